@@ -1,12 +1,23 @@
 import os
-from contextlib import asynccontextmanager
-from typing import Dict, Any, Optional
+import threading
+from collections import OrderedDict
+from contextlib import asynccontextmanager, contextmanager
+from typing import Dict, Any, Optional, Tuple
 
-import psycopg2
-from fastapi import FastAPI, HTTPException, Body
+from fastapi import FastAPI, HTTPException, Body, Request, Response
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
 from psycopg2 import extras
 
+from db_async import AsyncDatabasePool
+from db_pool import DatabasePool, run_read
+from migrations import migrate
+from provisioning import DEFAULT_CONFIG, DeviceProvisioner
+from versions import ContentVersions, conditional_get
+
+# 最多缓存多少台设备的配置，超出后淘汰最久未读的；device 来自查询参数，不能无限增长
+CONFIG_CACHE_MAX = int(os.getenv("CONFIG_CACHE_MAX", "1000"))
+
 DB_CONFIG = {
     "host": os.getenv("PG_HOST", "localhost"),
     "user": os.getenv("PG_USER", "kaguya"),
@@ -18,9 +29,29 @@ DB_CONFIG = {
 
 
 class ConfigService:
-    def __init__(self, db_config: Dict[str, Any] = None, db=None) -> None:
+    def __init__(
+        self,
+        db_config: Dict[str, Any] = None,
+        db=None,
+        pool: Optional[DatabasePool] = None,
+        async_pool: Optional[AsyncDatabasePool] = None,
+        versions: Optional[ContentVersions] = None,
+        provisioner: Optional[DeviceProvisioner] = None,
+    ) -> None:
         self.db_config = db_config or DB_CONFIG
         self._external_db = db
+        self._owns_pool = pool is None
+        self.pool = pool or DatabasePool(self.db_config)
+        self._owns_async_pool = async_pool is None
+        self.async_pool = async_pool or AsyncDatabasePool(self.db_config)
+        self.versions = versions or ContentVersions()
+        self.provisioner = provisioner or DeviceProvisioner()
+        # device -> (config 版本号, 配置)，不设过期时间：本进程的写入使版本前进后失效，
+        # 其他进程与触发器（经 NOTIFY）的变更到达时直接丢弃该设备的缓存，不论其版本号大小
+        self._cache: "OrderedDict[str, Tuple[int, Dict[str, str]]]" = OrderedDict()
+        # 通知回调在 LISTEN 线程中执行
+        self._cache_lock = threading.Lock()
+        self.versions.add_listener(self._on_change)
         self.app = FastAPI(lifespan=self._lifespan)
         self._configure_app()
         self._register_routes()
@@ -34,129 +65,103 @@ class ConfigService:
             allow_headers=["*"],
         )
 
-    def ensure_table(self, db) -> None:
-        create_sql = """
-        CREATE TABLE IF NOT EXISTS config (
-            key TEXT NOT NULL,
-            value TEXT NOT NULL,
-            device TEXT NOT NULL DEFAULT 'default'
-        );
-        """
-        alter_device_sql = """
-        ALTER TABLE config
-        ADD COLUMN IF NOT EXISTS device TEXT NOT NULL DEFAULT 'default'
-        """
-        drop_key_unique_sql = """
-        ALTER TABLE config
-        DROP CONSTRAINT IF EXISTS config_key_key
-        """
-        drop_key_pk_sql = """
-        ALTER TABLE config
-        DROP CONSTRAINT IF EXISTS config_pkey
-        """
-        add_unique_sql = """
-        DO $$
-        BEGIN
-            IF NOT EXISTS (
-                SELECT 1
-                FROM pg_constraint
-                WHERE conname = 'config_device_key_key'
-            ) THEN
-                ALTER TABLE config
-                ADD CONSTRAINT config_device_key_key UNIQUE (device, key);
-            END IF;
-        END $$;
-        """
-        insert_default_sql = """
-        INSERT INTO config (device, key, value)
-        VALUES
-            ('default', 'mode', 'default'),
-            ('default', 'notice_mode', 'text')
-        ON CONFLICT (device, key) DO NOTHING;
-        """
-        with db.cursor() as cur:
-            cur.execute(create_sql)
-            cur.execute(alter_device_sql)
-            cur.execute(drop_key_unique_sql)
-            cur.execute(drop_key_pk_sql)
-            cur.execute(add_unique_sql)
-            cur.execute(insert_default_sql)
-
     @asynccontextmanager
     async def _lifespan(self, app: FastAPI):
-        created_local = False
-        db = self._external_db
-        if db is None:
-            db = psycopg2.connect(**self.db_config)
-            db.set_client_encoding('UTF8')
-            db.autocommit = True
-            created_local = True
-        self.ensure_table(db)
-        app.state.db = db
+        if self._owns_pool:
+            # 独立运行时自行执行迁移；挂载到 main.py 时由主程序在启动时统一执行
+            with self.get_db() as db:
+                migrate(db)
+        if self._owns_async_pool:
+            await self.async_pool.open()
         try:
             yield
         finally:
-            if created_local:
-                try:
-                    db.close()
-                except Exception:
-                    pass
+            if self._owns_async_pool:
+                await self.async_pool.close()
+            if self._owns_pool:
+                self.pool.close()
 
+    @contextmanager
     def get_db(self):
-        db = getattr(self.app.state, "db", None)
-        if db is None or getattr(db, "closed", 1) != 0:
-            db = psycopg2.connect(**self.db_config)
-            db.set_client_encoding('UTF8')
-            db.autocommit = True
-            self.app.state.db = db
-            self.ensure_table(db)
-        else:
-            try:
-                with db.cursor() as cur:
-                    cur.execute("SELECT 1")
-            except Exception:
-                db = psycopg2.connect(**self.db_config)
-                db.set_client_encoding('UTF8')
-                db.autocommit = True
-                self.app.state.db = db
-                self.ensure_table(db)
-        return db
+        """按请求从连接池借出连接，离开上下文时归还"""
+        if self._external_db is not None:
+            yield self._external_db
+            return
+        with self.pool.connection() as db:
+            yield db
 
     def _ensure_device_defaults(self, db, device: str) -> None:
+        """首次写入时补齐默认配置行，本进程已初始化过的设备不再访问数据库"""
         with db.cursor() as cur:
-            cur.execute(
-                """
-                SELECT 1
-                FROM config
-                WHERE device = %s
-                LIMIT 1
-                """,
-                (device,),
-            )
-            if cur.fetchone() is None:
-                cur.execute(
-                    """
-                    INSERT INTO config (device, key, value)
-                    VALUES
-                        (%s, 'mode', 'default'),
-                        (%s, 'notice_mode', 'text')
-                    ON CONFLICT (device, key) DO NOTHING
-                    """,
-                    (device, device),
-                )
+            self.provisioner.ensure(cur, device)
+
+    def _on_change(self, device: str, resource: str, version: int, remote: bool) -> None:
+        if resource == "config" and remote:
+            with self._cache_lock:
+                self._cache.pop(device, None)
+
+    def _cached(self, device: str, version: int) -> Optional[Dict[str, str]]:
+        with self._cache_lock:
+            cached = self._cache.get(device)
+            if cached is None or cached[0] != version:
+                return None
+            self._cache.move_to_end(device)
+            return dict(cached[1])
+
+    def _remember(self, device: str, version: int, config: Dict[str, str]) -> None:
+        with self._cache_lock:
+            self._cache[device] = (version, config)
+            self._cache.move_to_end(device)
+            while len(self._cache) > CONFIG_CACHE_MAX:
+                self._cache.popitem(last=False)
+
+    def invalidate(self) -> None:
+        """丢弃全部缓存；变更通知连接重建后调用，断线期间错过的通知不会留下旧数据"""
+        with self._cache_lock:
+            self._cache.clear()
+
+    @staticmethod
+    def merge_defaults(rows) -> Dict[str, str]:
+        config = dict(DEFAULT_CONFIG)
+        config.update({r["key"]: r["value"] for r in rows})
+        return config
 
     def _register_routes(self) -> None:
         app = self.app
         get_db = self.get_db
 
+        def read_config(device: str) -> Dict[str, str]:
+            """同步读取路径：异步连接池不可用时使用"""
+
+            def query(db):
+                with db.cursor(cursor_factory=extras.RealDictCursor) as cur:
+                    cur.execute(
+                        """
+                        SELECT key, value
+                        FROM config
+                        WHERE device = %s
+                        ORDER BY key ASC
+                        """,
+                        (device,),
+                    )
+                    return self.merge_defaults(cur.fetchall())
+
+            return run_read(get_db, query)
+
         @app.get("/")
-        def get_config(device: str = "default") -> Dict[str, str]:
+        async def get_config(request: Request, response: Response, device: str = "default") -> Dict[str, str]:
             """获取所有配置项"""
+            # 先取版本再查库：查询期间若有写入，版本会前进，缓存随之失效
+            version = self.versions.get(device, "config")
+            not_modified = conditional_get(request, response, version)
+            if not_modified is not None:
+                return not_modified
+            cached = self._cached(device, version)
+            if cached is not None:
+                return cached
             try:
-                db = get_db()
-                self._ensure_device_defaults(db, device)
-                with db.cursor(cursor_factory=extras.RealDictCursor) as cur:
-                    cur.execute(
+                if self.async_pool.available:
+                    rows = await self.async_pool.fetch(
                         """
                         SELECT key, value
                         FROM config
@@ -165,10 +170,14 @@ class ConfigService:
                         """,
                         (device,),
                     )
-                    rows = cur.fetchall()
-                    return {r["key"]: r["value"] for r in rows}
+                    # 设备尚无配置行时以默认值补齐，读接口不写库
+                    config = self.merge_defaults(rows)
+                else:
+                    config = await run_in_threadpool(read_config, device)
             except Exception as e:
                 raise HTTPException(status_code=500, detail=f"查询失败: {str(e)}")
+            self._remember(device, version, config)
+            return dict(config)
 
         @app.put("/config/{key}")
         def update_config(
@@ -181,25 +190,26 @@ class ConfigService:
                 raise HTTPException(status_code=400, detail="配置key不能为空且必须为字符串")
             
             try:
-                db = get_db()
-                self._ensure_device_defaults(db, device)
-                with db.cursor() as cur:
-                    # 使用 UPSERT 语法：存在则更新，不存在则插入
-                    cur.execute(
-                        """
-                        INSERT INTO config (device, key, value)
-                        VALUES (%s, %s, %s)
-                        ON CONFLICT (device, key) DO UPDATE SET value = EXCLUDED.value
-                        RETURNING device, key, value
-                        """,
-                        (device, key, value)
-                    )
-                    updated_row = cur.fetchone()
-                    return {
-                        "success": True,
-                        "data": {"device": updated_row[0], "key": updated_row[1], "value": updated_row[2]},
-                        "message": "配置更新成功"
-                    }
+                with get_db() as db:
+                    self._ensure_device_defaults(db, device)
+                    with db.cursor() as cur:
+                        # 使用 UPSERT 语法：存在则更新，不存在则插入
+                        cur.execute(
+                            """
+                            INSERT INTO config (device, key, value)
+                            VALUES (%s, %s, %s)
+                            ON CONFLICT (device, key) DO UPDATE SET value = EXCLUDED.value
+                            RETURNING device, key, value
+                            """,
+                            (device, key, value)
+                        )
+                        updated_row = cur.fetchone()
+                        self.versions.bump(device, "config")
+                        return {
+                            "success": True,
+                            "data": {"device": updated_row[0], "key": updated_row[1], "value": updated_row[2]},
+                            "message": "配置更新成功"
+                        }
             except Exception as e:
                 raise HTTPException(status_code=500, detail=f"更新失败: {str(e)}")
 
@@ -214,28 +224,30 @@ class ConfigService:
                 raise HTTPException(status_code=400, detail="批量配置数据不能为空且必须为字典格式")
             
             try:
-                db = get_db()
-                self._ensure_device_defaults(db, device)
-                updated_count = 0
-                with db.cursor() as cur:
-                    for key, value in configs.items():
-                        if not key or not isinstance(value, str):
-                            continue  # 跳过无效的配置项
-                        cur.execute(
-                            """
-                            INSERT INTO config (device, key, value)
-                            VALUES (%s, %s, %s)
-                            ON CONFLICT (device, key) DO UPDATE SET value = EXCLUDED.value
-                            """,
-                            (device, key, value)
-                        )
-                        updated_count += 1
-                
-                return {
-                    "success": True,
-                    "updated_count": updated_count,
-                    "message": f"批量更新完成，共处理 {updated_count} 个配置项"
-                }
+                with get_db() as db:
+                    self._ensure_device_defaults(db, device)
+                    updated_count = 0
+                    with db.cursor() as cur:
+                        for key, value in configs.items():
+                            if not key or not isinstance(value, str):
+                                continue  # 跳过无效的配置项
+                            cur.execute(
+                                """
+                                INSERT INTO config (device, key, value)
+                                VALUES (%s, %s, %s)
+                                ON CONFLICT (device, key) DO UPDATE SET value = EXCLUDED.value
+                                """,
+                                (device, key, value)
+                            )
+                            updated_count += 1
+                    if updated_count:
+                        self.versions.bump(device, "config")
+
+                    return {
+                        "success": True,
+                        "updated_count": updated_count,
+                        "message": f"批量更新完成，共处理 {updated_count} 个配置项"
+                    }
             except Exception as e:
                 raise HTTPException(status_code=500, detail=f"批量更新失败: {str(e)}")
 
@@ -243,21 +255,22 @@ class ConfigService:
         def delete_config(key: str, device: str = "default") -> Dict[str, Any]:
             """删除指定key的配置项（可选补充）"""
             try:
-                db = get_db()
-                self._ensure_device_defaults(db, device)
-                with db.cursor() as cur:
-                    cur.execute(
-                        "DELETE FROM config WHERE device = %s AND key = %s RETURNING key",
-                        (device, key),
-                    )
-                    deleted_row = cur.fetchone()
-                    if not deleted_row:
-                        raise HTTPException(status_code=404, detail=f"配置项 {key} 不存在")
-                    
-                    return {
-                        "success": True,
-                        "message": f"配置项 {key} 删除成功"
-                    }
+                with get_db() as db:
+                    self._ensure_device_defaults(db, device)
+                    with db.cursor() as cur:
+                        cur.execute(
+                            "DELETE FROM config WHERE device = %s AND key = %s RETURNING key",
+                            (device, key),
+                        )
+                        deleted_row = cur.fetchone()
+                        if not deleted_row:
+                            raise HTTPException(status_code=404, detail=f"配置项 {key} 不存在")
+                        self.versions.bump(device, "config")
+
+                        return {
+                            "success": True,
+                            "message": f"配置项 {key} 删除成功"
+                        }
             except HTTPException:
                 raise
             except Exception as e:
@@ -0,0 +1,148 @@
+import hashlib
+import os
+import threading
+import uuid
+from typing import Dict, Optional
+
+# 上传的媒体按内容的 SHA-256 存放在媒体目录下的该子目录中
+CONTENT_STORE_SUBDIR = os.getenv("CONTENT_STORE_SUBDIR", ".store")
+_READ_BUFFER_BYTES = 1024 * 1024
+
+
+def hash_file(path: str) -> "hashlib._Hash":
+    """整个文件的 SHA-256，返回尚可继续 update() 的哈希对象"""
+    hasher = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(_READ_BUFFER_BYTES), b""):
+            hasher.update(block)
+    return hasher
+
+
+class ContentStore:
+    """按内容哈希存放的媒体文件。
+
+    同样的内容只存一份（<root>/.store/<前两位>/<sha256>），媒体目录中的文件名都是指向它的硬链接：
+    公开地址与静态服务器不受影响，重复上传不占额外磁盘，派生文件以哈希为键也不会重复生成。
+    对象的链接数降到 1（只剩存储本身）即无人引用，随即删除。
+    所在文件系统不支持硬链接时关闭去重，收到的文件直接改名为目标文件，同样只占一份磁盘。
+    文件名到哈希的对应关系靠 inode 找回，首次使用时扫描一遍存储目录。
+    """
+
+    def __init__(self, root: str, subdir: str = CONTENT_STORE_SUBDIR) -> None:
+        self.root = root
+        self.directory = os.path.join(root, subdir)
+        self._lock = threading.Lock()
+        # 存入与释放整体串行：否则释放方刚判定对象无人引用，存入方正要为它建链接，对象就被删掉了
+        self._store_lock = threading.RLock()
+        self._inodes: Optional[Dict[int, str]] = None
+        # 首次建硬链接失败后置为 False，此后不再经过存储目录
+        self._hardlinks = True
+
+    def path_for(self, digest: str) -> str:
+        return os.path.join(self.directory, digest[:2], digest)
+
+    def _load_inodes(self) -> Dict[int, str]:
+        if self._inodes is not None:
+            return self._inodes
+        inodes: Dict[int, str] = {}
+        if os.path.isdir(self.directory):
+            for bucket in os.scandir(self.directory):
+                if not bucket.is_dir():
+                    continue
+                for entry in os.scandir(bucket.path):
+                    try:
+                        inodes[os.stat(entry.path).st_ino] = entry.name
+                    except OSError:
+                        continue
+        self._inodes = inodes
+        return inodes
+
+    def digest_of(self, ino: int) -> Optional[str]:
+        """文件名对应的内容哈希；不经上传接口放入的文件不在存储中，返回 None"""
+        if not ino:
+            return None
+        with self._lock:
+            return self._load_inodes().get(ino)
+
+    def _put(self, tmp: str, digest: str) -> None:
+        path = self.path_for(digest)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        if os.path.exists(path):
+            # 已有同样内容，新上传的这份直接丢弃（重试存入时可能早已移走）
+            if os.path.exists(tmp):
+                os.remove(tmp)
+        else:
+            os.replace(tmp, path)
+        ino = os.stat(path).st_ino
+        with self._lock:
+            self._load_inodes()[ino] = digest
+
+    def _link(self, digest: str, target: str, replace: bool) -> bool:
+        source = self.path_for(digest)
+        try:
+            os.link(source, target)
+            return True
+        except FileExistsError:
+            if not replace or os.path.samefile(source, target):
+                return False
+        except OSError:
+            # 不支持硬链接：关闭去重，把对象本身改名为目标文件，不在存储目录里留第二份
+            self._hardlinks = False
+            if os.path.exists(target) and not replace:
+                return False
+            ino = os.stat(source).st_ino
+            os.replace(source, target)
+            with self._lock:
+                self._load_inodes().pop(ino, None)
+            return True
+        # 先在旁边建好链接再改名覆盖，读者看到的总是完整的旧文件或新文件
+        tmp = os.path.join(self.root, f".{uuid.uuid4().hex}.tmp")
+        os.link(source, tmp)
+        os.replace(tmp, target)
+        return True
+
+    @staticmethod
+    def _move(tmp: str, target: str, replace: bool) -> bool:
+        if os.path.exists(target) and not replace:
+            os.remove(tmp)
+            return False
+        os.replace(tmp, target)
+        return True
+
+    def release(self, digest: str) -> None:
+        """没有文件名再引用该对象时删除它"""
+        path = self.path_for(digest)
+        with self._store_lock:
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                return
+            if stat.st_nlink > 1:
+                return
+            os.remove(path)
+            with self._lock:
+                self._load_inodes().pop(stat.st_ino, None)
+
+    def store(self, tmp: str, digest: str, name: str, replace: bool = False) -> bool:
+        """把已算好哈希的临时文件存入并以 name 引用，返回 name 是否指向了新内容。
+
+        name 已存在时：replace 为 False 则保留原文件；为 True 则原子地换成新内容，
+        旧内容若不再被引用即删除。
+        """
+        target = os.path.join(self.root, name)
+        with self._store_lock:
+            if not self._hardlinks:
+                return self._move(tmp, target, replace)
+            previous = None
+            if replace:
+                try:
+                    previous = self.digest_of(os.stat(target).st_ino)
+                except FileNotFoundError:
+                    pass
+            self._put(tmp, digest)
+            stored = self._link(digest, target, replace)
+            if not stored:
+                self.release(digest)
+            elif previous is not None and previous != digest:
+                self.release(previous)
+            return stored
@@ -1,13 +1,21 @@
-from fastapi import FastAPI, HTTPException
-from contextlib import asynccontextmanager
+from fastapi import FastAPI, HTTPException, Request, Response
+from fastapi.concurrency import run_in_threadpool
+from contextlib import asynccontextmanager, contextmanager
 from pydantic import BaseModel
-from typing import Optional, List, Dict, Any
+from typing import Optional, List, Dict, Any, Tuple, Literal, Set
 from fastapi.staticfiles import StaticFiles
 from fastapi.middleware.cors import CORSMiddleware
 import os
-import psycopg2
+import threading
+from collections import OrderedDict
 from psycopg2 import extras
 from datetime import datetime, date
+from zoneinfo import ZoneInfo
+
+from db_async import AsyncDatabasePool
+from db_pool import DatabasePool, run_read
+from migrations import migrate
+from versions import ContentVersions, conditional_get
 
 DB_CONFIG = {
     "host": os.getenv("PG_HOST", "localhost"),
@@ -18,6 +26,43 @@ DB_CONFIG = {
     "client_encoding": "UTF-8",
 }
 
+# 判断"今天"所用的时区，留空时使用服务器本地时区；应与数据库的 TimeZone 设置一致，
+# 因为 time 列按数据库会话时区换算成日期（time::date）
+DAYS_TIMEZONE = os.getenv("DAYS_TIMEZONE", "")
+# 倒数日结果缓存的设备数上限，超出后淘汰最久未使用的设备
+DAYS_CACHE_MAX = int(os.getenv("DAYS_CACHE_MAX", "1000"))
+
+
+def _load_timezone():
+    if not DAYS_TIMEZONE:
+        return None
+    try:
+        return ZoneInfo(DAYS_TIMEZONE)
+    except Exception:
+        print(f"无法识别时区 {DAYS_TIMEZONE}，改用服务器本地时区")
+        return None
+
+
+LOCAL_TZ = _load_timezone()
+
+
+def local_today() -> date:
+    return datetime.now(LOCAL_TZ).date()
+
+
+def annotate_days(items: List[dict], today: date) -> List[dict]:
+    """为已序列化的倒数日补充剩余天数与是否已过期"""
+    for item in items:
+        delta = (date.fromisoformat(item["time"]) - today).days
+        item["days_left"] = max(delta, 0)
+        item["is_today"] = delta == 0
+        item["is_past"] = delta < 0
+    return items
+
+
+def visible_days(items: List[dict], hide_expired: bool) -> List[dict]:
+    return [item for item in items if not item["is_past"]] if hide_expired else items
+
 
 class DaysMasterCreate(BaseModel):
     device: str = "default"
@@ -31,11 +76,43 @@ class DaysMasterUpdate(BaseModel):
     time: Optional[date] = None
 
 
+class DaysBatchOperation(BaseModel):
+    op: Literal["create", "update", "delete"]
+    id: Optional[int] = None
+    device: str = "default"
+    # 仅 create：同一条倒数日写入多个设备，提供时忽略 device
+    devices: Optional[List[str]] = None
+    content: Optional[str] = None
+    time: Optional[date] = None
+
+
+class DaysBatchRequest(BaseModel):
+    operations: List[DaysBatchOperation]
+
+
 class DaysMaster:
-    def __init__(self, db_config: Dict[str, Any] = None, public_dir: str = "public", db=None) -> None:
+    def __init__(
+        self,
+        db_config: Dict[str, Any] = None,
+        public_dir: str = "public",
+        db=None,
+        pool: Optional[DatabasePool] = None,
+        async_pool: Optional[AsyncDatabasePool] = None,
+        versions: Optional[ContentVersions] = None,
+    ) -> None:
         self.db_config = db_config or DB_CONFIG
         self.public_dir = public_dir
         self._external_db = db
+        self._owns_pool = pool is None
+        self.pool = pool or DatabasePool(self.db_config)
+        self._owns_async_pool = async_pool is None
+        self.async_pool = async_pool or AsyncDatabasePool(self.db_config)
+        self.versions = versions or ContentVersions()
+        # device -> (days 版本号, 计算日期, 结果)，按最近使用排序；写入或跨过本地零点后失效
+        self._cache: "OrderedDict[str, Tuple[int, date, List[dict]]]" = OrderedDict()
+        # 通知回调在 LISTEN 线程中执行
+        self._cache_lock = threading.Lock()
+        self.versions.add_listener(self._on_change)
         self.app = FastAPI(lifespan=self._lifespan)
         self._configure_app()
         self._register_routes()
@@ -50,63 +127,51 @@ class DaysMaster:
         )
         self.app.mount("/public", StaticFiles(directory=self.public_dir), name="public")
 
-    def ensure_table(self, db) -> None:
-        sql = """
-        CREATE TABLE IF NOT EXISTS days_master (
-            id BIGSERIAL PRIMARY KEY,
-            content TEXT NOT NULL,
-            time TIMESTAMPTZ NOT NULL,
-            device TEXT NOT NULL DEFAULT 'default'
-        );
-        """
-        alter_device_sql = """
-        ALTER TABLE days_master
-        ADD COLUMN IF NOT EXISTS device TEXT NOT NULL DEFAULT 'default'
-        """
-        with db.cursor() as cur:
-            cur.execute(sql)
-            cur.execute(alter_device_sql)
+    def _on_change(self, device: str, resource: str, version: int, remote: bool) -> None:
+        if resource == "days":
+            with self._cache_lock:
+                self._cache.pop(device, None)
+
+    def _cached(self, device: str, version: int, today: date) -> Optional[List[dict]]:
+        with self._cache_lock:
+            cached = self._cache.get(device)
+            if cached is None or cached[0] != version or cached[1] != today:
+                return None
+            self._cache.move_to_end(device)
+            return cached[2]
+
+    def _remember(self, device: str, version: int, today: date, items: List[dict]) -> None:
+        with self._cache_lock:
+            self._cache[device] = (version, today, items)
+            self._cache.move_to_end(device)
+            while len(self._cache) > DAYS_CACHE_MAX:
+                self._cache.popitem(last=False)
 
     @asynccontextmanager
     async def _lifespan(self, app: FastAPI):
-        created_local = False
-        db = self._external_db
-        if db is None:
-            db = psycopg2.connect(**self.db_config)
-            db.set_client_encoding('UTF8')
-            db.autocommit = True
-            created_local = True
-        self.ensure_table(db)
-        app.state.db = db
+        if self._owns_pool:
+            # 独立运行时自行执行迁移；挂载到 main.py 时由主程序在启动时统一执行
+            with self.get_db() as db:
+                migrate(db)
+        if self._owns_async_pool:
+            await self.async_pool.open()
         print("PostgreSQL 数据库连接成功并已确保表存在！")
         try:
             yield
         finally:
-            if created_local:
-                try:
-                    db.close()
-                except Exception:
-                    pass
+            if self._owns_async_pool:
+                await self.async_pool.close()
+            if self._owns_pool:
+                self.pool.close()
 
+    @contextmanager
     def get_db(self):
-        db = getattr(self.app.state, "db", None)
-        if db is None or getattr(db, "closed", 1) != 0:
-            db = psycopg2.connect(**self.db_config)
-            db.set_client_encoding('UTF8')
-            db.autocommit = True
-            self.app.state.db = db
-            self.ensure_table(db)
-        else:
-            try:
-                with db.cursor() as cur:
-                    cur.execute("SELECT 1")
-            except Exception:
-                db = psycopg2.connect(**self.db_config)
-                db.set_client_encoding('UTF8')
-                db.autocommit = True
-                self.app.state.db = db
-                self.ensure_table(db)
-        return db
+        """按请求从连接池借出连接，离开上下文时归还"""
+        if self._external_db is not None:
+            yield self._external_db
+            return
+        with self.pool.connection() as db:
+            yield db
 
     def _ensure_device_placeholder(self, db, device: str) -> None:
         with db.cursor() as cur:
@@ -132,73 +197,107 @@ class DaysMaster:
     def serialize_row(row: dict) -> dict:
         t = row.get("time")
         if isinstance(t, datetime):
-            row["time"] = t.date().isoformat()
+            t = t.date().isoformat()
         elif isinstance(t, date):
-            row["time"] = t.isoformat()
-        return {"id": row["id"], "content": row["content"], "time": row["time"]}
+            t = t.isoformat()
+        return {"id": row["id"], "content": row["content"], "time": t}
 
     def _register_routes(self) -> None:
         app = self.app
         get_db = self.get_db
         serialize_row = self.serialize_row
 
-        @app.get("/")
-        def get_all_daysmaster(device: str = "default") -> List[dict]:
-            """返回所有倒数日，按结束时间升序"""
-            try:
-                db = get_db()
-                self._ensure_device_placeholder(db, device)
+        def read_daysmaster(device: str) -> List[dict]:
+            """同步读取路径：异步连接池不可用时使用"""
+
+            def query(db):
                 with db.cursor(cursor_factory=extras.RealDictCursor) as cur:
                     cur.execute(
                         """
-                        SELECT id, content, time
+                        SELECT id, content, time::date AS time
                         FROM days_master
                         WHERE device = %s
-                        ORDER BY time ASC
+                        ORDER BY days_master.time ASC
                         """,
                         (device,),
                     )
                     rows = cur.fetchall()
                     return [serialize_row(r) for r in rows]
+
+            return run_read(get_db, query)
+
+        async def load_days(device: str, today: date) -> List[dict]:
+            """带剩余天数的倒数日列表，按设备缓存到下一次写入或本地零点"""
+            # 先取版本再查库：查询期间若有写入，版本会前进，缓存随之失效
+            version = self.versions.get(device, "days")
+            cached = self._cached(device, version, today)
+            if cached is not None:
+                return cached
+            if self.async_pool.available:
+                rows = await self.async_pool.fetch(
+                    """
+                    SELECT id, content, time::date AS time
+                    FROM days_master
+                    WHERE device = %s
+                    ORDER BY days_master.time ASC
+                    """,
+                    (device,),
+                )
+                items = [serialize_row(r) for r in rows]
+            else:
+                items = await run_in_threadpool(read_daysmaster, device)
+            items = annotate_days(items, today)
+            self._remember(device, version, today, items)
+            return items
+
+        @app.get("/")
+        async def get_all_daysmaster(
+            request: Request,
+            response: Response,
+            device: str = "default",
+            hide_expired: bool = False,
+        ) -> List[dict]:
+            """
+            返回所有倒数日，按结束时间升序
+            - 每项附带 days_left（剩余天数，已过期为 0）、is_today、is_past
+            - hide_expired: 不返回已过期的倒数日
+            """
+            today = local_today()
+            # 剩余天数随日期变化，ETag 同时取决于内容版本与当天日期
+            tag = f"{self.versions.get(device, 'days')}-{today.isoformat()}"
+            not_modified = conditional_get(request, response, tag)
+            if not_modified is not None:
+                return not_modified
+            try:
+                return visible_days(await load_days(device, today), hide_expired)
             except Exception as e:
                 raise HTTPException(status_code=500, detail=f"查询失败: {str(e)}")
 
         @app.get("/list")
-        def list_daysmaster(device: str = "default") -> List[dict]:
+        async def list_daysmaster(device: str = "default", hide_expired: bool = False) -> List[dict]:
             """列出所有倒数日，按结束日期升序"""
             try:
-                db = get_db()
-                self._ensure_device_placeholder(db, device)
-                with db.cursor(cursor_factory=extras.RealDictCursor) as cur:
-                    cur.execute(
-                        """
-                        SELECT id, content, time
-                        FROM days_master
-                        WHERE device = %s
-                        ORDER BY time ASC
-                        """,
-                        (device,),
-                    )
-                    rows = cur.fetchall()
-                    return [serialize_row(r) for r in rows]
+                return visible_days(await load_days(device, local_today()), hide_expired)
             except Exception as e:
                 raise HTTPException(status_code=500, detail=f"查询失败: {str(e)}")
 
         @app.get("/{item_id}")
         def get_daysmaster(item_id: int, device: str = "default"):
             """获取指定 id 的倒数日"""
-            try:
-                db = get_db()
-                self._ensure_device_placeholder(db, device)
+
+            def query(db):
                 with db.cursor(cursor_factory=extras.RealDictCursor) as cur:
                     cur.execute(
-                        "SELECT id, content, time FROM days_master WHERE id = %s AND device = %s",
+                        "SELECT id, content, time::date AS time FROM days_master WHERE id = %s AND device = %s",
                         (item_id, device),
                     )
                     row = cur.fetchone()
                     if not row:
                         raise HTTPException(status_code=404, detail="未找到该倒数日")
                     return serialize_row(row)
+
+            try:
+                return run_read(get_db, query)
             except Exception as e:
                 raise HTTPException(status_code=500, detail=f"查询失败: {str(e)}")
 
@@ -206,19 +305,20 @@ class DaysMaster:
         def create_daysmaster(payload: DaysMasterCreate):
             """新增倒数日"""
             try:
-                db = get_db()
-                self._ensure_device_placeholder(db, payload.device)
-                with db.cursor(cursor_factory=extras.RealDictCursor) as cur:
-                    cur.execute(
-                        """
-                        INSERT INTO days_master(content, time, device)
-                        VALUES (%s, %s, %s)
-                        RETURNING id, content, time
-                        """,
-                        (payload.content, payload.time, payload.device),
-                    )
-                    row = cur.fetchone()
-                    return serialize_row(row)
+                with get_db() as db:
+                    self._ensure_device_placeholder(db, payload.device)
+                    with db.cursor(cursor_factory=extras.RealDictCursor) as cur:
+                        cur.execute(
+                            """
+                            INSERT INTO days_master(content, time, device)
+                            VALUES (%s, %s, %s)
+                            RETURNING id, content, time::date AS time
+                            """,
+                            (payload.content, payload.time, payload.device),
+                        )
+                        row = cur.fetchone()
+                        self.versions.bump(payload.device, "days")
+                        return serialize_row(row)
             except Exception as e:
                 raise HTTPException(status_code=500, detail=f"新增失败: {str(e)}")
 
@@ -238,37 +338,142 @@ class DaysMaster:
                 if not sets:
                     raise HTTPException(status_code=400, detail="未提供需更新的字段")
 
-                sql = f"UPDATE days_master SET {', '.join(sets)} WHERE id = %s AND device = %s RETURNING id, content, time"
+                sql = f"UPDATE days_master SET {', '.join(sets)} WHERE id = %s AND device = %s RETURNING id, content, time::date AS time"
                 values.append(item_id)
                 values.append(device)
 
-                db = get_db()
-                self._ensure_device_placeholder(db, device)
-                with db.cursor(cursor_factory=extras.RealDictCursor) as cur:
-                    cur.execute(sql, tuple(values))
-                    row = cur.fetchone()
-                    if not row:
-                        raise HTTPException(status_code=404, detail="未找到该倒数日")
-                    return serialize_row(row)
+                with get_db() as db:
+                    self._ensure_device_placeholder(db, device)
+                    with db.cursor(cursor_factory=extras.RealDictCursor) as cur:
+                        cur.execute(sql, tuple(values))
+                        row = cur.fetchone()
+                        if not row:
+                            raise HTTPException(status_code=404, detail="未找到该倒数日")
+                        self.versions.bump(device, "days")
+                        return serialize_row(row)
             except HTTPException:
                 raise
             except Exception as e:
                 raise HTTPException(status_code=500, detail=f"更新失败: {str(e)}")
 
+        @app.post("/batch")
+        def batch_daysmaster(payload: DaysBatchRequest) -> Dict[str, Any]:
+            """
+            批量新增/编辑/删除倒数日，可跨多个设备
+            每种操作合并为一条多行语句，全部在同一事务中执行，任一失败则整体回滚
+            返回格式: {"created": [...], "updated": [...], "deleted": [...], "not_found": [...]}
+            """
+            creates: List[Tuple[str, date, str]] = []
+            updates: List[Tuple[int, str, Optional[str], Optional[date]]] = []
+            deletes: List[Tuple[int, str]] = []
+            for index, item in enumerate(payload.operations):
+                if item.op == "create":
+                    if not item.content or item.time is None:
+                        raise HTTPException(status_code=400, detail=f"第 {index + 1} 项：新增需提供 content 与 time")
+                    for device in item.devices or [item.device]:
+                        creates.append((item.content, item.time, device))
+                elif item.id is None:
+                    raise HTTPException(status_code=400, detail=f"第 {index + 1} 项：{item.op} 需提供 id")
+                elif item.op == "update":
+                    if item.content is None and item.time is None:
+                        raise HTTPException(status_code=400, detail=f"第 {index + 1} 项：未提供需更新的字段")
+                    updates.append((item.id, item.device, item.content, item.time))
+                else:
+                    deletes.append((item.id, item.device))
+            if not (creates or updates or deletes):
+                raise HTTPException(status_code=400, detail="操作列表不能为空")
+
+            created: List[dict] = []
+            updated: List[dict] = []
+            deleted: List[dict] = []
+            try:
+                with get_db() as db:
+                    db.autocommit = False
+                    try:
+                        with db.cursor(cursor_factory=extras.RealDictCursor) as cur:
+                            if creates:
+                                created = extras.execute_values(
+                                    cur,
+                                    """
+                                    INSERT INTO days_master (content, time, device)
+                                    VALUES %s
+                                    RETURNING id, device, content, time::date AS time
+                                    """,
+                                    creates,
+                                    page_size=len(creates),
+                                    fetch=True,
+                                )
+                            if updates:
+                                updated = extras.execute_values(
+                                    cur,
+                                    """
+                                    UPDATE days_master AS d
+                                    SET content = COALESCE(v.content, d.content),
+                                        time = COALESCE(v.time, d.time)
+                                    FROM (VALUES %s) AS v(id, device, content, time)
+                                    WHERE d.id = v.id AND d.device = v.device
+                                    RETURNING d.id, d.device, d.content, d.time::date AS time
+                                    """,
+                                    updates,
+                                    template="(%s::bigint, %s::text, %s::text, %s::timestamptz)",
+                                    page_size=len(updates),
+                                    fetch=True,
+                                )
+                            if deletes:
+                                deleted = extras.execute_values(
+                                    cur,
+                                    """
+                                    DELETE FROM days_master AS d
+                                    USING (VALUES %s) AS v(id, device)
+                                    WHERE d.id = v.id AND d.device = v.device
+                                    RETURNING d.id, d.device
+                                    """,
+                                    deletes,
+                                    template="(%s::bigint, %s::text)",
+                                    page_size=len(deletes),
+                                    fetch=True,
+                                )
+                        db.commit()
+                    except Exception:
+                        db.rollback()
+                        raise
+                    finally:
+                        db.autocommit = True
+            except Exception as e:
+                raise HTTPException(status_code=500, detail=f"批量操作失败: {str(e)}")
+
+            touched: Set[str] = {r["device"] for r in created + updated + deleted}
+            for device in touched:
+                self.versions.bump(device, "days")
+
+            matched = {(r["id"], r["device"]) for r in updated + deleted}
+            return {
+                "created": [{**serialize_row(r), "device": r["device"]} for r in created],
+                "updated": [{**serialize_row(r), "device": r["device"]} for r in updated],
+                "deleted": [{"id": r["id"], "device": r["device"]} for r in deleted],
+                "not_found": [
+                    {"op": op, "id": item_id, "device": device}
+                    for op, rows in (("update", updates), ("delete", deletes))
+                    for item_id, device, *_ in rows
+                    if (item_id, device) not in matched
+                ],
+            }
+
         @app.delete("/{item_id}")
         def delete_daysmaster(item_id: int, device: str = "default"):
             """删除倒数日"""
             try:
-                db = get_db()
-                self._ensure_device_placeholder(db, device)
-                with db.cursor() as cur:
-                    cur.execute(
-                        "DELETE FROM days_master WHERE id = %s AND device = %s",
-                        (item_id, device),
-                    )
-                    if cur.rowcount == 0:
-                        raise HTTPException(status_code=404, detail="未找到该倒数日")
-                return {"status": "ok", "deleted_id": item_id}
+                with get_db() as db:
+                    self._ensure_device_placeholder(db, device)
+                    with db.cursor() as cur:
+                        cur.execute(
+                            "DELETE FROM days_master WHERE id = %s AND device = %s",
+                            (item_id, device),
+                        )
+                        if cur.rowcount == 0:
+                            raise HTTPException(status_code=404, detail="未找到该倒数日")
+                    self.versions.bump(device, "days")
+                    return {"status": "ok", "deleted_id": item_id}
             except HTTPException:
                 raise
             except Exception as e:
@@ -0,0 +1,97 @@
+import logging
+import os
+import re
+from typing import Any, Dict, List, Optional, Sequence
+
+from db_pool import DAEMON_APPLICATION_NAME
+
+try:
+    import asyncpg
+except ImportError:  # asyncpg 为可选依赖，未安装时各服务自动回退到同步连接池
+    asyncpg = None
+
+logger = logging.getLogger(__name__)
+
+PG_ASYNC_ENABLED = os.getenv("PG_ASYNC_ENABLED", "1") != "0"
+PG_ASYNC_POOL_MIN = int(os.getenv("PG_ASYNC_POOL_MIN", "2"))
+PG_ASYNC_POOL_MAX = int(os.getenv("PG_ASYNC_POOL_MAX", "20"))
+
+_PLACEHOLDER = re.compile(r"%%|%s")
+
+
+def to_asyncpg_sql(sql: str) -> str:
+    """把 psycopg2 风格的 %s 占位符转换为 asyncpg 的 $1, $2 ..."""
+    counter = 0
+
+    def replace(match: "re.Match[str]") -> str:
+        nonlocal counter
+        if match.group(0) == "%%":
+            return "%"
+        counter += 1
+        return f"${counter}"
+
+    return _PLACEHOLDER.sub(replace, sql)
+
+
+class AsyncDatabasePool:
+    """基于 asyncpg 的异步连接池，供屏幕端高频 GET 接口在事件循环内直接查询。
+
+    asyncpg 未安装、被 PG_ASYNC_ENABLED=0 关闭或连接失败时 available 为 False，
+    调用方应回退到同步连接池。SQL 统一使用 psycopg2 的 %s 写法。
+    """
+
+    def __init__(
+        self,
+        db_config: Dict[str, Any],
+        min_size: Optional[int] = None,
+        max_size: Optional[int] = None,
+    ) -> None:
+        self.db_config = db_config
+        self.min_size = PG_ASYNC_POOL_MIN if min_size is None else min_size
+        self.max_size = PG_ASYNC_POOL_MAX if max_size is None else max_size
+        self._pool = None
+
+    @property
+    def available(self) -> bool:
+        return self._pool is not None
+
+    async def open(self) -> None:
+        if self._pool is not None or asyncpg is None or not PG_ASYNC_ENABLED:
+            return
+        try:
+            self._pool = await asyncpg.create_pool(
+                host=self.db_config.get("host"),
+                port=self.db_config.get("port"),
+                user=self.db_config.get("user"),
+                password=self.db_config.get("password"),
+                database=self.db_config.get("dbname"),
+                min_size=self.min_size,
+                max_size=self.max_size,
+                server_settings={"application_name": DAEMON_APPLICATION_NAME},
+            )
+        except Exception as e:
+            logger.warning(f"异步连接池创建失败，回退到同步连接池: {e}")
+            self._pool = None
+
+    async def close(self) -> None:
+        pool, self._pool = self._pool, None
+        if pool is not None:
+            await pool.close()
+
+    async def _run(self, method: str, sql: str, params: Sequence[Any]):
+        query = to_asyncpg_sql(sql)
+        try:
+            async with self._pool.acquire() as conn:
+                return await getattr(conn, method)(query, *params)
+        except (asyncpg.PostgresConnectionError, asyncpg.InterfaceError, ConnectionError, OSError):
+            # 连接在查询时失效：这些接口都是幂等读，换一个连接重试一次
+            async with self._pool.acquire() as conn:
+                return await getattr(conn, method)(query, *params)
+
+    async def fetch(self, sql: str, params: Sequence[Any] = ()) -> List[Dict[str, Any]]:
+        rows = await self._run("fetch", sql, params)
+        return [dict(r) for r in rows]
+
+    async def fetchrow(self, sql: str, params: Sequence[Any] = ()) -> Optional[Dict[str, Any]]:
+        row = await self._run("fetchrow", sql, params)
+        return dict(row) if row is not None else None
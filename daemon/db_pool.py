@@ -0,0 +1,226 @@
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Optional
+
+import psycopg2
+from psycopg2 import pool as pg_pool
+
+PG_POOL_MIN = int(os.getenv("PG_POOL_MIN", "2"))
+PG_POOL_MAX = int(os.getenv("PG_POOL_MAX", "20"))
+PG_POOL_TIMEOUT = float(os.getenv("PG_POOL_TIMEOUT", "10"))
+# 后台保活间隔（秒），0 表示关闭；开启后定期探测空闲连接并剔除失效连接
+PG_KEEPALIVE_INTERVAL = float(os.getenv("PG_KEEPALIVE_INTERVAL", "0"))
+
+# libpq TCP keepalive，让内核尽早发现被防火墙/NAT 静默断开的连接
+TCP_KEEPALIVE_OPTIONS = {
+    "keepalives": 1,
+    "keepalives_idle": 60,
+    "keepalives_interval": 10,
+    "keepalives_count": 3,
+}
+
+# 本程序连接的 application_name；config 表的变更触发器据此跳过本程序的写入（写接口自己会发通知）
+DAEMON_APPLICATION_NAME = "kaguya-daemon"
+
+# 连接已失效（而非语句本身出错）时 psycopg2 抛出的异常
+CONNECTION_ERRORS = (psycopg2.OperationalError, psycopg2.InterfaceError)
+
+
+def run_read(get_db, query: Callable[[Any], Any]) -> Any:
+    """执行幂等读操作；若连接在执行时失效，换一个新连接重试一次"""
+    try:
+        with get_db() as db:
+            return query(db)
+    except psycopg2.extensions.QueryCanceledError:
+        raise
+    except CONNECTION_ERRORS:
+        with get_db() as db:
+            return query(db)
+
+
+class DatabasePool:
+    """进程级 PostgreSQL 连接池，供所有服务共享，按请求借出、归还连接。"""
+
+    def __init__(
+        self,
+        db_config: Dict[str, Any],
+        minconn: Optional[int] = None,
+        maxconn: Optional[int] = None,
+        timeout: Optional[float] = None,
+    ) -> None:
+        self.db_config = db_config
+        self.connect_kwargs = {**TCP_KEEPALIVE_OPTIONS, "application_name": DAEMON_APPLICATION_NAME, **db_config}
+        self.minconn = PG_POOL_MIN if minconn is None else minconn
+        self.maxconn = PG_POOL_MAX if maxconn is None else maxconn
+        self.timeout = PG_POOL_TIMEOUT if timeout is None else timeout
+        if self.maxconn < 1 or self.minconn < 0 or self.minconn > self.maxconn:
+            raise ValueError(f"连接池大小配置无效: min={self.minconn}, max={self.maxconn}")
+        self._pool: Optional[pg_pool.ThreadedConnectionPool] = None
+        self._lock = threading.Lock()
+        # ThreadedConnectionPool 耗尽时直接抛错，这里用信号量让请求排队等待空闲连接
+        self._slots = threading.BoundedSemaphore(self.maxconn)
+        self._in_use = 0
+        self._checkouts = 0
+        self._waits = 0
+        self._timeouts = 0
+        self._discarded = 0
+        self._wait_seconds = 0.0
+        self._keepalive_stop = threading.Event()
+        self._keepalive_thread: Optional[threading.Thread] = None
+
+    def _ensure_pool(self) -> pg_pool.ThreadedConnectionPool:
+        if self._pool is None:
+            with self._lock:
+                if self._pool is None:
+                    self._pool = pg_pool.ThreadedConnectionPool(
+                        self.minconn, self.maxconn, **self.connect_kwargs
+                    )
+        return self._pool
+
+    def open(self) -> None:
+        """预先建立最小连接数"""
+        self._ensure_pool()
+
+    def close(self) -> None:
+        self.stop_keepalive()
+        with self._lock:
+            if self._pool is not None:
+                try:
+                    self._pool.closeall()
+                except Exception:
+                    pass
+                self._pool = None
+
+    @staticmethod
+    def _prepare(db) -> None:
+        if db.autocommit is not True:
+            db.autocommit = True
+        db.set_client_encoding('UTF8')
+
+    def _sweep_idle(self, ping: bool) -> int:
+        """借出当前全部空闲连接：ping=True 时探测后归还存活者，否则全部关闭。返回剔除数量"""
+        pool = self._pool
+        if pool is None:
+            return 0
+        taken = []
+        for _ in range(len(pool._pool)):
+            if not self._slots.acquire(blocking=False):
+                break
+            try:
+                taken.append(pool.getconn())
+            except Exception:
+                self._slots.release()
+                break
+        removed = 0
+        for db in taken:
+            alive = False
+            if ping and db.closed == 0:
+                try:
+                    with db.cursor() as cur:
+                        cur.execute("SELECT 1")
+                    alive = True
+                except Exception:
+                    alive = False
+            try:
+                pool.putconn(db, close=not alive)
+            except Exception:
+                pass
+            if not alive:
+                removed += 1
+            self._slots.release()
+        if removed:
+            with self._lock:
+                self._discarded += removed
+        return removed
+
+    @contextmanager
+    def connection(self):
+        """借出一个连接，离开上下文时归还；连接已断开时直接丢弃"""
+        started = time.monotonic()
+        acquired = self._slots.acquire(blocking=False)
+        if not acquired:
+            with self._lock:
+                self._waits += 1
+            acquired = self._slots.acquire(timeout=self.timeout)
+        if not acquired:
+            with self._lock:
+                self._timeouts += 1
+            raise pg_pool.PoolError(f"等待数据库连接超时（{self.timeout}s）")
+
+        try:
+            pool = self._ensure_pool()
+            db = pool.getconn()
+            self._prepare(db)
+        except Exception:
+            self._slots.release()
+            raise
+
+        with self._lock:
+            self._in_use += 1
+            self._checkouts += 1
+            self._wait_seconds += time.monotonic() - started
+        try:
+            yield db
+        except CONNECTION_ERRORS:
+            if getattr(db, "closed", 1) != 0:
+                # 服务端重启或网络中断时，池中其余空闲连接大概率同样失效，一并清理
+                self._sweep_idle(ping=False)
+            raise
+        finally:
+            broken = getattr(db, "closed", 1) != 0
+            try:
+                pool.putconn(db, close=broken)
+            except Exception:
+                pass
+            with self._lock:
+                self._in_use -= 1
+                if broken:
+                    self._discarded += 1
+            self._slots.release()
+
+    def start_keepalive(self, interval: Optional[float] = None) -> None:
+        """启动后台保活线程，定期探测空闲连接"""
+        interval = PG_KEEPALIVE_INTERVAL if interval is None else interval
+        if interval <= 0 or self._keepalive_thread is not None:
+            return
+        self._keepalive_stop.clear()
+
+        def loop() -> None:
+            while not self._keepalive_stop.wait(interval):
+                try:
+                    self._sweep_idle(ping=True)
+                except Exception:
+                    pass
+
+        self._keepalive_thread = threading.Thread(target=loop, name="pg-keepalive", daemon=True)
+        self._keepalive_thread.start()
+
+    def stop_keepalive(self) -> None:
+        thread = self._keepalive_thread
+        if thread is None:
+            return
+        self._keepalive_stop.set()
+        thread.join(timeout=5)
+        self._keepalive_thread = None
+
+    def stats(self) -> Dict[str, Any]:
+        """连接池运行状态"""
+        with self._lock:
+            pool = self._pool
+            idle = len(pool._pool) if pool is not None else 0
+            opened = idle + (len(pool._used) if pool is not None else 0)
+            checkouts = self._checkouts
+            return {
+                "min": self.minconn,
+                "max": self.maxconn,
+                "opened": opened,
+                "in_use": self._in_use,
+                "idle": idle,
+                "checkouts": checkouts,
+                "waits": self._waits,
+                "timeouts": self._timeouts,
+                "discarded": self._discarded,
+                "avg_wait_ms": round(self._wait_seconds * 1000 / checkouts, 3) if checkouts else 0.0,
+            }
@@ -0,0 +1,280 @@
+"""上传文件的派生文件（图片缩略图与显示尺寸、视频预览图）后台生成。
+
+图片在进程池中解码；视频预览图由 ffmpeg 子进程截取，用单独的小线程池限制并发。
+两者都不占用请求线程，列表接口对尚未生成完的条目返回 pending。
+
+用法（为已有的图片、视频补齐派生文件）:
+    python derivatives.py --rescan
+"""
+import argparse
+import logging
+import os
+import shutil
+import subprocess
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import Executor, Future, ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# 默认保留一个核给 Web 进程
+MEDIA_WORKERS = int(os.getenv("MEDIA_WORKERS", str(max(1, (os.cpu_count() or 2) - 1))))
+# 排队中的任务上限，超出时暂不提交，由下一次列表请求或重新扫描补上
+MEDIA_QUEUE_LIMIT = int(os.getenv("MEDIA_QUEUE_LIMIT", "256"))
+# 生成失败后首次重试的间隔（秒），之后每次翻倍，不超过上限
+MEDIA_RETRY_SECONDS = float(os.getenv("MEDIA_RETRY_SECONDS", "60"))
+MEDIA_RETRY_MAX_SECONDS = float(os.getenv("MEDIA_RETRY_MAX_SECONDS", "3600"))
+# 同时运行的 ffmpeg 数；每个 ffmpeg 自己会用多个线程解码
+VIDEO_PREVIEW_WORKERS = int(os.getenv("VIDEO_PREVIEW_WORKERS", "2"))
+VIDEO_PREVIEW_TIMEOUT = float(os.getenv("VIDEO_PREVIEW_TIMEOUT", "60"))
+# 未设置时依次尝试 PATH 中的 ffmpeg 与 imageio-ffmpeg 自带的可执行文件
+FFMPEG_BINARY = os.getenv("FFMPEG_BINARY", "")
+
+PENDING = "pending"
+READY = "ready"
+FAILED = "failed"
+
+
+def _ffmpeg_binary() -> str:
+    if FFMPEG_BINARY:
+        return FFMPEG_BINARY
+    found = shutil.which("ffmpeg")
+    if found:
+        return found
+    try:
+        import imageio_ffmpeg
+    except ImportError:
+        raise RuntimeError("未找到 ffmpeg，请安装 ffmpeg 或 imageio-ffmpeg，或设置 FFMPEG_BINARY")
+    return imageio_ffmpeg.get_ffmpeg_exe()
+
+
+def _extract_frame(ffmpeg: str, video_path: str, target: str, at: float) -> bool:
+    # -ss 放在 -i 之前按关键帧直接定位，不从头解码
+    command = [
+        ffmpeg, "-hide_banner", "-loglevel", "error", "-nostdin", "-y",
+        "-ss", f"{at:.3f}", "-i", video_path,
+        "-frames:v", "1", "-q:v", "3", target,
+    ]
+    result = subprocess.run(command, capture_output=True, timeout=VIDEO_PREVIEW_TIMEOUT)
+    if result.returncode != 0:
+        message = result.stderr.decode("utf-8", "replace").strip()
+        raise RuntimeError(f"ffmpeg 退出码 {result.returncode}: {message[-500:]}")
+    return os.path.isfile(target) and os.path.getsize(target) > 0
+
+
+def render_video_preview(video_path: str, preview_path: str, at: float) -> None:
+    """用 ffmpeg 截取视频 at 秒处的一帧保存为预览图；视频短于 at 秒时取第一帧"""
+    ffmpeg = _ffmpeg_binary()
+    root, ext = os.path.splitext(preview_path)
+    # 临时文件保留扩展名，ffmpeg 据此选择编码器
+    tmp = f"{root}.{uuid.uuid4().hex}.tmp{ext}"
+    try:
+        if not _extract_frame(ffmpeg, video_path, tmp, at) and not _extract_frame(ffmpeg, video_path, tmp, 0):
+            raise RuntimeError("未能从视频中截取到画面")
+        os.replace(tmp, preview_path)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+
+
+class DerivativeQueue:
+    """按键去重的派生文件生成队列。
+
+    键通常是目标文件名；同一个键在生成期间不会重复提交。同时提交的任务超过 limit 时，
+    多出的任务记在待办中，有任务完成时依次补上。失败的键在一段时间内直接报告 failed，
+    之后再次提交时重试，间隔按次数翻倍（锁定的文件、ffmpeg 超时这类偶发错误可以自愈）。
+    完成回调在执行器的管理线程中调用。
+    threads 为 True 时用线程池，适合把工作交给外部程序（如 ffmpeg）的任务，workers 即并发上限。
+    """
+
+    def __init__(self, workers: Optional[int] = None, limit: Optional[int] = None, threads: bool = False) -> None:
+        self.workers = MEDIA_WORKERS if workers is None else max(1, workers)
+        self.limit = MEDIA_QUEUE_LIMIT if limit is None else limit
+        self.threads = threads
+        self._lock = threading.Lock()
+        self._executor: Optional[Executor] = None
+        self._pending: Dict[str, Future] = {}
+        # 超出 limit 暂未提交的任务，键 -> (fn, args, on_done)
+        self._backlog: "OrderedDict[str, Tuple[Callable[..., Any], tuple, Optional[Callable[[], None]]]]" = OrderedDict()
+        # 键 -> (错误信息, 连续失败次数, 可重试的时刻)
+        self._failed: Dict[str, Tuple[str, int, float]] = {}
+
+    def _ensure_executor(self) -> Executor:
+        if self._executor is None:
+            if self.threads:
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="video-preview")
+            else:
+                self._executor = ProcessPoolExecutor(max_workers=self.workers)
+        return self._executor
+
+    def _failed_now(self, key: str) -> bool:
+        failed = self._failed.get(key)
+        return failed is not None and time.monotonic() < failed[2]
+
+    def status(self, key: str) -> Optional[str]:
+        with self._lock:
+            if key in self._pending or key in self._backlog:
+                return PENDING
+            if self._failed_now(key):
+                return FAILED
+        return None
+
+    def submit(
+        self,
+        key: str,
+        fn: Callable[..., Any],
+        *args: Any,
+        on_done: Optional[Callable[[], None]] = None,
+    ) -> str:
+        """提交生成任务，返回该键当前的状态（pending 或 failed）"""
+        with self._lock:
+            if key in self._pending or key in self._backlog:
+                return PENDING
+            if self._failed_now(key):
+                return FAILED
+            if len(self._pending) >= self.limit:
+                self._backlog[key] = (fn, args, on_done)
+                return PENDING
+            future = self._start(key, fn, args)
+        self._watch(key, future, on_done)
+        return PENDING
+
+    def _start(self, key: str, fn: Callable[..., Any], args: tuple) -> Future:
+        """在持有 _lock 时调用"""
+        future = self._ensure_executor().submit(fn, *args)
+        self._pending[key] = future
+        return future
+
+    def _watch(self, key: str, future: Future, on_done: Optional[Callable[[], None]]) -> None:
+        # 在锁外注册：任务若已完成，回调会在当前线程立即执行
+        def done(f: Future) -> None:
+            error = None if f.cancelled() else f.exception()
+            started = []
+            with self._lock:
+                self._pending.pop(key, None)
+                if error is not None:
+                    attempts = self._failed.get(key, ("", 0, 0.0))[1] + 1
+                    delay = min(MEDIA_RETRY_MAX_SECONDS, MEDIA_RETRY_SECONDS * 2 ** (attempts - 1))
+                    self._failed[key] = (str(error), attempts, time.monotonic() + delay)
+                else:
+                    self._failed.pop(key, None)
+                # 补上待办中的任务
+                while self._backlog and len(self._pending) < self.limit and self._executor is not None:
+                    next_key, (fn, args, callback) = self._backlog.popitem(last=False)
+                    started.append((next_key, self._start(next_key, fn, args), callback))
+            for next_key, next_future, callback in started:
+                self._watch(next_key, next_future, callback)
+            if error is not None:
+                logger.warning(f"派生文件生成失败 {key}: {error}")
+                return
+            if f.cancelled():
+                return
+            if on_done is not None:
+                try:
+                    on_done()
+                except Exception as e:
+                    logger.warning(f"派生文件登记失败 {key}: {e}")
+
+        future.add_done_callback(done)
+
+    def shutdown(self) -> None:
+        with self._lock:
+            executor, self._executor = self._executor, None
+            self._backlog.clear()
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+
+def rescan(workers: Optional[int] = None) -> Dict[str, int]:
+    """并行补齐图片缩略图、显示尺寸与视频预览图，返回 {"generated", "failed", "skipped"}"""
+    from content_store import ContentStore
+    from picture import PICTURE_RENDITION_SUBDIR, PICTURE_ROOT, PICTURE_THUMB_DIR, THUMBNAIL_SIZE, _is_image_file
+    from renditions import RenditionStore, render_renditions, rendition_key
+    from thumbnails import ThumbnailCache, render_thumbnail
+    from video import VIDEO_PREVIEW_TIME, VIDEO_ROOT, _is_video_file, _preview_filename, _thumb_dir
+
+    thumbnails = ThumbnailCache(PICTURE_THUMB_DIR, THUMBNAIL_SIZE)
+    renditions = RenditionStore(os.path.join(PICTURE_ROOT, PICTURE_RENDITION_SUBDIR))
+    picture_store = ContentStore(PICTURE_ROOT)
+    video_store = ContentStore(VIDEO_ROOT)
+    jobs: List[tuple] = []
+    video_jobs: List[tuple] = []
+    # 内容相同的文件派生文件也相同，只生成一次
+    queued = set()
+    skipped = 0
+    if os.path.isdir(PICTURE_ROOT):
+        os.makedirs(PICTURE_THUMB_DIR, exist_ok=True)
+        os.makedirs(renditions.directory, exist_ok=True)
+        for entry in os.scandir(PICTURE_ROOT):
+            if not entry.is_file() or not _is_image_file(entry.name):
+                continue
+            stat = entry.stat()
+            digest = picture_store.digest_of(entry.inode())
+            name, ready = thumbnails.lookup(entry.path, stat.st_mtime_ns, stat.st_size, digest)
+            if ready or name in queued:
+                skipped += 1
+            else:
+                queued.add(name)
+                target = os.path.join(PICTURE_THUMB_DIR, name)
+                jobs.append((name, render_thumbnail, (entry.path, target, THUMBNAIL_SIZE, thumbnails.fmt)))
+            key = rendition_key(entry.name, stat.st_mtime_ns, stat.st_size, digest)
+            if renditions.manifest(key) is not None or key in queued:
+                skipped += 1
+            else:
+                queued.add(key)
+                args = (entry.path, renditions.directory, key, renditions.heights, thumbnails.fmt)
+                jobs.append((None, render_renditions, args))
+    if os.path.isdir(VIDEO_ROOT):
+        os.makedirs(_thumb_dir(), exist_ok=True)
+        for entry in os.scandir(VIDEO_ROOT):
+            if not entry.is_file() or not _is_video_file(entry.name):
+                continue
+            preview_name = _preview_filename(entry.name, video_store.digest_of(entry.inode()))
+            preview_path = os.path.join(_thumb_dir(), preview_name)
+            if os.path.isfile(preview_path) or preview_name in queued:
+                skipped += 1
+                continue
+            queued.add(preview_name)
+            video_jobs.append((entry.path, preview_path, VIDEO_PREVIEW_TIME))
+
+    generated = failed = 0
+    with ProcessPoolExecutor(max_workers=workers or MEDIA_WORKERS) as executor, ThreadPoolExecutor(
+        max_workers=VIDEO_PREVIEW_WORKERS
+    ) as video_executor:
+        futures = {executor.submit(fn, *args): (name, args[0]) for name, fn, args in jobs}
+        for args in video_jobs:
+            futures[video_executor.submit(render_video_preview, *args)] = (None, args[0])
+        for future in as_completed(futures):
+            name, source = futures[future]
+            error = future.exception()
+            if error is not None:
+                failed += 1
+                print(f"生成失败 {source}: {error}")
+                continue
+            if name is not None:
+                thumbnails.add(name)
+            generated += 1
+    return {"generated": generated, "failed": failed, "skipped": skipped}
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="生成图片缩略图与视频预览图")
+    parser.add_argument("--rescan", action="store_true", help="扫描图片、视频目录，补齐缺失的派生文件")
+    parser.add_argument("--workers", type=int, default=None, help=f"图片并行进程数，默认 {MEDIA_WORKERS}")
+    args = parser.parse_args(argv)
+    if not args.rescan:
+        parser.print_help()
+        return
+    started = time.monotonic()
+    result = rescan(args.workers)
+    print(
+        f"生成 {result['generated']} 个，失败 {result['failed']} 个，"
+        f"已存在 {result['skipped']} 个，耗时 {time.monotonic() - started:.2f}s"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -1,13 +1,22 @@
 import os
-from contextlib import asynccontextmanager
-from typing import Any, Dict, List, Optional
+import threading
+from contextlib import asynccontextmanager, contextmanager
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, Iterable, List, Optional, Set
 
-import psycopg2
 from fastapi import Body, FastAPI, HTTPException, Query
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
 from psycopg2 import extras
 from pydantic import BaseModel
 
+from db_async import AsyncDatabasePool
+from db_pool import DatabasePool, run_read
+from heartbeat import DEVICE_STALE_SECONDS, HeartbeatBuffer
+from migrations import migrate
+from provisioning import DeviceProvisioner
+from versions import ContentVersions
+
 DB_CONFIG = {
 	"host": os.getenv("PG_HOST", "localhost"),
 	"user": os.getenv("PG_USER", "postgres"),
@@ -27,10 +36,38 @@ class DeviceRemark(BaseModel):
 	remark: str
 
 
+class DeviceHeartbeat(BaseModel):
+	device: str
+	mode: Optional[str] = None
+	client_version: Optional[str] = None
+	fps: Optional[float] = None
+
+
 class DeviceService:
-	def __init__(self, db_config: Dict[str, Any] = None, db=None) -> None:
+	def __init__(
+		self,
+		db_config: Dict[str, Any] = None,
+		db=None,
+		pool: Optional[DatabasePool] = None,
+		async_pool: Optional[AsyncDatabasePool] = None,
+		versions: Optional[ContentVersions] = None,
+		provisioner: Optional[DeviceProvisioner] = None,
+	) -> None:
 		self.db_config = db_config or DB_CONFIG
 		self._external_db = db
+		self._owns_pool = pool is None
+		self.pool = pool or DatabasePool(self.db_config)
+		self._owns_async_pool = async_pool is None
+		self.async_pool = async_pool or AsyncDatabasePool(self.db_config)
+		self.versions = versions or ContentVersions()
+		self.provisioner = provisioner or DeviceProvisioner()
+		# 已注册设备的内存副本：首次使用时整体加载，本进程的增删直接更新，
+		# 其他进程的增删经 NOTIFY 到达后只把该设备标记为待复核，下次检查时单独查一次
+		self._registry_lock = threading.Lock()
+		self._registry: Optional[Set[str]] = None
+		self._stale: Set[str] = set()
+		self.versions.add_listener(self._on_change)
+		self.heartbeats = HeartbeatBuffer(self.get_db)
 		self.app = FastAPI(lifespan=self._lifespan)
 		self._configure_app()
 		self._register_routes()
@@ -44,52 +81,91 @@ class DeviceService:
 			allow_headers=["*"],
 		)
 
-	def ensure_table(self, db) -> None:
-		create_sql = """
-		CREATE TABLE IF NOT EXISTS device_list (
-			device_id TEXT PRIMARY KEY,
-			remark TEXT NOT NULL DEFAULT ''
-		);
-		"""
-		with db.cursor() as cur:
-			cur.execute(create_sql)
-
 	@asynccontextmanager
 	async def _lifespan(self, app: FastAPI):
-		created_local = False
-		db = self._external_db
-		if db is None:
-			db = psycopg2.connect(**self.db_config)
-			db.autocommit = True
-			created_local = True
-		self.ensure_table(db)
-		app.state.db = db
+		if self._owns_pool:
+			# 独立运行时自行执行迁移；挂载到 main.py 时由主程序在启动时统一执行
+			with self.get_db() as db:
+				migrate(db)
+		if self._owns_async_pool:
+			await self.async_pool.open()
+		if self._owns_pool:
+			self.heartbeats.start()
 		try:
 			yield
 		finally:
-			if created_local:
-				try:
-					db.close()
-				except Exception:
-					pass
+			if self._owns_pool:
+				self.heartbeats.stop()
+			if self._owns_async_pool:
+				await self.async_pool.close()
+			if self._owns_pool:
+				self.pool.close()
 
+	@contextmanager
 	def get_db(self):
-		db = getattr(self.app.state, "db", None)
-		if db is None or getattr(db, "closed", 1) != 0:
-			db = psycopg2.connect(**self.db_config)
-			db.autocommit = True
-			self.app.state.db = db
-			self.ensure_table(db)
-		else:
-			try:
-				with db.cursor() as cur:
-					cur.execute("SELECT 1")
-			except Exception:
-				db = psycopg2.connect(**self.db_config)
-				db.autocommit = True
-				self.app.state.db = db
-				self.ensure_table(db)
-		return db
+		"""按请求从连接池借出连接，离开上下文时归还"""
+		if self._external_db is not None:
+			yield self._external_db
+			return
+		with self.pool.connection() as db:
+			yield db
+
+	def _on_change(self, device: str, resource: str, version: int, remote: bool) -> None:
+		if resource != "device" or not remote:
+			return
+		with self._registry_lock:
+			self._stale.add(device)
+
+	async def _fetch(self, sql: str, params: tuple = ()) -> List[Any]:
+		if self.async_pool.available:
+			return await self.async_pool.fetch(sql, params)
+
+		def query(db):
+			with db.cursor(cursor_factory=extras.RealDictCursor) as cur:
+				cur.execute(sql, params)
+				return cur.fetchall()
+
+		return await run_in_threadpool(run_read, self.get_db, query)
+
+	async def load_registry(self) -> None:
+		"""整体加载已注册设备"""
+		rows = await self._fetch("SELECT device_id FROM device_list")
+		self._replace_registry(r["device_id"] for r in rows)
+
+	def _replace_registry(self, devices: Iterable[str]) -> None:
+		with self._registry_lock:
+			self._registry = set(devices)
+			self._stale.clear()
+
+	def invalidate_registry(self) -> None:
+		"""丢弃内存副本，下次检查时重新加载；变更通知连接重建后调用"""
+		with self._registry_lock:
+			self._registry = None
+
+	def _remember(self, device_id: str, exists: bool) -> None:
+		with self._registry_lock:
+			self._stale.discard(device_id)
+			if self._registry is None:
+				return
+			if exists:
+				self._registry.add(device_id)
+			else:
+				self._registry.discard(device_id)
+
+	async def device_exists(self, device: str) -> bool:
+		with self._registry_lock:
+			loaded = self._registry is not None
+		if not loaded:
+			await self.load_registry()
+		with self._registry_lock:
+			if device not in self._stale and self._registry is not None:
+				return device in self._registry
+		rows = await self._fetch(
+			"SELECT 1 AS found FROM device_list WHERE device_id = %s LIMIT 1",
+			(device,),
+		)
+		self._remember(device, bool(rows))
+		return bool(rows)
 
 	def _register_routes(self) -> None:
 		app = self.app
@@ -98,14 +174,17 @@ class DeviceService:
 		@app.get("/")
 		def list_devices() -> List[Dict[str, str]]:
 			"""获取设备列表"""
-			try:
-				db = get_db()
+
+			def query(db):
 				with db.cursor(cursor_factory=extras.RealDictCursor) as cur:
 					cur.execute(
 						"SELECT device_id, remark FROM device_list ORDER BY device_id ASC"
 					)
 					rows = cur.fetchall()
 					return [{"device_id": r["device_id"], "remark": r["remark"]} for r in rows]
+
+			try:
+				return run_read(get_db, query)
 			except Exception as e:
 				raise HTTPException(status_code=500, detail=f"查询失败: {str(e)}")
 
@@ -115,24 +194,28 @@ class DeviceService:
 			if not payload.device_id:
 				raise HTTPException(status_code=400, detail="device_id 不能为空")
 			try:
-				db = get_db()
-				with db.cursor() as cur:
-					cur.execute(
-						"""
-						INSERT INTO device_list (device_id, remark)
-						VALUES (%s, %s)
-						ON CONFLICT (device_id) DO NOTHING
-						RETURNING device_id, remark
-						""",
-						(payload.device_id, payload.remark or ""),
-					)
-					row = cur.fetchone()
-					if row is None:
-						raise HTTPException(status_code=409, detail="设备已存在")
-					return {
-						"success": True,
-						"data": {"device_id": row[0], "remark": row[1]},
-					}
+				with get_db() as db:
+					with db.cursor() as cur:
+						cur.execute(
+							"""
+							INSERT INTO device_list (device_id, remark)
+							VALUES (%s, %s)
+							ON CONFLICT (device_id) DO NOTHING
+							RETURNING device_id, remark
+							""",
+							(payload.device_id, payload.remark or ""),
+						)
+						row = cur.fetchone()
+						if row is None:
+							raise HTTPException(status_code=409, detail="设备已存在")
+						# 注册时写入默认配置，之后该设备的读接口只需一次查询
+						self.provisioner.ensure(cur, payload.device_id)
+						self._remember(payload.device_id, True)
+						self.versions.bump(payload.device_id, "device")
+						return {
+							"success": True,
+							"data": {"device_id": row[0], "remark": row[1]},
+						}
 			except HTTPException:
 				raise
 			except Exception as e:
@@ -144,16 +227,19 @@ class DeviceService:
 			if not device_id:
 				raise HTTPException(status_code=400, detail="device_id 不能为空")
 			try:
-				db = get_db()
-				with db.cursor() as cur:
-					cur.execute(
-						"DELETE FROM device_list WHERE device_id = %s RETURNING device_id",
-						(device_id,),
-					)
-					row = cur.fetchone()
-					if row is None:
-						raise HTTPException(status_code=404, detail="设备不存在")
-					return {"success": True, "message": "删除成功"}
+				with get_db() as db:
+					with db.cursor() as cur:
+						cur.execute(
+							"DELETE FROM device_list WHERE device_id = %s RETURNING device_id",
+							(device_id,),
+						)
+						row = cur.fetchone()
+						if row is None:
+							raise HTTPException(status_code=404, detail="设备不存在")
+						cur.execute("DELETE FROM device_status WHERE device_id = %s", (device_id,))
+						self._remember(device_id, False)
+						self.versions.bump(device_id, "device")
+						return {"success": True, "message": "删除成功"}
 			except HTTPException:
 				raise
 			except Exception as e:
@@ -165,45 +251,91 @@ class DeviceService:
 			if not device_id:
 				raise HTTPException(status_code=400, detail="device_id 不能为空")
 			try:
-				db = get_db()
-				with db.cursor() as cur:
-					cur.execute(
-						"""
-						UPDATE device_list
-						SET remark = %s
-						WHERE device_id = %s
-						RETURNING device_id, remark
-						""",
-						(payload.remark, device_id),
-					)
-					row = cur.fetchone()
-					if row is None:
-						raise HTTPException(status_code=404, detail="设备不存在")
-					return {
-						"success": True,
-						"data": {"device_id": row[0], "remark": row[1]},
-					}
+				with get_db() as db:
+					with db.cursor() as cur:
+						cur.execute(
+							"""
+							UPDATE device_list
+							SET remark = %s
+							WHERE device_id = %s
+							RETURNING device_id, remark
+							""",
+							(payload.remark, device_id),
+						)
+						row = cur.fetchone()
+						if row is None:
+							raise HTTPException(status_code=404, detail="设备不存在")
+						return {
+							"success": True,
+							"data": {"device_id": row[0], "remark": row[1]},
+						}
 			except HTTPException:
 				raise
 			except Exception as e:
 				raise HTTPException(status_code=500, detail=f"更新失败: {str(e)}")
 
 		@app.get("/check")
-		def check_device(device: str = Query("", min_length=1)) -> Dict[str, Any]:
-			"""检查设备是否存在"""
+		async def check_device(device: str = Query("", min_length=1)) -> Dict[str, Any]:
+			"""检查设备是否存在（由内存中的设备表直接回答）"""
 			if not device:
 				raise HTTPException(status_code=400, detail="device 不能为空")
 			try:
-				db = get_db()
-				with db.cursor() as cur:
-					cur.execute(
-						"SELECT 1 FROM device_list WHERE device_id = %s LIMIT 1",
-						(device,),
-					)
-					exists = cur.fetchone() is not None
-					return {"exists": exists}
+				return {"exists": await self.device_exists(device)}
+			except Exception as e:
+				raise HTTPException(status_code=500, detail=f"查询失败: {str(e)}")
+
+		@app.post("/heartbeat")
+		async def heartbeat(payload: DeviceHeartbeat) -> Dict[str, Any]:
+			"""屏幕定期上报在线状态；先记在内存中，由后台线程批量写入"""
+			if not payload.device:
+				raise HTTPException(status_code=400, detail="device 不能为空")
+			try:
+				exists = await self.device_exists(payload.device)
+			except Exception as e:
+				raise HTTPException(status_code=500, detail=f"查询失败: {str(e)}")
+			if not exists:
+				raise HTTPException(status_code=404, detail="设备不存在")
+			seen = self.heartbeats.record(payload.device, payload.mode, payload.client_version, payload.fps)
+			return {"success": True, "last_seen": seen.isoformat()}
+
+		@app.get("/status")
+		async def device_status() -> Dict[str, Any]:
+			"""设备在线状态：超过 stale_after 秒没有心跳的设备视为离线"""
+			try:
+				rows = await self._fetch(
+					"""
+					SELECT d.device_id, d.remark, s.last_seen, s.mode, s.client_version, s.fps
+					FROM device_list d
+					LEFT JOIN device_status s ON s.device_id = d.device_id
+					ORDER BY d.device_id ASC
+					"""
+				)
 			except Exception as e:
 				raise HTTPException(status_code=500, detail=f"查询失败: {str(e)}")
+			pending = self.heartbeats.pending()
+			cutoff = datetime.now(timezone.utc) - timedelta(seconds=DEVICE_STALE_SECONDS)
+			devices = []
+			for r in rows:
+				last_seen, mode, client_version, fps = r["last_seen"], r["mode"], r["client_version"], r["fps"]
+				beat = pending.get(r["device_id"])
+				if beat is not None and (last_seen is None or beat[0] > last_seen):
+					last_seen, mode, client_version, fps = beat
+				devices.append({
+					"device_id": r["device_id"],
+					"remark": r["remark"],
+					"online": last_seen is not None and last_seen >= cutoff,
+					"last_seen": last_seen.isoformat() if last_seen else None,
+					"mode": mode,
+					"client_version": client_version,
+					"fps": fps,
+				})
+			online = sum(1 for d in devices if d["online"])
+			return {
+				"stale_after": DEVICE_STALE_SECONDS,
+				"online": online,
+				"stale": len(devices) - online,
+				"devices": devices,
+			}
 
 
 api = DeviceService()
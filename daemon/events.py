@@ -0,0 +1,183 @@
+import asyncio
+import json
+import logging
+import os
+import queue
+import select
+import threading
+import uuid
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional, Set
+
+import psycopg2
+
+from db_pool import TCP_KEEPALIVE_OPTIONS
+from versions import GLOBAL_DEVICE, ContentVersions
+
+logger = logging.getLogger(__name__)
+
+# 设为 0 时只在本进程内推送，不通过 PostgreSQL 与其他进程同步；多 worker 部署需保持开启，
+# 否则各进程的配置缓存看不到其他进程的写入
+PG_NOTIFY_ENABLED = os.getenv("PG_NOTIFY_ENABLED", "1") != "0"
+NOTIFY_CHANNEL = "screen_changes"
+# SSE 心跳间隔（秒），让代理与屏幕都能及时发现断开的连接
+SSE_HEARTBEAT_SECONDS = float(os.getenv("SSE_HEARTBEAT_SECONDS", "15"))
+# 单个订阅者积压的事件上限，屏幕长时间不读时丢弃新事件而不是无限占用内存
+SUBSCRIBER_QUEUE_SIZE = 100
+RECONNECT_DELAY_SECONDS = 3.0
+POLL_INTERVAL_SECONDS = 0.2
+
+
+class EventHub:
+    """把 ContentVersions 的变更推送给 SSE 订阅者，并经 LISTEN/NOTIFY 在进程间同步。
+
+    本进程的写入先直接分发给本地订阅者，再由后台线程 pg_notify 广播；
+    收到其他进程的通知后调用 versions.observe()，由其回调完成本地分发。
+    """
+
+    def __init__(self, db_config: Dict[str, Any], versions: ContentVersions) -> None:
+        self.db_config = db_config
+        self.versions = versions
+        self.origin = uuid.uuid4().hex
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._lock = threading.Lock()
+        self._subscribers: Dict[str, Set[asyncio.Queue]] = {}
+        self._outbox: "queue.Queue[str]" = queue.Queue(maxsize=1000)
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._resync_listeners: List[Callable[[], None]] = []
+        versions.add_listener(self._on_change)
+
+    def add_resync_listener(self, listener: Callable[[], None]) -> None:
+        """注册 LISTEN 连接断开后重新建立时的回调，供依赖通知失效的缓存整体丢弃，补上断线期间错过的变更"""
+        self._resync_listeners.append(listener)
+
+    def _resync(self) -> None:
+        for listener in list(self._resync_listeners):
+            try:
+                listener()
+            except Exception as e:
+                logger.warning(f"变更通知重连回调失败: {e}")
+
+    def start(self) -> None:
+        """在事件循环内调用；开启跨进程同步时启动 LISTEN 线程"""
+        self._loop = asyncio.get_running_loop()
+        if not PG_NOTIFY_ENABLED or self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._listen_loop, name="pg-listen", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        thread, self._thread = self._thread, None
+        if thread is not None:
+            thread.join(timeout=5)
+
+    def _on_change(self, device: str, resource: str, version: int, remote: bool) -> None:
+        event = {"device": device, "resource": resource, "version": version}
+        self._dispatch(event)
+        if remote or not PG_NOTIFY_ENABLED:
+            return
+        payload = json.dumps({**event, "origin": self.origin})
+        try:
+            self._outbox.put_nowait(payload)
+        except queue.Full:
+            logger.warning("变更通知积压过多，丢弃一条跨进程通知")
+
+    def _dispatch(self, event: Dict[str, Any]) -> None:
+        loop = self._loop
+        if loop is None or loop.is_closed():
+            return
+        device = event["device"]
+        with self._lock:
+            if device == GLOBAL_DEVICE:
+                targets = [q for subs in self._subscribers.values() for q in subs]
+            else:
+                targets = list(self._subscribers.get(device, ()))
+        for q in targets:
+            loop.call_soon_threadsafe(self._offer, q, event)
+
+    @staticmethod
+    def _offer(q: asyncio.Queue, event: Dict[str, Any]) -> None:
+        try:
+            q.put_nowait(event)
+        except asyncio.QueueFull:
+            pass
+
+    def _handle_notify(self, payload: str) -> None:
+        try:
+            data = json.loads(payload)
+            if data.get("origin") == self.origin:
+                return
+            self.versions.observe(str(data["device"]), str(data["resource"]), int(data["version"]))
+        except (ValueError, KeyError, TypeError):
+            logger.warning(f"忽略无法解析的变更通知: {payload!r}")
+
+    def _listen_loop(self) -> None:
+        connected_before = False
+        while not self._stop.is_set():
+            db = None
+            try:
+                db = psycopg2.connect(**{**TCP_KEEPALIVE_OPTIONS, **self.db_config})
+                db.autocommit = True
+                with db.cursor() as cur:
+                    cur.execute(f"LISTEN {NOTIFY_CHANNEL}")
+                    if connected_before:
+                        self._resync()
+                    connected_before = True
+                    while not self._stop.is_set():
+                        while True:
+                            try:
+                                payload = self._outbox.get_nowait()
+                            except queue.Empty:
+                                break
+                            cur.execute("SELECT pg_notify(%s, %s)", (NOTIFY_CHANNEL, payload))
+                        if select.select([db], [], [], POLL_INTERVAL_SECONDS) == ([], [], []):
+                            continue
+                        db.poll()
+                        while db.notifies:
+                            self._handle_notify(db.notifies.pop(0).payload)
+            except Exception as e:
+                logger.warning(f"变更通知连接中断，{RECONNECT_DELAY_SECONDS}s 后重连: {e}")
+                self._stop.wait(RECONNECT_DELAY_SECONDS)
+            finally:
+                if db is not None:
+                    try:
+                        db.close()
+                    except Exception:
+                        pass
+
+    def subscribe(self, device: str) -> asyncio.Queue:
+        q: asyncio.Queue = asyncio.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+        with self._lock:
+            self._subscribers.setdefault(device, set()).add(q)
+        return q
+
+    def unsubscribe(self, device: str, q: asyncio.Queue) -> None:
+        with self._lock:
+            subs = self._subscribers.get(device)
+            if subs is None:
+                return
+            subs.discard(q)
+            if not subs:
+                del self._subscribers[device]
+
+    def subscriber_count(self) -> int:
+        with self._lock:
+            return sum(len(subs) for subs in self._subscribers.values())
+
+    async def stream(self, device: str) -> AsyncIterator[str]:
+        """按 SSE 格式输出该设备（及全局资源）的变更事件"""
+        q = self.subscribe(device)
+        try:
+            # 告知重连间隔，并让客户端确认连接已建立
+            yield f"retry: {int(RECONNECT_DELAY_SECONDS * 1000)}\nevent: ready\ndata: {json.dumps({'device': device})}\n\n"
+            while True:
+                try:
+                    event = await asyncio.wait_for(q.get(), timeout=SSE_HEARTBEAT_SECONDS)
+                except asyncio.TimeoutError:
+                    yield ": ping\n\n"
+                    continue
+                yield f"event: change\ndata: {json.dumps(event, ensure_ascii=False)}\n\n"
+        finally:
+            self.unsubscribe(device, q)
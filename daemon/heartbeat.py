@@ -0,0 +1,106 @@
+import logging
+import os
+import threading
+from datetime import datetime, timezone
+from typing import Dict, Optional, Tuple
+
+from psycopg2 import extras
+
+logger = logging.getLogger(__name__)
+
+# 心跳在内存中合并，每隔这么多秒批量写入一次
+HEARTBEAT_FLUSH_SECONDS = float(os.getenv("HEARTBEAT_FLUSH_SECONDS", "5"))
+# 超过该时长没有心跳的设备视为离线（屏幕默认每 30 秒上报一次）
+DEVICE_STALE_SECONDS = float(os.getenv("DEVICE_STALE_SECONDS", "90"))
+
+# (最后上报时间, 页面模式, 客户端版本, 渲染帧率)
+Heartbeat = Tuple[datetime, Optional[str], Optional[str], Optional[float]]
+
+# 多个进程各自批量写入时，只保留时间更新的那一条
+FLUSH_SQL = """
+INSERT INTO device_status (device_id, last_seen, mode, client_version, fps)
+VALUES %s
+ON CONFLICT (device_id) DO UPDATE SET
+    last_seen = EXCLUDED.last_seen,
+    mode = EXCLUDED.mode,
+    client_version = EXCLUDED.client_version,
+    fps = EXCLUDED.fps
+WHERE device_status.last_seen <= EXCLUDED.last_seen
+"""
+
+
+class HeartbeatBuffer:
+    """设备心跳的写后缓冲。
+
+    record() 只更新内存中每台设备的最新一条，后台线程定期用一条批量 UPSERT 落库，
+    几百台屏幕每 30 秒上报一次，每分钟也只有几条语句。写入失败的数据放回缓冲，下次重试。
+    """
+
+    def __init__(self, get_db, interval: Optional[float] = None) -> None:
+        self.get_db = get_db
+        self.interval = HEARTBEAT_FLUSH_SECONDS if interval is None else interval
+        self._lock = threading.Lock()
+        self._pending: Dict[str, Heartbeat] = {}
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def record(
+        self,
+        device: str,
+        mode: Optional[str] = None,
+        client_version: Optional[str] = None,
+        fps: Optional[float] = None,
+    ) -> datetime:
+        seen = datetime.now(timezone.utc)
+        with self._lock:
+            self._pending[device] = (seen, mode, client_version, fps)
+        return seen
+
+    def pending(self) -> Dict[str, Heartbeat]:
+        """尚未落库的心跳，状态接口用它覆盖库中的旧值"""
+        with self._lock:
+            return dict(self._pending)
+
+    def flush(self) -> int:
+        with self._lock:
+            batch, self._pending = self._pending, {}
+        if not batch:
+            return 0
+        rows = [(device, *beat) for device, beat in batch.items()]
+        try:
+            with self.get_db() as db:
+                with db.cursor() as cur:
+                    extras.execute_values(cur, FLUSH_SQL, rows, page_size=len(rows))
+        except Exception:
+            with self._lock:
+                for device, beat in batch.items():
+                    current = self._pending.get(device)
+                    if current is None or current[0] < beat[0]:
+                        self._pending[device] = beat
+            raise
+        return len(rows)
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            try:
+                self.flush()
+            except Exception as e:
+                logger.warning(f"设备心跳写入失败，下次重试: {e}")
+
+    def start(self) -> None:
+        if self.interval <= 0 or self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="heartbeat-flush", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        """停止后台线程并写入剩余的心跳"""
+        self._stop.set()
+        thread, self._thread = self._thread, None
+        if thread is not None:
+            thread.join(timeout=5)
+        try:
+            self.flush()
+        except Exception as e:
+            logger.warning(f"退出前写入设备心跳失败: {e}")
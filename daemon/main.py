@@ -1,7 +1,8 @@
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
+from fastapi.responses import StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 import os
-import psycopg2
 
 from renmin_daily import RenminDaily
 from days_master import DaysMaster
@@ -11,8 +12,19 @@ from notice import NoticeText
 from picture import NoticePicture
 from device import DeviceService
 from weather import WeatherService
+from screen import ScreenService
+from db_async import AsyncDatabasePool
+from db_pool import DatabasePool
+from derivatives import VIDEO_PREVIEW_WORKERS, DerivativeQueue
+from events import EventHub
+from migrations import migrate
+from provisioning import DeviceProvisioner
+from versions import ContentVersions
 
 
+# 设为 0 时启动不执行迁移，改由 `python migrations.py` 手动执行
+AUTO_MIGRATE = os.getenv("DB_AUTO_MIGRATE", "1") != "0"
+
 DB_CONFIG = {
     "host": os.getenv("PG_HOST", "localhost"),
     "user": os.getenv("PG_USER", "kaguya"),
@@ -24,16 +36,91 @@ DB_CONFIG = {
 
 
 def create_app() -> FastAPI:
-    renmin_daily_api = RenminDaily(db_config=DB_CONFIG)
-    days_master_api = DaysMaster(db_config=DB_CONFIG)
-    config_api = ConfigService(db_config=DB_CONFIG)
-    video_api = VideoService(db_config=DB_CONFIG)
-    notice_text_api = NoticeText(db_config=DB_CONFIG)
-    notice_picture_api = NoticePicture(db_config=DB_CONFIG)
-    device_api = DeviceService(db_config=DB_CONFIG)
-    weather_api = WeatherService()
+    # 所有服务共享同一个进程级连接池，最小/最大连接数由 PG_POOL_MIN / PG_POOL_MAX 配置
+    db_pool = DatabasePool(DB_CONFIG)
+    # 屏幕端高频 GET 接口使用的异步连接池（需安装 asyncpg），不可用时回退到 db_pool
+    async_db_pool = AsyncDatabasePool(DB_CONFIG)
+    # 各写接口提交后递增对应 (设备, 资源) 的版本号，屏幕轮询据此判断是否需要重新拉取
+    versions = ContentVersions()
+    # 把版本变更推送给 /events 订阅者，并经 LISTEN/NOTIFY 同步其他进程的写入
+    event_hub = EventHub(DB_CONFIG, versions)
+    # 记录本进程已写入默认配置的设备，设备注册与配置写接口共用
+    provisioner = DeviceProvisioner()
+    renmin_daily_api = RenminDaily(db_config=DB_CONFIG, pool=db_pool, async_pool=async_db_pool, versions=versions)
+    days_master_api = DaysMaster(db_config=DB_CONFIG, pool=db_pool, async_pool=async_db_pool, versions=versions)
+    config_api = ConfigService(
+        db_config=DB_CONFIG, pool=db_pool, async_pool=async_db_pool, versions=versions, provisioner=provisioner
+    )
+    # 图片缩略图与显示尺寸在进程池中生成，worker 数由 MEDIA_WORKERS 配置
+    derivatives = DerivativeQueue()
+    # 视频预览图由 ffmpeg 子进程截取，同时运行的数量由 VIDEO_PREVIEW_WORKERS 限制
+    previews = DerivativeQueue(VIDEO_PREVIEW_WORKERS, threads=True)
+    video_api = VideoService(
+        db_config=DB_CONFIG, pool=db_pool, async_pool=async_db_pool, versions=versions, derivatives=previews
+    )
+    # LISTEN 连接断开期间可能错过通知，重连后整体丢弃配置缓存
+    event_hub.add_resync_listener(config_api.invalidate)
+    notice_text_api = NoticeText(db_config=DB_CONFIG, pool=db_pool, async_pool=async_db_pool, versions=versions)
+    notice_picture_api = NoticePicture(
+        db_config=DB_CONFIG, pool=db_pool, async_pool=async_db_pool, versions=versions, derivatives=derivatives
+    )
+    device_api = DeviceService(
+        db_config=DB_CONFIG, pool=db_pool, async_pool=async_db_pool, versions=versions, provisioner=provisioner
+    )
+    # 同理，重连后整体重新加载设备表
+    event_hub.add_resync_listener(device_api.invalidate_registry)
+    weather_api = WeatherService(versions=versions)
+    screen_api = ScreenService(
+        db_config=DB_CONFIG,
+        pool=db_pool,
+        async_pool=async_db_pool,
+        versions=versions,
+        weather=weather_api,
+        quotes=renmin_daily_api.quotes,
+        pictures=notice_picture_api,
+    )
+
+    @asynccontextmanager
+    async def lifespan(app: FastAPI):
+        try:
+            db_pool.open()
+        except Exception as e:
+            print(f"连接池预热失败，将在首次请求时重试: {e}")
+        if AUTO_MIGRATE:
+            try:
+                with db_pool.connection() as db:
+                    applied = migrate(db)
+                if applied:
+                    print(f"已执行数据库迁移: {applied}")
+            except Exception as e:
+                print(f"数据库迁移失败，请手动执行 python migrations.py: {e}")
+        # PG_KEEPALIVE_INTERVAL > 0 时启用后台保活
+        db_pool.start_keepalive()
+        await async_db_pool.open()
+        try:
+            # 屏幕开机时集中调用 /device/check，启动时预先加载设备表
+            await device_api.load_registry()
+        except Exception as e:
+            print(f"设备表加载失败，将在首次检查时重试: {e}")
+        event_hub.start()
+        device_api.heartbeats.start()
+        # 定期重新扫描媒体目录，发现不经上传接口拷入的文件
+        notice_picture_api.files.start()
+        video_api.files.start()
+        try:
+            yield
+        finally:
+            device_api.heartbeats.stop()
+            notice_picture_api.files.stop()
+            video_api.files.stop()
+            derivatives.shutdown()
+            previews.shutdown()
+            event_hub.stop()
+            await async_db_pool.close()
+            db_pool.close()
 
-    app = FastAPI()
+    app = FastAPI(lifespan=lifespan)
+    app.state.db_pool = db_pool
     
     # Configure CORS
     app.add_middleware(
@@ -44,6 +131,23 @@ def create_app() -> FastAPI:
         allow_headers=["*"],  # Allows all headers, including X-QW-Api-Key
     )
     
+    @app.get("/pool/stats")
+    def pool_stats():
+        """数据库连接池状态"""
+        stats = db_pool.stats()
+        stats["async_available"] = async_db_pool.available
+        stats["event_subscribers"] = event_hub.subscriber_count()
+        return stats
+
+    @app.get("/events")
+    async def events(device: str = "default"):
+        """屏幕订阅的变更推送（SSE），写接口提交后立即推送 change 事件"""
+        return StreamingResponse(
+            event_hub.stream(device),
+            media_type="text/event-stream",
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        )
+
     app.mount("/renmin", renmin_daily_api.app)
     app.mount("/days", days_master_api.app)
     app.mount("/config", config_api.app)
@@ -52,6 +156,7 @@ def create_app() -> FastAPI:
     app.mount("/picture", notice_picture_api.app)
     app.mount("/device", device_api.app)
     app.mount("/weather", weather_api.app)
+    app.mount("/screen", screen_api.app)
     return app
 
 
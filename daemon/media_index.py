@@ -0,0 +1,152 @@
+import logging
+import os
+import threading
+from datetime import datetime, timezone
+from typing import Callable, Dict, List, NamedTuple, Optional, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+# 后台重新扫描媒体目录的间隔（秒），用于发现不经上传接口拷入或删除的文件；0 表示关闭
+MEDIA_SCAN_SECONDS = float(os.getenv("MEDIA_SCAN_SECONDS", "30"))
+# 列表接口单页条数上限
+MEDIA_MAX_LIMIT = 500
+
+
+class MediaEntry(NamedTuple):
+    name: str
+    size: int
+    mtime_ns: int
+    # 经上传接口存入的文件是内容存储的硬链接，据 inode 找回内容哈希
+    ino: int = 0
+
+    @property
+    def modified(self) -> str:
+        return datetime.fromtimestamp(self.mtime_ns / 1e9, timezone.utc).isoformat()
+
+
+class MediaIndex:
+    """媒体目录的内存索引，列表请求不再逐个访问文件系统。
+
+    首次使用时扫描一遍目录；上传接口写入后调用 upsert()，其他途径拷入或删除的文件
+    由后台线程定期重新扫描发现（目录可能在网络盘上，inotify 类通知不可靠，这里统一轮询）。
+    """
+
+    def __init__(self, root: str, accept: Callable[[str], bool], interval: Optional[float] = None) -> None:
+        self.root = root
+        self.accept = accept
+        self.interval = MEDIA_SCAN_SECONDS if interval is None else interval
+        self._lock = threading.Lock()
+        self._entries: Optional[Dict[str, MediaEntry]] = None
+        self._sorted: Dict[str, List[MediaEntry]] = {}
+        # 扫描期间经 upsert()/remove() 修改过的文件名，扫描结果以这些修改为准
+        self._touched: Set[str] = set()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def _scan(self) -> Dict[str, MediaEntry]:
+        entries: Dict[str, MediaEntry] = {}
+        if not os.path.isdir(self.root):
+            return entries
+        for entry in os.scandir(self.root):
+            if not self.accept(entry.name):
+                continue
+            try:
+                if not entry.is_file():
+                    continue
+                stat = entry.stat()
+                ino = entry.inode()
+            except OSError:
+                continue
+            entries[entry.name] = MediaEntry(entry.name, stat.st_size, stat.st_mtime_ns, ino)
+        return entries
+
+    def refresh(self) -> bool:
+        """重新扫描目录，内容有变化时返回 True"""
+        with self._lock:
+            self._touched.clear()
+        entries = self._scan()
+        with self._lock:
+            for name in self._touched:
+                current = (self._entries or {}).get(name)
+                if current is None:
+                    entries.pop(name, None)
+                else:
+                    entries[name] = current
+            if entries == self._entries:
+                return False
+            self._entries = entries
+            self._sorted.clear()
+        return True
+
+    def _ensure_loaded(self) -> Dict[str, MediaEntry]:
+        if self._entries is None:
+            self.refresh()
+        return self._entries or {}
+
+    def upsert(self, name: str) -> Optional[MediaEntry]:
+        path = os.path.join(self.root, name)
+        try:
+            stat = os.stat(path)
+        except OSError:
+            self.remove(name)
+            return None
+        entry = MediaEntry(name, stat.st_size, stat.st_mtime_ns, stat.st_ino)
+        self._ensure_loaded()
+        with self._lock:
+            self._entries[name] = entry
+            self._touched.add(name)
+            self._sorted.clear()
+        return entry
+
+    def remove(self, name: str) -> None:
+        with self._lock:
+            self._touched.add(name)
+            if self._entries is not None and self._entries.pop(name, None) is not None:
+                self._sorted.clear()
+
+    def get(self, name: str) -> Optional[MediaEntry]:
+        return self._ensure_loaded().get(name)
+
+    def query(
+        self,
+        offset: int = 0,
+        limit: Optional[int] = None,
+        sort: str = "name",
+        descending: bool = False,
+        q: Optional[str] = None,
+    ) -> Tuple[int, List[MediaEntry]]:
+        """返回 (符合条件的总数, 当前页)；q 按文件名包含匹配，不区分大小写"""
+        self._ensure_loaded()
+        with self._lock:
+            ordered = self._sorted.get(sort)
+            if ordered is None:
+                key = (lambda e: (e.mtime_ns, e.name)) if sort == "date" else (lambda e: e.name)
+                ordered = sorted((self._entries or {}).values(), key=key)
+                self._sorted[sort] = ordered
+        if descending:
+            ordered = ordered[::-1]
+        if q:
+            needle = q.lower()
+            ordered = [e for e in ordered if needle in e.name.lower()]
+        end = None if limit is None else offset + limit
+        return len(ordered), ordered[offset:end]
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            try:
+                self.refresh()
+            except Exception as e:
+                logger.warning(f"扫描媒体目录失败 {self.root}: {e}")
+
+    def start(self) -> None:
+        if self.interval <= 0 or self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="media-scan", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        thread, self._thread = self._thread, None
+        if thread is not None:
+            thread.join(timeout=5)
@@ -0,0 +1,320 @@
+"""数据库结构版本迁移。
+
+所有表结构变更集中在 MIGRATIONS 中按版本号顺序执行，已执行的版本记录在
+schema_version 表里。由启动流程或命令行执行一次，请求路径上不再执行任何 DDL。
+
+用法:
+    python migrations.py            # 迁移到最新版本
+    python migrations.py --status   # 查看当前版本与待执行的迁移
+"""
+import argparse
+import os
+from typing import List, Optional, Tuple
+
+import psycopg2
+
+DB_CONFIG = {
+    "host": os.getenv("PG_HOST", "localhost"),
+    "user": os.getenv("PG_USER", "kaguya"),
+    "password": os.getenv("PG_PASSWORD", "FX7R4Ap3imY7NNzy"),
+    "dbname": os.getenv("PG_DATABASE", "kaguya"),
+    "port": int(os.getenv("PG_PORT", "5432")),
+    "client_encoding": "UTF-8",
+}
+
+# 多个进程同时启动时，用咨询锁保证只有一个在执行迁移
+MIGRATION_LOCK_KEY = 0x4B414755
+
+# 版本 1 汇总此前各服务 ensure_table() 与 Create_DB.py 中的建表逻辑，
+# 既能建新库，也能把旧版本建出来的表（如 config 的 UNIQUE(key)）整理成当前结构
+BASELINE_SQL = """
+CREATE TABLE IF NOT EXISTS renmindaily (
+    id SERIAL PRIMARY KEY,
+    content TEXT NOT NULL,
+    defination TEXT NOT NULL,
+    theme TEXT NOT NULL DEFAULT ''
+);
+ALTER TABLE renmindaily ADD COLUMN IF NOT EXISTS theme TEXT NOT NULL DEFAULT '';
+
+CREATE TABLE IF NOT EXISTS days_master (
+    id BIGSERIAL PRIMARY KEY,
+    content TEXT NOT NULL,
+    time TIMESTAMPTZ NOT NULL,
+    device TEXT NOT NULL DEFAULT 'default'
+);
+ALTER TABLE days_master ADD COLUMN IF NOT EXISTS device TEXT NOT NULL DEFAULT 'default';
+
+CREATE TABLE IF NOT EXISTS config (
+    key TEXT NOT NULL,
+    value TEXT NOT NULL,
+    device TEXT NOT NULL DEFAULT 'default'
+);
+ALTER TABLE config ADD COLUMN IF NOT EXISTS device TEXT NOT NULL DEFAULT 'default';
+ALTER TABLE config ALTER COLUMN device SET DEFAULT 'default';
+ALTER TABLE config DROP CONSTRAINT IF EXISTS config_key_key;
+ALTER TABLE config DROP CONSTRAINT IF EXISTS config_pkey;
+DO $$
+BEGIN
+    IF NOT EXISTS (
+        SELECT 1 FROM pg_constraint WHERE conname = 'config_device_key_key'
+    ) THEN
+        ALTER TABLE config ADD CONSTRAINT config_device_key_key UNIQUE (device, key);
+    END IF;
+END $$;
+INSERT INTO config (device, key, value)
+VALUES
+    ('default', 'mode', 'default'),
+    ('default', 'notice_mode', 'text')
+ON CONFLICT (device, key) DO NOTHING;
+
+CREATE TABLE IF NOT EXISTS video (
+    url TEXT NOT NULL,
+    device TEXT NOT NULL DEFAULT 'default'
+);
+ALTER TABLE video ADD COLUMN IF NOT EXISTS device TEXT NOT NULL DEFAULT 'default';
+ALTER TABLE video DROP CONSTRAINT IF EXISTS video_pkey;
+ALTER TABLE video DROP COLUMN IF EXISTS is_file;
+DO $$
+BEGIN
+    IF NOT EXISTS (
+        SELECT 1 FROM pg_constraint WHERE conname = 'video_device_url_key'
+    ) THEN
+        ALTER TABLE video ADD CONSTRAINT video_device_url_key UNIQUE (device, url);
+    END IF;
+END $$;
+
+CREATE TABLE IF NOT EXISTS notice_text (
+    title TEXT NOT NULL,
+    device TEXT NOT NULL DEFAULT 'default',
+    context TEXT NOT NULL
+);
+ALTER TABLE notice_text ADD COLUMN IF NOT EXISTS device TEXT NOT NULL DEFAULT 'default';
+ALTER TABLE notice_text DROP CONSTRAINT IF EXISTS notice_text_title_key;
+ALTER TABLE notice_text DROP CONSTRAINT IF EXISTS notice_text_pkey;
+ALTER TABLE notice_text DROP CONSTRAINT IF EXISTS notice_text_device_title_key;
+DO $$
+BEGIN
+    IF NOT EXISTS (
+        SELECT 1 FROM pg_constraint WHERE conname = 'notice_text_device_key'
+    ) THEN
+        ALTER TABLE notice_text ADD CONSTRAINT notice_text_device_key UNIQUE (device);
+    END IF;
+END $$;
+INSERT INTO notice_text (device, title, context)
+VALUES ('default', '通知', '这是一条测试通知')
+ON CONFLICT (device) DO NOTHING;
+
+CREATE TABLE IF NOT EXISTS notice_picture (
+    url TEXT NOT NULL,
+    device TEXT NOT NULL DEFAULT 'default'
+);
+ALTER TABLE notice_picture ADD COLUMN IF NOT EXISTS device TEXT NOT NULL DEFAULT 'default';
+ALTER TABLE notice_picture DROP CONSTRAINT IF EXISTS notice_picture_pkey;
+ALTER TABLE notice_picture DROP COLUMN IF EXISTS is_file;
+DO $$
+BEGIN
+    IF NOT EXISTS (
+        SELECT 1 FROM pg_constraint WHERE conname = 'notice_picture_device_key'
+    ) THEN
+        ALTER TABLE notice_picture ADD CONSTRAINT notice_picture_device_key UNIQUE (device);
+    END IF;
+END $$;
+
+CREATE TABLE IF NOT EXISTS device_list (
+    device_id TEXT PRIMARY KEY,
+    remark TEXT NOT NULL DEFAULT ''
+);
+"""
+
+# 批量导入按 content 去重；content 可能很长，超出 btree 单项大小上限，因此对其哈希建索引
+RENMIN_CONTENT_HASH_SQL = """
+CREATE INDEX IF NOT EXISTS renmindaily_content_md5_idx ON renmindaily (md5(content));
+"""
+
+# 金句搜索：pg_trgm 的 GIN 索引让 ILIKE '%关键词%' 走索引，主题数组索引支撑按主题筛选。
+# 部分托管数据库不允许安装扩展，此时跳过 trigram 索引，搜索退化为顺序扫描
+RENMIN_SEARCH_SQL = r"""
+DO $$
+BEGIN
+    CREATE EXTENSION IF NOT EXISTS pg_trgm;
+EXCEPTION WHEN OTHERS THEN
+    RAISE NOTICE 'pg_trgm 不可用，跳过 trigram 索引: %', SQLERRM;
+END $$;
+DO $$
+BEGIN
+    IF EXISTS (SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm') THEN
+        CREATE INDEX IF NOT EXISTS renmindaily_content_trgm_idx
+            ON renmindaily USING gin (content gin_trgm_ops);
+        CREATE INDEX IF NOT EXISTS renmindaily_defination_trgm_idx
+            ON renmindaily USING gin (defination gin_trgm_ops);
+    END IF;
+END $$;
+CREATE INDEX IF NOT EXISTS renmindaily_themes_idx
+    ON renmindaily USING gin (regexp_split_to_array(btrim(theme), '\s*、\s*'));
+"""
+
+# 屏幕按设备取倒数日并按时间排序
+DAYS_DEVICE_TIME_SQL = """
+CREATE INDEX IF NOT EXISTS days_master_device_time_idx ON days_master (device, time);
+"""
+
+# 绕过守护进程直接修改 config（psql、其他脚本）时同样发出变更通知，各进程据此使配置缓存失效；
+# 频道与载荷格式与 events.py 一致，版本号取触发时刻的毫秒时间
+CONFIG_NOTIFY_SQL = """
+CREATE OR REPLACE FUNCTION notify_screen_change() RETURNS trigger AS $$
+DECLARE
+    changed_at BIGINT := floor(extract(epoch FROM clock_timestamp()) * 1000);
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        PERFORM pg_notify('screen_changes', json_build_object(
+            'device', OLD.device, 'resource', TG_ARGV[0], 'version', changed_at, 'origin', 'trigger'
+        )::text);
+    END IF;
+    IF TG_OP = 'INSERT' OR (TG_OP = 'UPDATE' AND NEW.device IS DISTINCT FROM OLD.device) THEN
+        PERFORM pg_notify('screen_changes', json_build_object(
+            'device', NEW.device, 'resource', TG_ARGV[0], 'version', changed_at, 'origin', 'trigger'
+        )::text);
+    END IF;
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql;
+DROP TRIGGER IF EXISTS config_notify_change ON config;
+CREATE TRIGGER config_notify_change
+    AFTER INSERT OR UPDATE OR DELETE ON config
+    FOR EACH ROW EXECUTE PROCEDURE notify_screen_change('config');
+"""
+
+# 本程序的写接口提交后自己会发通知，触发器只为其他途径（管理后台、手工 SQL）的写入补发，
+# 避免每次写入广播两次；application_name 与 db_pool.DAEMON_APPLICATION_NAME 一致
+CONFIG_NOTIFY_SKIP_DAEMON_SQL = """
+CREATE OR REPLACE FUNCTION notify_screen_change() RETURNS trigger AS $$
+DECLARE
+    changed_at BIGINT := floor(extract(epoch FROM clock_timestamp()) * 1000);
+BEGIN
+    IF current_setting('application_name', true) = 'kaguya-daemon' THEN
+        RETURN NULL;
+    END IF;
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        PERFORM pg_notify('screen_changes', json_build_object(
+            'device', OLD.device, 'resource', TG_ARGV[0], 'version', changed_at, 'origin', 'trigger'
+        )::text);
+    END IF;
+    IF TG_OP = 'INSERT' OR (TG_OP = 'UPDATE' AND NEW.device IS DISTINCT FROM OLD.device) THEN
+        PERFORM pg_notify('screen_changes', json_build_object(
+            'device', NEW.device, 'resource', TG_ARGV[0], 'version', changed_at, 'origin', 'trigger'
+        )::text);
+    END IF;
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql;
+"""
+
+# 屏幕心跳：每台设备一行，由 heartbeat.py 批量写入
+DEVICE_STATUS_SQL = """
+CREATE TABLE IF NOT EXISTS device_status (
+    device_id TEXT PRIMARY KEY,
+    last_seen TIMESTAMPTZ NOT NULL,
+    mode TEXT,
+    client_version TEXT,
+    fps REAL
+);
+"""
+
+# (版本号, 名称, SQL)，只允许在末尾追加，已发布的迁移不要修改
+MIGRATIONS: List[Tuple[int, str, str]] = [
+    (1, "baseline", BASELINE_SQL),
+    (2, "renmindaily_content_hash", RENMIN_CONTENT_HASH_SQL),
+    (3, "renmindaily_search", RENMIN_SEARCH_SQL),
+    (4, "days_master_device_time", DAYS_DEVICE_TIME_SQL),
+    (5, "config_notify_trigger", CONFIG_NOTIFY_SQL),
+    (6, "device_status", DEVICE_STATUS_SQL),
+    (7, "config_notify_skip_daemon", CONFIG_NOTIFY_SKIP_DAEMON_SQL),
+]
+
+SCHEMA_VERSION_SQL = """
+CREATE TABLE IF NOT EXISTS schema_version (
+    version INTEGER PRIMARY KEY,
+    name TEXT NOT NULL,
+    applied_at TIMESTAMPTZ NOT NULL DEFAULT now()
+);
+"""
+
+
+def _applied_versions(cur) -> List[int]:
+    cur.execute("SELECT to_regclass('schema_version')")
+    if cur.fetchone()[0] is None:
+        return []
+    cur.execute("SELECT version FROM schema_version ORDER BY version")
+    return [r[0] for r in cur.fetchall()]
+
+
+def current_version(db) -> int:
+    with db.cursor() as cur:
+        applied = _applied_versions(cur)
+    return applied[-1] if applied else 0
+
+
+def pending_migrations(db) -> List[Tuple[int, str, str]]:
+    with db.cursor() as cur:
+        applied = set(_applied_versions(cur))
+    return [m for m in MIGRATIONS if m[0] not in applied]
+
+
+def migrate(db, target: Optional[int] = None) -> List[int]:
+    """把数据库迁移到 target（默认最新）版本，返回本次执行的版本号。
+
+    整个过程在一个事务中完成，任何一步失败都会整体回滚。
+    """
+    previous_autocommit = db.autocommit
+    db.autocommit = False
+    applied_now: List[int] = []
+    try:
+        with db.cursor() as cur:
+            cur.execute("SELECT pg_advisory_xact_lock(%s)", (MIGRATION_LOCK_KEY,))
+            cur.execute(SCHEMA_VERSION_SQL)
+            applied = set(_applied_versions(cur))
+            for version, name, sql in MIGRATIONS:
+                if version in applied:
+                    continue
+                if target is not None and version > target:
+                    break
+                cur.execute(sql)
+                cur.execute(
+                    "INSERT INTO schema_version (version, name) VALUES (%s, %s)",
+                    (version, name),
+                )
+                applied_now.append(version)
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.autocommit = previous_autocommit
+    return applied_now
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="执行数据库结构迁移")
+    parser.add_argument("--status", action="store_true", help="只显示当前版本与待执行的迁移")
+    parser.add_argument("--target", type=int, default=None, help="迁移到指定版本（默认最新）")
+    args = parser.parse_args(argv)
+
+    db = psycopg2.connect(**DB_CONFIG)
+    try:
+        if args.status:
+            print(f"当前版本: {current_version(db)}")
+            for version, name, _ in pending_migrations(db):
+                print(f"待执行: {version} {name}")
+            return
+        applied = migrate(db, target=args.target)
+        if applied:
+            print(f"已执行迁移: {', '.join(str(v) for v in applied)}")
+        else:
+            print("数据库已是最新版本")
+        print(f"当前版本: {current_version(db)}")
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,13 +1,19 @@
 import os
-from contextlib import asynccontextmanager
-from typing import Dict, Any, List
+from contextlib import asynccontextmanager, contextmanager
+from typing import Dict, Any, List, Optional
 
-import psycopg2
-from fastapi import FastAPI, HTTPException, Body
+from fastapi import FastAPI, HTTPException, Body, Request, Response
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
 from psycopg2 import extras
 
+from db_async import AsyncDatabasePool
+from db_pool import DatabasePool, run_read
+from migrations import migrate
+from provisioning import DEFAULT_NOTICE
+from versions import ContentVersions, conditional_get
+
 DB_CONFIG = {
     "host": os.getenv("PG_HOST", "localhost"),
     "user": os.getenv("PG_USER", "kaguya"),
@@ -33,9 +39,21 @@ class NoticeUpdateRequest(BaseModel):
 
 
 class NoticeText:
-    def __init__(self, db_config: Dict[str, Any] = None, db=None) -> None:
+    def __init__(
+        self,
+        db_config: Dict[str, Any] = None,
+        db=None,
+        pool: Optional[DatabasePool] = None,
+        async_pool: Optional[AsyncDatabasePool] = None,
+        versions: Optional[ContentVersions] = None,
+    ) -> None:
         self.db_config = db_config or DB_CONFIG
         self._external_db = db
+        self._owns_pool = pool is None
+        self.pool = pool or DatabasePool(self.db_config)
+        self._owns_async_pool = async_pool is None
+        self.async_pool = async_pool or AsyncDatabasePool(self.db_config)
+        self.versions = versions or ContentVersions()
         self.app = FastAPI(lifespan=self._lifespan)
         self._configure_app()
         self._register_routes()
@@ -49,105 +67,39 @@ class NoticeText:
             allow_headers=["*"],
         )
 
-    def ensure_table(self, db) -> None:
-        create_sql = """
-        CREATE TABLE IF NOT EXISTS notice_text (
-            title TEXT NOT NULL,
-            device TEXT NOT NULL DEFAULT 'default',
-            context TEXT NOT NULL
-        );
-        """
-        alter_device_sql = """
-        ALTER TABLE notice_text
-        ADD COLUMN IF NOT EXISTS device TEXT NOT NULL DEFAULT 'default'
-        """
-        drop_title_unique_sql = """
-        ALTER TABLE notice_text
-        DROP CONSTRAINT IF EXISTS notice_text_title_key
-        """
-        drop_title_pk_sql = """
-        ALTER TABLE notice_text
-        DROP CONSTRAINT IF EXISTS notice_text_pkey
-        """
-        drop_device_title_unique_sql = """
-        ALTER TABLE notice_text
-        DROP CONSTRAINT IF EXISTS notice_text_device_title_key
-        """
-        add_device_unique_sql = """
-        DO $$
-        BEGIN
-            IF NOT EXISTS (
-                SELECT 1
-                FROM pg_constraint
-                WHERE conname = 'notice_text_device_key'
-            ) THEN
-                ALTER TABLE notice_text
-                ADD CONSTRAINT notice_text_device_key UNIQUE (device);
-            END IF;
-        END $$;
-        """
-        insert_default_sql = """
-        INSERT INTO notice_text (device, title, context)
-        VALUES ('default', '通知', '这是一条测试通知')
-        ON CONFLICT (device) DO NOTHING;
-        """
-        with db.cursor() as cur:
-            cur.execute(create_sql)
-            cur.execute(alter_device_sql)
-            cur.execute(drop_title_unique_sql)
-            cur.execute(drop_title_pk_sql)
-            cur.execute(drop_device_title_unique_sql)
-            cur.execute(add_device_unique_sql)
-            cur.execute(insert_default_sql)
-
     @asynccontextmanager
     async def _lifespan(self, app: FastAPI):
-        created_local = False
-        db = self._external_db
-        if db is None:
-            db = psycopg2.connect(**self.db_config)
-            db.set_client_encoding('UTF8')
-            db.autocommit = True
-            created_local = True
-        self.ensure_table(db)
-        app.state.db = db
+        if self._owns_pool:
+            # 独立运行时自行执行迁移；挂载到 main.py 时由主程序在启动时统一执行
+            with self.get_db() as db:
+                migrate(db)
+        if self._owns_async_pool:
+            await self.async_pool.open()
         try:
             yield
         finally:
-            if created_local:
-                try:
-                    db.close()
-                except Exception:
-                    pass
+            if self._owns_async_pool:
+                await self.async_pool.close()
+            if self._owns_pool:
+                self.pool.close()
 
+    @contextmanager
     def get_db(self):
-        db = getattr(self.app.state, "db", None)
-        if db is None or getattr(db, "closed", 1) != 0:
-            db = psycopg2.connect(**self.db_config)
-            db.set_client_encoding('UTF8')
-            db.autocommit = True
-            self.app.state.db = db
-            self.ensure_table(db)
-        else:
-            try:
-                with db.cursor() as cur:
-                    cur.execute("SELECT 1")
-            except Exception:
-                db = psycopg2.connect(**self.db_config)
-                db.set_client_encoding('UTF8')
-                db.autocommit = True
-                self.app.state.db = db
-                self.ensure_table(db)
-        return db
+        """按请求从连接池借出连接，离开上下文时归还"""
+        if self._external_db is not None:
+            yield self._external_db
+            return
+        with self.pool.connection() as db:
+            yield db
 
     def _register_routes(self) -> None:
         app = self.app
         get_db = self.get_db
 
-        @app.get("/", summary="获取通知内容")
-        def get_config(device: str = "default") -> Dict[str, str]:
-            try:
-                db = get_db()
+        def read_notice(device: str) -> Dict[str, str]:
+            """同步读取路径：异步连接池不可用时使用"""
+
+            def query(db):
                 with db.cursor(cursor_factory=extras.RealDictCursor) as cur:
                     cur.execute(
                         """
@@ -161,15 +113,31 @@ class NoticeText:
                     row = cur.fetchone()
                     if row:
                         return {"title": row["title"], "context": row["context"]}
-                    cur.execute(
+                    # 设备尚无通知时返回默认值，首次修改通知时才写入
+                    return dict(DEFAULT_NOTICE)
+
+            return run_read(get_db, query)
+
+        @app.get("/", summary="获取通知内容")
+        async def get_config(request: Request, response: Response, device: str = "default") -> Dict[str, str]:
+            not_modified = conditional_get(request, response, self.versions.get(device, "notice"))
+            if not_modified is not None:
+                return not_modified
+            try:
+                if self.async_pool.available:
+                    row = await self.async_pool.fetchrow(
                         """
-                        INSERT INTO notice_text (device, title, context)
-                        VALUES (%s, %s, %s)
-                        ON CONFLICT (device) DO NOTHING
+                        SELECT title, context
+                        FROM notice_text
+                        WHERE device = %s
+                        LIMIT 1
                         """,
-                        (device, "通知", ""),
+                        (device,),
                     )
-                    return {"title": "通知", "context": ""}
+                    if row:
+                        return {"title": row["title"], "context": row["context"]}
+                    return dict(DEFAULT_NOTICE)
+                return await run_in_threadpool(read_notice, device)
             except Exception as e:
                 raise HTTPException(status_code=500, detail=f"查询失败: {str(e)}")
 
@@ -179,22 +147,23 @@ class NoticeText:
                 raise HTTPException(status_code=400, detail="通知内容不能为空")
             
             try:
-                db = get_db()
-                with db.cursor() as cur:
-                    update_sql = """
-                    INSERT INTO notice_text (device, title, context)
-                    VALUES (%s, %s, %s)
-                    ON CONFLICT (device) DO UPDATE SET title = EXCLUDED.title, context = EXCLUDED.context;
-                    """
-                    cur.execute(
-                        update_sql,
-                        (
-                            notice_data.device.strip(),
-                            notice_data.title.strip(),
-                            notice_data.context.strip(),
-                        ),
-                    )
-                return {"code": 200, "message": "通知内容修改成功", "data": notice_data.dict()}
+                with get_db() as db:
+                    with db.cursor() as cur:
+                        update_sql = """
+                        INSERT INTO notice_text (device, title, context)
+                        VALUES (%s, %s, %s)
+                        ON CONFLICT (device) DO UPDATE SET title = EXCLUDED.title, context = EXCLUDED.context;
+                        """
+                        cur.execute(
+                            update_sql,
+                            (
+                                notice_data.device.strip(),
+                                notice_data.title.strip(),
+                                notice_data.context.strip(),
+                            ),
+                        )
+                    self.versions.bump(notice_data.device.strip(), "notice")
+                    return {"code": 200, "message": "通知内容修改成功", "data": notice_data.dict()}
             except Exception as e:
                 raise HTTPException(status_code=500, detail=f"修改失败: {str(e)}")
 
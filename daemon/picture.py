@@ -1,16 +1,30 @@
-import base64
-import io
+import json
+import logging
 import os
-import shutil
-from contextlib import asynccontextmanager
-from typing import Dict, Any, Optional, List
+from contextlib import asynccontextmanager, contextmanager
+from functools import partial
+from typing import Dict, Any, Literal, Optional, List, Tuple
 
-import psycopg2
-from fastapi import FastAPI, HTTPException, UploadFile, File, Form
+from fastapi import FastAPI, HTTPException, UploadFile, File, Form, Header, Query, Request, Response
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import FileResponse, StreamingResponse
 from psycopg2 import extras
 from pydantic import BaseModel
 
+from content_store import ContentStore
+from db_async import AsyncDatabasePool
+from db_pool import DatabasePool, run_read
+from derivatives import READY, DerivativeQueue
+from media_index import MEDIA_MAX_LIMIT, MediaEntry, MediaIndex
+from migrations import migrate
+from renditions import RenditionStore, render_renditions, rendition_key
+from thumbnails import IMMUTABLE_CACHE_CONTROL, ThumbnailCache, render_thumbnail
+from uploads import UploadSessions
+from versions import ContentVersions, conditional_get
+
+logger = logging.getLogger(__name__)
+
 DB_CONFIG = {
     "host": os.getenv("PG_HOST", "localhost"),
     "user": os.getenv("PG_USER", "kaguya"),
@@ -24,6 +38,11 @@ PICTURE_ROOT = os.getenv("PICTURE_ROOT", r"D:/Kaguya/public/Data/Picture")
 PICTURE_PUBLIC_BASE = os.getenv("PICTURE_PUBLIC_BASE", "http://home.kaguya.lysz.sorasaku.vip/Data/Picture/")
 ALLOWED_IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png", ".gif", ".bmp", ".webp"}
 THUMBNAIL_SIZE = (200, 200)
+PICTURE_MAX_UPLOAD_BYTES = int(os.getenv("PICTURE_MAX_UPLOAD_BYTES", str(64 * 1024 * 1024)))
+# 供屏幕显示的多档尺寸放在图片目录下的该子目录中，与原图一样经 PICTURE_PUBLIC_BASE 对外提供
+PICTURE_RENDITION_SUBDIR = os.getenv("PICTURE_RENDITION_SUBDIR", "renditions")
+# 缩略图缓存目录，默认放在图片目录下的隐藏子目录中（列表只收录文件，不会把它当成图片）
+PICTURE_THUMB_DIR = os.getenv("PICTURE_THUMB_DIR", os.path.join(PICTURE_ROOT, ".thumbs"))
 
 
 def _ensure_picture_dir(create_if_missing: bool = False) -> str:
@@ -40,25 +59,6 @@ def _is_image_file(filename: str) -> bool:
     return ext.lower() in ALLOWED_IMAGE_EXTENSIONS
 
 
-def _build_thumbnail(file_path: str) -> str:
-    try:
-        from PIL import Image
-    except ImportError as exc:
-        raise HTTPException(status_code=500, detail="Pillow未安装，无法生成缩略图") from exc
-
-    try:
-        with Image.open(file_path) as img:
-            img.thumbnail(THUMBNAIL_SIZE)
-            if img.mode not in ("RGB", "RGBA"):
-                img = img.convert("RGBA")
-            buffer = io.BytesIO()
-            img.save(buffer, format="PNG")
-            encoded = base64.b64encode(buffer.getvalue()).decode("ascii")
-            return f"data:image/png;base64,{encoded}"
-    except Exception as exc:
-        raise HTTPException(status_code=500, detail=f"生成缩略图失败: {str(exc)}") from exc
-
-
 def _build_public_url(filename: str) -> str:
     base = PICTURE_PUBLIC_BASE
     if not base.endswith("/"):
@@ -68,9 +68,29 @@ def _build_public_url(filename: str) -> str:
 
 
 class NoticePicture:
-    def __init__(self, db_config: Dict[str, Any] = None, db=None) -> None:
+    def __init__(
+        self,
+        db_config: Dict[str, Any] = None,
+        db=None,
+        pool: Optional[DatabasePool] = None,
+        async_pool: Optional[AsyncDatabasePool] = None,
+        versions: Optional[ContentVersions] = None,
+        derivatives: Optional[DerivativeQueue] = None,
+    ) -> None:
         self.db_config = db_config or DB_CONFIG
         self._external_db = db
+        self._owns_pool = pool is None
+        self.pool = pool or DatabasePool(self.db_config)
+        self._owns_async_pool = async_pool is None
+        self.async_pool = async_pool or AsyncDatabasePool(self.db_config)
+        self.versions = versions or ContentVersions()
+        self.thumbnails = ThumbnailCache(PICTURE_THUMB_DIR, THUMBNAIL_SIZE)
+        self.files = MediaIndex(PICTURE_ROOT, _is_image_file)
+        self.renditions = RenditionStore(os.path.join(PICTURE_ROOT, PICTURE_RENDITION_SUBDIR))
+        self.store = ContentStore(PICTURE_ROOT)
+        self.uploads = UploadSessions(self.store, _is_image_file, PICTURE_MAX_UPLOAD_BYTES, label="图片")
+        self._owns_derivatives = derivatives is None
+        self.derivatives = derivatives or DerivativeQueue()
         self.app = FastAPI(lifespan=self._lifespan)
         self._configure_app()
         self._register_routes()
@@ -80,109 +100,135 @@ class NoticePicture:
             CORSMiddleware,
             allow_origins=["*"],
             allow_credentials=False,
-            allow_methods=["GET", "PUT", "POST", "OPTIONS"], 
+            allow_methods=["GET", "PUT", "POST", "PATCH", "DELETE", "OPTIONS"],
             allow_headers=["*"],
         )
 
-    def ensure_table(self, db) -> None:
-        create_sql = """
-        CREATE TABLE IF NOT EXISTS notice_picture (
-            url TEXT NOT NULL,
-            device TEXT NOT NULL DEFAULT 'default'
-        );
-        """
-        alter_device_sql = """
-        ALTER TABLE notice_picture
-        ADD COLUMN IF NOT EXISTS device TEXT NOT NULL DEFAULT 'default'
-        """
-        drop_pk_sql = """
-        ALTER TABLE notice_picture
-        DROP CONSTRAINT IF EXISTS notice_picture_pkey
-        """
-        add_unique_sql = """
-        DO $$
-        BEGIN
-            IF NOT EXISTS (
-                SELECT 1
-                FROM pg_constraint
-                WHERE conname = 'notice_picture_device_key'
-            ) THEN
-                ALTER TABLE notice_picture
-                ADD CONSTRAINT notice_picture_device_key UNIQUE (device);
-            END IF;
-        END $$;
-        """
-        drop_is_file_sql = """
-        ALTER TABLE notice_picture
-        DROP COLUMN IF EXISTS is_file
-        """
-        with db.cursor() as cur:
-            cur.execute(create_sql)
-            cur.execute(alter_device_sql)
-            cur.execute(drop_pk_sql)
-            cur.execute(add_unique_sql)
-            cur.execute(drop_is_file_sql)
-
     @asynccontextmanager
     async def _lifespan(self, app: FastAPI):
-        created_local = False
-        db = self._external_db
-        if db is None:
-            db = psycopg2.connect(**self.db_config)
-            db.set_client_encoding('UTF8')
-            db.autocommit = True
-            created_local = True
-        self.ensure_table(db)
-        app.state.db = db
+        if self._owns_pool:
+            # 独立运行时自行执行迁移；挂载到 main.py 时由主程序在启动时统一执行
+            with self.get_db() as db:
+                migrate(db)
+        if self._owns_async_pool:
+            await self.async_pool.open()
+        if self._owns_pool:
+            self.files.start()
         try:
             yield
         finally:
-            if created_local:
-                try:
-                    db.close()
-                except Exception:
-                    pass
-
+            if self._owns_pool:
+                self.files.stop()
+            if self._owns_derivatives:
+                self.derivatives.shutdown()
+            if self._owns_async_pool:
+                await self.async_pool.close()
+            if self._owns_pool:
+                self.pool.close()
+
+    @contextmanager
     def get_db(self):
-        db = getattr(self.app.state, "db", None)
-        if db is None or getattr(db, "closed", 1) != 0:
-            db = psycopg2.connect(**self.db_config)
-            db.set_client_encoding('UTF8')
-            db.autocommit = True
-            self.app.state.db = db
-            self.ensure_table(db)
+        """按请求从连接池借出连接，离开上下文时归还"""
+        if self._external_db is not None:
+            yield self._external_db
+            return
+        with self.pool.connection() as db:
+            yield db
+
+    def _thumbnail(self, file_path: str, entry: Optional[MediaEntry] = None) -> Tuple[Optional[str], str]:
+        """返回 (缩略图地址, 状态)；尚未生成时提交到后台进程池，不在请求线程中解码"""
+        if entry is not None:
+            digest = self.store.digest_of(entry.ino)
+            name, ready = self.thumbnails.lookup(file_path, entry.mtime_ns, entry.size, digest)
         else:
-            try:
+            name, ready = self.thumbnails.lookup(file_path)
+        if ready:
+            return f"thumbs/{name}", READY
+        os.makedirs(self.thumbnails.directory, exist_ok=True)
+        status = self.derivatives.submit(
+            name,
+            render_thumbnail,
+            file_path,
+            self.thumbnails.target(name),
+            self.thumbnails.size,
+            self.thumbnails.fmt,
+            on_done=partial(self.thumbnails.add, name),
+        )
+        return None, status
+
+    def _rendition_key(self, entry: MediaEntry) -> str:
+        return rendition_key(entry.name, entry.mtime_ns, entry.size, self.store.digest_of(entry.ino))
+
+    def _schedule_renditions(self, file_path: str, key: str) -> None:
+        if self.renditions.manifest(key) is not None:
+            return
+        os.makedirs(self.renditions.directory, exist_ok=True)
+        self.derivatives.submit(
+            f"renditions:{key}",
+            render_renditions,
+            file_path,
+            self.renditions.directory,
+            key,
+            self.renditions.heights,
+            self.thumbnails.fmt,
+            on_done=partial(self.renditions.mark_ready, key),
+        )
+
+    def _ingest(self, filename: str, replaced: bool = False) -> None:
+        """新文件放入图片目录后登记到索引，并开始生成缩略图与显示尺寸，列表接口与屏幕都无需等待"""
+        target_path = os.path.join(PICTURE_ROOT, filename)
+        entry = self.files.upsert(filename)
+        if entry is None:
+            return
+        self._thumbnail(target_path, entry)
+        self._schedule_renditions(target_path, self._rendition_key(entry))
+        if replaced:
+            self._bump_referencing(filename)
+
+    def _bump_referencing(self, filename: str) -> None:
+        """同名图片被替换后，通知正在使用它的设备重新获取"""
+        try:
+            with self.get_db() as db:
                 with db.cursor() as cur:
-                    cur.execute("SELECT 1")
-            except Exception:
-                db = psycopg2.connect(**self.db_config)
-                db.set_client_encoding('UTF8')
-                db.autocommit = True
-                self.app.state.db = db
-                self.ensure_table(db)
-        return db
-
-    def _ensure_device_placeholder(self, db, device: str) -> None:
-        with db.cursor() as cur:
-            cur.execute(
-                """
-                SELECT 1
-                FROM notice_picture
-                WHERE device = %s
-                LIMIT 1
-                """,
-                (device,),
-            )
-            if cur.fetchone() is None:
-                cur.execute(
-                    """
-                    INSERT INTO notice_picture (url, device)
-                    VALUES (%s, %s)
-                    ON CONFLICT (device) DO NOTHING
-                    """,
-                    ("", device),
-                )
+                    cur.execute("SELECT device FROM notice_picture WHERE url = %s", (_build_public_url(filename),))
+                    devices = [row[0] for row in cur.fetchall()]
+        except Exception as e:
+            logger.warning(f"查询使用图片 {filename} 的设备失败: {e}")
+            return
+        for device in devices:
+            self.versions.bump(device, "picture")
+
+    def display(self, url: Optional[str], width: Optional[int], height: Optional[int]) -> Dict[str, Optional[str]]:
+        """把库中的原图地址换成适合设备分辨率的一档，并附上模糊占位图；/screen/state 也经此返回图片"""
+        if not url:
+            return {"url": None}
+        result = {"url": url, "original": url, "placeholder": None}
+        base = _build_public_url("")
+        name = url[len(base):] if url.startswith(base) else ""
+        entry = self.files.get(name) if name else None
+        if entry is None:
+            return result
+        key = self._rendition_key(entry)
+        manifest = self.renditions.manifest(key)
+        if manifest is None:
+            # 功能上线前上传的图片在首次被读取时补生成
+            self._schedule_renditions(os.path.join(PICTURE_ROOT, name), key)
+            return result
+        result["placeholder"] = manifest["placeholder"]
+        chosen = RenditionStore.choose(manifest, width, height)
+        if chosen:
+            result["url"] = _build_public_url(f"{PICTURE_RENDITION_SUBDIR}/{chosen}")
+        return result
+
+    def _file_item(self, picture_dir: str, entry: MediaEntry) -> Dict[str, Any]:
+        thumbnail, status = self._thumbnail(os.path.join(picture_dir, entry.name), entry)
+        return {
+            "filename": entry.name,
+            "size": entry.size,
+            "modified": entry.modified,
+            "thumbnail": thumbnail,
+            "status": status,
+        }
 
     def _register_routes(self) -> None:
         app = self.app
@@ -192,15 +238,10 @@ class NoticePicture:
             device: str
             filename: str
 
-        @app.get("/", summary="获取图片URL", response_description="返回当前的图片URL")
-        def get_video(device: str = "default") -> Dict[str, Optional[str]]:
-            """
-            获取当前存储的图片URL（兼容原接口路径 / ）
-            返回格式: {"url": "当前的图片地址"}
-            """
-            try:
-                db = get_db()
-                self._ensure_device_placeholder(db, device)
+        def read_picture(device: str) -> Dict[str, Optional[str]]:
+            """同步读取路径：异步连接池不可用时使用"""
+
+            def query(db):
                 with db.cursor(cursor_factory=extras.RealDictCursor) as cur:
                     cur.execute(
                         """
@@ -218,8 +259,41 @@ class NoticePicture:
                     if row and row["url"]:
                         return {"url": row["url"]}
                     return {"url": None}
+
+            return run_read(get_db, query)
+
+        @app.get("/", summary="获取图片URL", response_description="返回当前的图片URL")
+        async def get_video(
+            request: Request,
+            response: Response,
+            device: str = "default",
+            width: Optional[int] = Query(None, ge=1, description="设备显示区域的宽度（物理像素）"),
+            height: Optional[int] = Query(None, ge=1, description="设备显示区域的高度（物理像素）"),
+        ) -> Dict[str, Optional[str]]:
+            """
+            获取当前存储的图片URL（兼容原接口路径 / ）
+            返回格式: {"url": "适合该分辨率的图片地址", "original": "原图地址", "placeholder": "data:image/jpeg;base64,..."}
+            显示尺寸尚未生成时 url 即原图、placeholder 为 null；未设置图片时只返回 {"url": null}
+            """
+            # 显示尺寸生成完成后 generation 递增，屏幕下次请求即可换用
+            tag = f"{self.versions.get(device, 'picture')}-{width or 0}x{height or 0}-{self.renditions.generation}"
+            not_modified = conditional_get(request, response, tag)
+            if not_modified is not None:
+                return not_modified
+            try:
+                if self.async_pool.available:
+                    # notice_picture 以 device 唯一；设备尚无记录与未设置图片一样返回 None
+                    row = await self.async_pool.fetchrow(
+                        "SELECT url FROM notice_picture WHERE device = %s LIMIT 1",
+                        (device,),
+                    )
+                    url = (row["url"] if row is not None else "") or ""
+                    current = {"url": url if url.startswith("http") else None}
+                else:
+                    current = await run_in_threadpool(read_picture, device)
             except Exception as e:
                 raise HTTPException(status_code=500, detail=f"查询失败: {str(e)}")
+            return await run_in_threadpool(self.display, current["url"], width, height)
 
         @app.put("/", summary="修改图片URL", response_description="返回修改后的图片URL")
         def update_picture_url(payload: PictureUrlUpdate) -> Dict[str, str]:
@@ -238,77 +312,121 @@ class NoticePicture:
 
             full_url = _build_public_url(safe_name)
             try:
-                db = get_db()
-                self._ensure_device_placeholder(db, payload.device)
-                with db.cursor() as cur:
-                    cur.execute(
-                        """
-                        DELETE FROM notice_picture
-                        WHERE device = %s
-                        AND url LIKE 'http%%'
-                        """,
-                        (payload.device,),
-                    )
-                    cur.execute(
-                        """
-                        INSERT INTO notice_picture (url, device)
-                        VALUES (%s, %s)
-                        ON CONFLICT (device) DO UPDATE SET url = EXCLUDED.url
-                        """,
-                        (full_url, payload.device),
-                    )
-                
-                return {"url": full_url}
+                with get_db() as db:
+                    with db.cursor() as cur:
+                        cur.execute(
+                            """
+                            DELETE FROM notice_picture
+                            WHERE device = %s
+                            AND url LIKE 'http%%'
+                            """,
+                            (payload.device,),
+                        )
+                        cur.execute(
+                            """
+                            INSERT INTO notice_picture (url, device)
+                            VALUES (%s, %s)
+                            ON CONFLICT (device) DO UPDATE SET url = EXCLUDED.url
+                            """,
+                            (full_url, payload.device),
+                        )
+                    self.versions.bump(payload.device, "picture")
+
+                    return {"url": full_url}
             except Exception as e:
                 raise HTTPException(status_code=500, detail=f"更新失败: {str(e)}")
 
         @app.get("/files", summary="获取图片文件及缩略图", response_description="返回文件名与缩略图")
-        def list_pictures() -> Dict[str, List[Dict[str, str]]]:
+        def list_pictures(
+            offset: int = Query(0, ge=0, description="跳过的条数"),
+            limit: Optional[int] = Query(None, ge=1, le=MEDIA_MAX_LIMIT, description="每页条数，默认返回全部"),
+            sort: Literal["name", "date"] = Query("name", description="按文件名或修改时间排序"),
+            order: Literal["asc", "desc"] = Query("asc"),
+            q: Optional[str] = Query(None, description="文件名包含的关键词"),
+            format: Literal["json", "ndjson"] = Query("json", description="ndjson 时逐行流式输出"),
+        ):
             """
-            获取图片目录下所有图片的文件名与缩略图
-            返回格式: {"items": [{"filename": "...", "thumbnail": "data:image/png;base64,..."}]}
+            获取图片目录下图片的文件名、大小、修改时间与缩略图地址（来自内存索引）
+            - json: 返回 {"total": 1, "items": [{"filename": "...", "size": 1, "modified": "...", "thumbnail": "thumbs/<key>.webp", "status": "ready"}]}
+            - ndjson: 每行一个条目，边生成边输出
+            thumbnail 相对于本服务根路径；尚未生成完的条目 thumbnail 为 null，status 为 pending（失败为 failed）
             """
             picture_dir = _ensure_picture_dir()
-            items: List[Dict[str, str]] = []
-            for filename in sorted(os.listdir(picture_dir)):
-                if not _is_image_file(filename):
-                    continue
-                file_path = os.path.join(picture_dir, filename)
-                if not os.path.isfile(file_path):
-                    continue
-                thumbnail = _build_thumbnail(file_path)
-                items.append({"filename": filename, "thumbnail": thumbnail})
-            return {"items": items}
+            total, entries = self.files.query(offset, limit, sort, order == "desc", q)
+            if format == "ndjson":
+
+                def stream():
+                    for entry in entries:
+                        yield json.dumps(self._file_item(picture_dir, entry), ensure_ascii=False) + "\n"
+
+                return StreamingResponse(
+                    stream(), media_type="application/x-ndjson", headers={"X-Total-Count": str(total)}
+                )
+            return {"total": total, "items": [self._file_item(picture_dir, entry) for entry in entries]}
+
+        @app.get("/thumbs/{name}", summary="获取缩略图")
+        def get_thumbnail(name: str):
+            path = self.thumbnails.path_for(name)
+            if path is None or not os.path.isfile(path):
+                raise HTTPException(status_code=404, detail="缩略图不存在")
+            return FileResponse(
+                path,
+                media_type=self.thumbnails.media_type,
+                headers={"Cache-Control": IMMUTABLE_CACHE_CONTROL},
+            )
 
         @app.post("/upload", summary="上传图片", response_description="返回上传后的文件名")
         async def upload_picture(
             file: UploadFile = File(..., description="上传的图片文件"),
+            replace: bool = Form(False, description="同名文件已存在时是否替换"),
         ) -> Dict[str, str]:
             """
-            上传图片到指定目录
+            上传图片到指定目录（一次性上传；大文件请使用 /uploads 分块上传）
+            同名文件已存在且未要求替换时保留原文件
             返回格式: {"filename": "上传后的文件名"}
             """
-            if not file.filename:
-                raise HTTPException(status_code=400, detail="文件名不能为空")
+            safe_name, stored = await self.uploads.save(file, replace)
+            if stored:
+                await run_in_threadpool(self._ingest, safe_name, replace)
+            return {"filename": safe_name}
 
-            safe_name = os.path.basename(file.filename)
-            if not _is_image_file(safe_name):
-                raise HTTPException(status_code=400, detail="仅支持图片格式")
-
-            picture_dir = _ensure_picture_dir(create_if_missing=True)
-            target_path = os.path.join(picture_dir, safe_name)
-            if not os.path.exists(target_path):
-                try:
-                    with open(target_path, "wb") as target:
-                        shutil.copyfileobj(file.file, target)
-                except Exception as exc:
-                    raise HTTPException(status_code=500, detail=f"上传失败: {str(exc)}") from exc
-                finally:
-                    await file.close()
-            else:
-                await file.close()
+        class UploadCreate(BaseModel):
+            filename: str
+            size: int
+            replace: bool = False
 
-            return {"filename": safe_name}
+        @app.post("/uploads", summary="创建分块上传", response_description="返回上传 ID 与建议的块大小")
+        def create_upload(payload: UploadCreate) -> Dict[str, Any]:
+            """
+            创建可续传的上传会话，文件名与大小不合格时直接拒绝（400/413），不传输任何数据
+            返回格式: {"upload_id": "...", "filename": "...", "size": 1, "offset": 0, "chunk_size": 8388608}
+            """
+            return self.uploads.create(payload.filename, payload.size, payload.replace)
+
+        @app.get("/uploads/{upload_id}", summary="查询上传进度")
+        def get_upload(upload_id: str) -> Dict[str, Any]:
+            """断线后据 offset 继续上传"""
+            return self.uploads.status(upload_id)
+
+        @app.patch("/uploads/{upload_id}", summary="上传一块数据")
+        async def upload_chunk(
+            upload_id: str,
+            request: Request,
+            upload_offset: int = Header(..., alias="Upload-Offset", ge=0, description="本块在文件中的起始偏移"),
+        ) -> Dict[str, Any]:
+            """
+            请求体为原始字节，从 Upload-Offset 处追加；偏移不一致时返回 409 并在 Upload-Offset 头中给出正确偏移
+            返回格式: {"offset": 1, "size": 1, "filename": "...", "replace": false, "complete": false, "stored": false}
+            """
+            result = await self.uploads.receive(upload_id, upload_offset, request.stream())
+            if result["stored"]:
+                await run_in_threadpool(self._ingest, result["filename"], result["replace"])
+            return result
+
+        @app.delete("/uploads/{upload_id}", summary="取消上传")
+        def abort_upload(upload_id: str) -> Dict[str, str]:
+            self.uploads.abort(upload_id)
+            return {"upload_id": upload_id}
 
 
 api = NoticePicture()
@@ -0,0 +1,38 @@
+import threading
+from typing import Dict, Set
+
+# 设备尚无记录时读接口返回的默认值，与注册/首次写入时落库的默认行一致
+DEFAULT_CONFIG: Dict[str, str] = {"mode": "default", "notice_mode": "text"}
+DEFAULT_NOTICE: Dict[str, str] = {"title": "通知", "context": ""}
+
+PROVISION_SQL = """
+INSERT INTO config (device, key, value)
+VALUES
+    (%s, 'mode', 'default'),
+    (%s, 'notice_mode', 'text')
+ON CONFLICT (device, key) DO NOTHING
+"""
+
+
+class DeviceProvisioner:
+    """为设备写入默认配置行，并在进程内记录已初始化的设备。
+
+    读接口不再写库，设备尚无记录时直接返回内存中的默认值；
+    初始化只在设备注册或首次写入时执行，之后的写入跳过这一步。
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._known: Set[str] = set()
+
+    def is_known(self, device: str) -> bool:
+        with self._lock:
+            return device in self._known
+
+    def ensure(self, cur, device: str) -> None:
+        """在调用方的游标上写入默认行；本进程已初始化过的设备直接返回"""
+        if self.is_known(device):
+            return
+        cur.execute(PROVISION_SQL, (device, device))
+        with self._lock:
+            self._known.add(device)
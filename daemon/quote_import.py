@@ -0,0 +1,216 @@
+"""金句批量导入。
+
+CSV（可带 content,defination,theme 表头，否则按该顺序取列）或 NDJSON（每行一个对象）
+经 COPY 流式写入临时表，再一次性插入 renmindaily，按 content 去重：
+文件内重复的只保留第一条，库中已有的跳过。
+
+用法:
+    python quote_import.py quotes.csv
+    python quote_import.py quotes.ndjson --format ndjson
+"""
+import argparse
+import csv
+import io
+import json
+import os
+import time
+from typing import Dict, Iterable, Iterator, List, Optional, TextIO, Tuple
+
+import psycopg2
+
+from events import NOTIFY_CHANNEL
+from versions import GLOBAL_DEVICE
+
+DB_CONFIG = {
+    "host": os.getenv("PG_HOST", "localhost"),
+    "user": os.getenv("PG_USER", "kaguya"),
+    "password": os.getenv("PG_PASSWORD", "FX7R4Ap3imY7NNzy"),
+    "dbname": os.getenv("PG_DATABASE", "kaguya"),
+    "port": int(os.getenv("PG_PORT", "5432")),
+    "client_encoding": "UTF-8",
+}
+
+IMPORT_FORMATS = ("csv", "ndjson")
+FIELDS = ("content", "defination", "theme")
+# 同时只允许一个导入任务写入，保证并发导入之间也能按 content 去重
+IMPORT_LOCK_KEY = 0x4B414756
+
+Row = Tuple[str, str, str]
+
+STAGE_SQL = """
+CREATE TEMP TABLE renmin_import (
+    ord BIGSERIAL,
+    content TEXT NOT NULL,
+    defination TEXT NOT NULL,
+    theme TEXT NOT NULL
+) ON COMMIT DROP
+"""
+
+COPY_SQL = "COPY renmin_import (content, defination, theme) FROM STDIN WITH (FORMAT csv)"
+
+MERGE_SQL = """
+INSERT INTO renmindaily (content, defination, theme)
+SELECT content, defination, theme
+FROM (
+    SELECT DISTINCT ON (content) ord, content, defination, theme
+    FROM renmin_import
+    ORDER BY content, ord
+) AS d
+WHERE NOT EXISTS (
+    SELECT 1
+    FROM renmindaily r
+    WHERE md5(r.content) = md5(d.content)
+      AND r.content = d.content
+)
+ORDER BY ord
+"""
+
+
+def detect_format(filename: Optional[str], content_type: Optional[str] = None) -> str:
+    name = (filename or "").lower()
+    if name.endswith((".ndjson", ".jsonl")) or "ndjson" in (content_type or ""):
+        return "ndjson"
+    return "csv"
+
+
+def _normalize(content, defination, theme) -> Optional[Row]:
+    content = str(content or "").strip()
+    if not content:
+        return None
+    return content, str(defination or "").strip(), str(theme or "").strip()
+
+
+def parse_csv(stream: TextIO) -> Iterator[Optional[Row]]:
+    reader = csv.reader(stream)
+    columns: Optional[List[int]] = None
+    for record in reader:
+        if not record:
+            continue
+        if columns is None:
+            header = [c.strip().lower() for c in record]
+            columns = [header.index(f) if f in header else -1 for f in FIELDS]
+            if columns[0] >= 0:
+                continue
+            # 没有表头时按 content, defination, theme 的顺序取列
+            columns = [0, 1, 2]
+        values = [record[i] if 0 <= i < len(record) else "" for i in columns]
+        yield _normalize(*values)
+
+
+def parse_ndjson(stream: TextIO) -> Iterator[Optional[Row]]:
+    for line in stream:
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            item = json.loads(line)
+        except ValueError:
+            yield None
+            continue
+        if not isinstance(item, dict):
+            yield None
+            continue
+        yield _normalize(item.get("content"), item.get("defination"), item.get("theme"))
+
+
+class _CopySource:
+    """把解析出的行按需编码成 CSV 供 copy_expert 读取，不在内存中拼出整个文件"""
+
+    def __init__(self, rows: Iterable[Optional[Row]]) -> None:
+        self._rows = iter(rows)
+        self._buffer = ""
+        self._out = io.StringIO()
+        self._writer = csv.writer(self._out, lineterminator="\n")
+        self.received = 0
+        self.invalid = 0
+
+    def _encode(self, row: Row) -> str:
+        self._out.seek(0)
+        self._out.truncate()
+        self._writer.writerow(row)
+        return self._out.getvalue()
+
+    def read(self, size: int = -1) -> str:
+        while size < 0 or len(self._buffer) < size:
+            try:
+                row = next(self._rows)
+            except StopIteration:
+                break
+            self.received += 1
+            if row is None:
+                self.invalid += 1
+                continue
+            self._buffer += self._encode(row)
+        if size < 0:
+            size = len(self._buffer)
+        chunk, self._buffer = self._buffer[:size], self._buffer[size:]
+        return chunk
+
+
+def import_quotes(db, stream: TextIO, fmt: str = "csv") -> Dict[str, int]:
+    """在一个事务中导入，返回 {"received", "inserted", "skipped", "invalid"}"""
+    if fmt not in IMPORT_FORMATS:
+        raise ValueError(f"不支持的导入格式: {fmt}")
+    rows = parse_ndjson(stream) if fmt == "ndjson" else parse_csv(stream)
+    source = _CopySource(rows)
+
+    previous_autocommit = db.autocommit
+    db.autocommit = False
+    try:
+        with db.cursor() as cur:
+            cur.execute("SELECT pg_advisory_xact_lock(%s)", (IMPORT_LOCK_KEY,))
+            cur.execute(STAGE_SQL)
+            cur.copy_expert(COPY_SQL, source)
+            cur.execute(MERGE_SQL)
+            inserted = cur.rowcount
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.autocommit = previous_autocommit
+
+    return {
+        "received": source.received,
+        "inserted": inserted,
+        # 文件内重复或库中已存在
+        "skipped": source.received - source.invalid - inserted,
+        # content 为空或无法解析的行
+        "invalid": source.invalid,
+    }
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="批量导入金句（CSV 或 NDJSON）")
+    parser.add_argument("file", help="待导入的文件")
+    parser.add_argument("--format", choices=IMPORT_FORMATS, default=None, help="文件格式，默认按扩展名判断")
+    args = parser.parse_args(argv)
+
+    fmt = args.format or detect_format(args.file)
+    started = time.monotonic()
+    db = psycopg2.connect(**DB_CONFIG)
+    try:
+        with open(args.file, "r", encoding="utf-8-sig", newline="") as f:
+            result = import_quotes(db, f, fmt)
+        if result["inserted"]:
+            # 通知运行中的服务刷新金句索引与屏幕版本
+            payload = {
+                "device": GLOBAL_DEVICE,
+                "resource": "renmin",
+                "version": int(time.time() * 1000),
+                "origin": "quote_import",
+            }
+            with db.cursor() as cur:
+                cur.execute("SELECT pg_notify(%s, %s)", (NOTIFY_CHANNEL, json.dumps(payload)))
+            db.commit()
+    finally:
+        db.close()
+    print(
+        f"读取 {result['received']} 行，新增 {result['inserted']} 条，"
+        f"跳过重复 {result['skipped']} 条，无效 {result['invalid']} 行，"
+        f"耗时 {time.monotonic() - started:.2f}s"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,155 @@
+import asyncio
+import random
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+from fastapi.concurrency import run_in_threadpool
+from psycopg2 import extras
+
+from db_async import AsyncDatabasePool
+from db_pool import run_read
+from versions import GLOBAL_DEVICE, ContentVersions
+
+# 主题字段可包含多个主题，以顿号分隔
+THEME_SEPARATOR = "、"
+# 按其中任一主题精确匹配，与 split_themes() 的拆分规则一致，可使用 renmindaily_themes_idx 索引
+THEME_FILTER_SQL = r"regexp_split_to_array(btrim(theme), '\s*、\s*') @> ARRAY[%s::text]"
+# 最多为多少个 (设备, 主题) 组合保留洗牌进度，超出后淘汰最久未用的
+MAX_DECKS = 1000
+
+INDEX_SQL = "SELECT id, theme FROM renmindaily ORDER BY id ASC"
+ROW_SQL = "SELECT id, content, defination, theme FROM renmindaily WHERE id = %s"
+
+
+def split_themes(theme: Optional[str]) -> List[str]:
+    return [t.strip() for t in (theme or "").split(THEME_SEPARATOR) if t.strip()]
+
+
+class QuoteIndex:
+    """金句 id 的内存索引，随机抽取只需一次主键查询。
+
+    索引记录它对应的 renmin 版本号，增删改（含其他进程经 NOTIFY 同步来的）
+    使版本前进后，下一次抽取时重新加载 id 与主题。
+    """
+
+    def __init__(self, versions: ContentVersions, get_db, async_pool: AsyncDatabasePool) -> None:
+        self.versions = versions
+        self.get_db = get_db
+        self.async_pool = async_pool
+        self._lock = threading.Lock()
+        self._loaded_version: Optional[int] = None
+        self._ids: List[int] = []
+        self._by_theme: Dict[str, List[int]] = {}
+        self._id_set: frozenset = frozenset()
+        self._theme_sets: Dict[str, frozenset] = {}
+        # 失效后并发的请求只由第一个去重新加载，其余等它完成
+        self._reload_lock = asyncio.Lock()
+        # (设备, 主题) -> (剩余未播放的 id, 上一次播放的 id)
+        self._decks: "OrderedDict[Tuple[str, str], Tuple[List[int], Optional[int]]]" = OrderedDict()
+
+    def _read_index(self) -> List[Dict[str, Any]]:
+        def query(db):
+            with db.cursor(cursor_factory=extras.RealDictCursor) as cur:
+                cur.execute(INDEX_SQL)
+                return cur.fetchall()
+
+        return run_read(self.get_db, query)
+
+    def _read_row(self, item_id: int) -> Optional[Dict[str, Any]]:
+        def query(db):
+            with db.cursor(cursor_factory=extras.RealDictCursor) as cur:
+                cur.execute(ROW_SQL, (item_id,))
+                return cur.fetchone()
+
+        return run_read(self.get_db, query)
+
+    def _load(self, rows: List[Dict[str, Any]], version: int) -> None:
+        ids: List[int] = []
+        by_theme: Dict[str, List[int]] = {}
+        for row in rows:
+            ids.append(row["id"])
+            for theme in split_themes(row["theme"]):
+                by_theme.setdefault(theme, []).append(row["id"])
+        with self._lock:
+            self._ids = ids
+            self._by_theme = by_theme
+            self._id_set = frozenset(ids)
+            self._theme_sets = {theme: frozenset(theme_ids) for theme, theme_ids in by_theme.items()}
+            self._loaded_version = version
+
+    async def ensure_loaded(self) -> None:
+        """索引落后于当前 renmin 版本时重新加载"""
+        # 先取版本再查库：加载期间若有写入，版本会再次前进，下次调用会再加载一次
+        version = self.versions.get(GLOBAL_DEVICE, "renmin")
+        if self._loaded_version == version:
+            return
+        async with self._reload_lock:
+            version = self.versions.get(GLOBAL_DEVICE, "renmin")
+            if self._loaded_version == version:
+                return
+            if self.async_pool.available:
+                rows = await self.async_pool.fetch(INDEX_SQL)
+            else:
+                rows = await run_in_threadpool(self._read_index)
+            self._load(rows, version)
+
+    def invalidate(self) -> None:
+        with self._lock:
+            self._loaded_version = None
+
+    def count(self, theme: Optional[str] = None) -> int:
+        with self._lock:
+            return len(self._by_theme.get(theme, [])) if theme else len(self._ids)
+
+    def themes(self) -> Dict[str, int]:
+        with self._lock:
+            return {theme: len(ids) for theme, ids in sorted(self._by_theme.items())}
+
+    def pick(self, device: str = "default", theme: Optional[str] = None, shuffle: bool = False) -> Optional[int]:
+        """抽取一个 id；shuffle 时同一设备在该主题下播完全部金句前不会重复"""
+        with self._lock:
+            candidates = self._by_theme.get(theme, []) if theme else self._ids
+            allowed = self._theme_sets.get(theme, frozenset()) if theme else self._id_set
+            if not candidates:
+                return None
+            if not shuffle:
+                return random.choice(candidates)
+
+            key = (device, theme or "")
+            deck, last = self._decks.pop(key, ([], None))
+            # 洗牌后新增、删除或改了主题的金句：不再属于该主题的跳过，新增的在下一轮进入
+            while deck and deck[-1] not in allowed:
+                deck.pop()
+            if not deck:
+                deck = list(candidates)
+                random.shuffle(deck)
+                # 避免新一轮的第一条恰好是上一轮的最后一条
+                if len(deck) > 1 and deck[-1] == last:
+                    deck[0], deck[-1] = deck[-1], deck[0]
+            item_id = deck.pop()
+            self._decks[key] = (deck, item_id)
+            while len(self._decks) > MAX_DECKS:
+                self._decks.popitem(last=False)
+            return item_id
+
+    async def fetch(self, item_id: int) -> Optional[Dict[str, Any]]:
+        if self.async_pool.available:
+            return await self.async_pool.fetchrow(ROW_SQL, (item_id,))
+        return await run_in_threadpool(self._read_row, item_id)
+
+    async def random_quote(
+        self, device: str = "default", theme: Optional[str] = None, shuffle: bool = False
+    ) -> Optional[Dict[str, Any]]:
+        await self.ensure_loaded()
+        item_id = self.pick(device, theme, shuffle)
+        if item_id is None:
+            return None
+        row = await self.fetch(item_id)
+        if row is None:
+            # 其他进程刚删除了这一条而通知尚未到达：重新加载后再抽一次
+            self.invalidate()
+            await self.ensure_loaded()
+            item_id = self.pick(device, theme, shuffle)
+            row = await self.fetch(item_id) if item_id is not None else None
+        return row
@@ -0,0 +1,135 @@
+import base64
+import hashlib
+import io
+import json
+import os
+import threading
+import uuid
+from typing import Any, Dict, Iterable, Optional, Tuple
+
+# 为通知图片生成的显示尺寸（按高度，像素），原图不高于某档时不生成该档
+PICTURE_RENDITION_HEIGHTS = tuple(
+    sorted(int(h) for h in os.getenv("PICTURE_RENDITIONS", "720,1080,2160").split(",") if h.strip())
+)
+RENDITION_QUALITY = int(os.getenv("RENDITION_QUALITY", "82"))
+# 设备未上报分辨率时按 1080p 屏幕挑选
+DEFAULT_DISPLAY_HEIGHT = 1080
+# 模糊占位图的最长边（像素），以 data URI 内联在响应里
+PLACEHOLDER_SIZE = 16
+
+_FORMATS = {"webp": ("WEBP", ".webp"), "jpeg": ("JPEG", ".jpg")}
+
+Manifest = Dict[str, Any]
+
+
+def rendition_key(name: str, mtime_ns: int, size: int, digest: Optional[str] = None) -> str:
+    """已知内容哈希时按内容取键，重复的图片共用一套；否则按文件名与状态取键，同名文件被替换后键随之变化"""
+    if digest is not None:
+        return digest[:16]
+    return hashlib.sha1(f"{name}|{mtime_ns}|{size}".encode("utf-8")).hexdigest()[:16]
+
+
+def _save_atomic(img, target: str, pil_format: str, **params) -> None:
+    tmp = f"{target}.{uuid.uuid4().hex}.tmp"
+    try:
+        img.save(tmp, format=pil_format, **params)
+        os.replace(tmp, target)
+    except Exception:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+
+
+def render_renditions(source: str, directory: str, key: str, heights: Iterable[int], fmt: str) -> None:
+    """生成各档显示尺寸与模糊占位图，最后写入 <key>.json 清单；在子进程中执行。
+
+    动图不生成任何一档（缩放后只剩第一帧），清单里只有占位图，屏幕始终使用原图。
+    """
+    from PIL import Image, ImageOps
+
+    pil_format, ext = _FORMATS[fmt]
+    heights = sorted(heights)
+    with Image.open(source) as img:
+        if getattr(img, "is_animated", False):
+            heights = []
+        # JPEG 可在解码时直接按 1/2、1/4… 缩小，20MB 的手机照片不必按原尺寸解码
+        if heights:
+            img.draft("RGB", (heights[-1], heights[-1]))
+        img = ImageOps.exif_transpose(img)
+        if img.mode not in ("RGB", "RGBA") or pil_format == "JPEG":
+            img = img.convert("RGB")
+        width, height = img.size
+        renditions = []
+        for target in heights:
+            if target >= height:
+                break
+            scaled = img.resize((max(1, round(width * target / height)), target), Image.LANCZOS)
+            filename = f"{key}-{target}{ext}"
+            _save_atomic(scaled, os.path.join(directory, filename), pil_format, quality=RENDITION_QUALITY)
+            renditions.append({"file": filename, "width": scaled.width, "height": scaled.height})
+
+        tiny = img.convert("RGB")
+        tiny.thumbnail((PLACEHOLDER_SIZE, PLACEHOLDER_SIZE))
+        buffer = io.BytesIO()
+        tiny.save(buffer, format="JPEG", quality=50)
+        placeholder = "data:image/jpeg;base64," + base64.b64encode(buffer.getvalue()).decode("ascii")
+
+    manifest = {"renditions": renditions, "placeholder": placeholder}
+    target = os.path.join(directory, f"{key}.json")
+    tmp = f"{target}.{uuid.uuid4().hex}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(manifest, f)
+    os.replace(tmp, target)
+
+
+class RenditionStore:
+    """通知图片显示尺寸派生文件的清单缓存与挑选。
+
+    清单由 render_renditions() 在后台进程中写到磁盘，这里按键缓存在内存中；
+    generation 在任一清单就绪时递增，读接口把它计入 ETag，屏幕据此换用新生成的尺寸。
+    """
+
+    def __init__(self, directory: str, heights: Tuple[int, ...] = PICTURE_RENDITION_HEIGHTS) -> None:
+        self.directory = directory
+        self.heights = heights
+        self.generation = 0
+        self._lock = threading.Lock()
+        self._manifests: Dict[str, Manifest] = {}
+
+    def manifest(self, key: str) -> Optional[Manifest]:
+        with self._lock:
+            cached = self._manifests.get(key)
+        if cached is not None:
+            return cached
+        path = os.path.join(self.directory, f"{key}.json")
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                loaded = json.load(f)
+        except (OSError, ValueError):
+            return None
+        with self._lock:
+            self._manifests[key] = loaded
+        return loaded
+
+    def mark_ready(self, key: str) -> None:
+        with self._lock:
+            self._manifests.pop(key, None)
+            self.generation += 1
+
+    @staticmethod
+    def choose(manifest: Manifest, width: Optional[int], height: Optional[int]) -> Optional[str]:
+        """挑选等比缩放放进设备显示区域后不需要放大的最小一档。
+
+        图片按比例完整放进 width x height 时，宽或高总有一边顶满；某档的宽达到 width 或高达到 height，
+        放进去时就不需要放大（竖图在横屏上只需高度够）。
+        返回 None 表示使用原图：各档都不够大时（原图比任何一档都大），或没有生成任何一档时。
+        """
+        renditions = manifest["renditions"]
+        if not renditions:
+            return None
+        want_w = width or 0
+        want_h = height or (0 if width else DEFAULT_DISPLAY_HEIGHT)
+        for item in renditions:
+            if (want_w and item["width"] >= want_w) or (want_h and item["height"] >= want_h):
+                return item["file"]
+        return None
@@ -1,13 +1,23 @@
-from fastapi import FastAPI, HTTPException, Path
-from contextlib import asynccontextmanager
+from fastapi import FastAPI, HTTPException, Path, Query, UploadFile, File, Form
+from fastapi.concurrency import run_in_threadpool
+from contextlib import asynccontextmanager, contextmanager
 from pydantic import BaseModel
-from typing import Optional, Dict, Any, List
+from typing import Optional, Dict, Any, List, Literal
 from fastapi.staticfiles import StaticFiles
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse
+import io
+import json
 import os
-import psycopg2
 from psycopg2 import extras
 
+from db_async import AsyncDatabasePool
+from db_pool import DatabasePool, run_read
+from migrations import migrate
+from quote_import import IMPORT_FORMATS, detect_format, import_quotes
+from quote_index import THEME_FILTER_SQL, QuoteIndex
+from versions import GLOBAL_DEVICE, ContentVersions
+
 DB_CONFIG = {
     "host": os.getenv("PG_HOST", "localhost"),
     "user": os.getenv("PG_USER", "screen"),
@@ -17,6 +27,23 @@ DB_CONFIG = {
     "client_encoding": "UTF-8",
 }
 
+LIST_DEFAULT_LIMIT = 100
+LIST_MAX_LIMIT = 1000
+# ndjson 流式输出时每次从服务端游标取回的行数
+LIST_STREAM_BATCH = 500
+SEARCH_DEFAULT_LIMIT = 20
+SEARCH_MAX_LIMIT = 100
+
+
+def serialize_row(row) -> Dict[str, Any]:
+    return {
+        "id": row["id"],
+        "content": row["content"],
+        "defination": row["defination"],
+        "theme": row["theme"],
+    }
+
+
 class AddRequest(BaseModel):
     content: str
     defination: Optional[str] = None
@@ -31,10 +58,27 @@ class UpdateRequest(BaseModel):
 class RenminDaily:
     """可复用的人民日报服务封装，可在其他程序中导入使用。"""
 
-    def __init__(self, db_config: Dict[str, Any] = None, public_dir: str = "public", db=None) -> None:
+    def __init__(
+        self,
+        db_config: Dict[str, Any] = None,
+        public_dir: str = "public",
+        db=None,
+        pool: Optional[DatabasePool] = None,
+        async_pool: Optional[AsyncDatabasePool] = None,
+        versions: Optional[ContentVersions] = None,
+    ) -> None:
         self.db_config = db_config or DB_CONFIG
         self.public_dir = public_dir
         self._external_db = db
+        self._owns_pool = pool is None
+        self.pool = pool or DatabasePool(self.db_config)
+        self._owns_async_pool = async_pool is None
+        self.async_pool = async_pool or AsyncDatabasePool(self.db_config)
+        self.versions = versions or ContentVersions()
+        # 随机抽取用的 id 索引，增删改使 renmin 版本前进后自动重新加载
+        self.quotes = QuoteIndex(self.versions, self.get_db, self.async_pool)
+        # 数据库是否装有 pg_trgm，首次搜索时检测
+        self._trgm: Optional[bool] = None
         self.app = FastAPI(lifespan=self._lifespan)
         self._configure_app()
         self._register_routes()
@@ -49,85 +93,68 @@ class RenminDaily:
         )
         self.app.mount("/public", StaticFiles(directory=self.public_dir), name="public")
 
-    def ensure_table(self, db) -> None:
-        create_sql = """
-        CREATE TABLE IF NOT EXISTS renmindaily (
-            id SERIAL PRIMARY KEY,
-            content TEXT NOT NULL,
-            defination TEXT NOT NULL,
-            theme TEXT NOT NULL DEFAULT ''
-        );
-        """
-        alter_sql = "ALTER TABLE renmindaily ADD COLUMN IF NOT EXISTS theme TEXT NOT NULL DEFAULT ''"
-        with db.cursor() as cur:
-            cur.execute(create_sql)
-            cur.execute(alter_sql)
-
     @asynccontextmanager
     async def _lifespan(self, app: FastAPI):
-        created_local = False
-        db = self._external_db
-        if db is None:
-            db = psycopg2.connect(**self.db_config)
-            db.set_client_encoding('UTF8')
-            db.autocommit = True
-            created_local = True
-        self.ensure_table(db)
-        app.state.db = db
+        if self._owns_pool:
+            # 独立运行时自行执行迁移；挂载到 main.py 时由主程序在启动时统一执行
+            with self.get_db() as db:
+                migrate(db)
+        if self._owns_async_pool:
+            await self.async_pool.open()
         print("PostgreSQL 数据库连接成功！")
         try:
             yield
         finally:
-            if created_local:
-                try:
-                    db.close()
-                except Exception:
-                    pass
+            if self._owns_async_pool:
+                await self.async_pool.close()
+            if self._owns_pool:
+                self.pool.close()
 
+    @contextmanager
     def get_db(self):
-        db = getattr(self.app.state, "db", None)
-        if db is None or getattr(db, "closed", 1) != 0:
-            db = psycopg2.connect(**self.db_config)
-            db.set_client_encoding('UTF8')
-            db.autocommit = True
-            self.app.state.db = db
-        else:
-            try:
-                with db.cursor() as cur:
-                    cur.execute("SELECT 1")
-            except Exception:
-                db = psycopg2.connect(**self.db_config)
-                db.set_client_encoding('UTF8')
-                db.autocommit = True
-                self.app.state.db = db
-        return db
+        """按请求从连接池借出连接，离开上下文时归还"""
+        if self._external_db is not None:
+            yield self._external_db
+            return
+        with self.pool.connection() as db:
+            yield db
 
     def _register_routes(self) -> None:
         app = self.app
         get_db = self.get_db
 
         @app.get("/", include_in_schema=False)
-        def get_random_renmin():
-            """随机返回一条数据，包含 id、content、defination、theme"""
+        async def get_random_renmin(
+            device: str = "default",
+            theme: Optional[str] = None,
+            shuffle: bool = False,
+        ):
+            """
+            随机返回一条数据，包含 id、content、defination、theme
+            - theme: 只在该主题下抽取
+            - shuffle: 同一设备播完全部金句前不重复
+            """
             try:
-                db = get_db()
-                with db.cursor(cursor_factory=extras.RealDictCursor) as cur:
-                    sql = """
-                        SELECT id, content, defination, theme
-                        FROM renmindaily
-                        ORDER BY RANDOM()
-                        LIMIT 1
-                    """
-                    cur.execute(sql)
-                    row = cur.fetchone()
-                    if not row:
-                        raise HTTPException(status_code=404, detail="表中暂无数据")
-                    return {
-                        "id": row["id"],
-                        "content": row["content"],
-                        "defination": row["defination"],
-                        "theme": row["theme"],
-                    }
+                row = await self.quotes.random_quote(device, theme=theme, shuffle=shuffle)
+                if not row:
+                    raise HTTPException(status_code=404, detail="表中暂无数据")
+                return {
+                    "id": row["id"],
+                    "content": row["content"],
+                    "defination": row["defination"],
+                    "theme": row["theme"],
+                }
+            except HTTPException:
+                raise
+            except Exception as e:
+                raise HTTPException(status_code=500, detail=f"查询失败: {str(e)}")
+
+        @app.get("/themes")
+        async def get_themes():
+            """返回全部主题及各主题下的金句数量"""
+            try:
+                await self.quotes.ensure_loaded()
+                return self.quotes.themes()
             except Exception as e:
                 raise HTTPException(status_code=500, detail=f"查询失败: {str(e)}")
 
@@ -137,50 +164,183 @@ class RenminDaily:
             defn = payload.defination or ""
             thm = payload.theme or ""
             try:
-                db = get_db()
-                with db.cursor(cursor_factory=extras.RealDictCursor) as cur:
-                    sql = "INSERT INTO renmindaily (content, defination, theme) VALUES (%s, %s, %s) RETURNING id"
-                    cur.execute(sql, (payload.content, defn, thm))
-                    row = cur.fetchone()
-                    new_id = row["id"]
-                    return {
-                        "id": new_id,
-                        "content": payload.content,
-                        "defination": defn,
-                        "theme": thm,
-                    }
+                with get_db() as db:
+                    with db.cursor(cursor_factory=extras.RealDictCursor) as cur:
+                        sql = "INSERT INTO renmindaily (content, defination, theme) VALUES (%s, %s, %s) RETURNING id"
+                        cur.execute(sql, (payload.content, defn, thm))
+                        row = cur.fetchone()
+                        new_id = row["id"]
+                        self.versions.bump(GLOBAL_DEVICE, "renmin")
+                        return {
+                            "id": new_id,
+                            "content": payload.content,
+                            "defination": defn,
+                            "theme": thm,
+                        }
             except Exception as e:
                 raise HTTPException(status_code=500, detail=f"新增失败: {str(e)}")
 
-        @app.get("/list")
-        def get_all_renmin():
-            """获取表中所有数据，返回列表形式，每条包含 id、content、defination、theme"""
+        def list_sql(after_id: int, theme: Optional[str], limit: Optional[int]):
+            conditions = ["id > %s"]
+            params: List[Any] = [after_id]
+            if theme:
+                conditions.append(THEME_FILTER_SQL)
+                params.append(theme)
+            sql = f"""
+                SELECT id, content, defination, theme
+                FROM renmindaily
+                WHERE {' AND '.join(conditions)}
+                ORDER BY id ASC
+            """
+            if limit is not None:
+                sql += " LIMIT %s"
+                params.append(limit)
+            return sql, params
+
+        def stream_renmin(sql: str, params: List[Any]):
+            # 服务端游标分批取数，内存占用与表大小无关；命名游标需要在事务中使用
+            with get_db() as db:
+                db.autocommit = False
+                try:
+                    with db.cursor(name="renmin_list", cursor_factory=extras.RealDictCursor) as cur:
+                        cur.itersize = LIST_STREAM_BATCH
+                        cur.execute(sql, params)
+                        for row in cur:
+                            yield json.dumps(serialize_row(row), ensure_ascii=False) + "\n"
+                finally:
+                    db.rollback()
+                    db.autocommit = True
+
+        @app.post("/import", status_code=201)
+        def import_renmin(
+            file: UploadFile = File(..., description="CSV 或 NDJSON 文件"),
+            format: Optional[str] = Form(None, description="csv 或 ndjson，默认按文件名判断"),
+        ):
+            """批量导入，按 content 去重，返回读取、新增、跳过与无效的行数"""
+            fmt = format or detect_format(file.filename, file.content_type)
+            if fmt not in IMPORT_FORMATS:
+                raise HTTPException(status_code=400, detail=f"不支持的导入格式: {fmt}")
+            stream = io.TextIOWrapper(file.file, encoding="utf-8-sig", newline="")
             try:
-                db = get_db()
+                with get_db() as db:
+                    result = import_quotes(db, stream, fmt)
+            except UnicodeDecodeError:
+                raise HTTPException(status_code=400, detail="文件需为 UTF-8 编码")
+            except Exception as e:
+                raise HTTPException(status_code=500, detail=f"导入失败: {str(e)}")
+            if result["inserted"]:
+                self.versions.bump(GLOBAL_DEVICE, "renmin")
+            return result
+
+        @app.get("/list")
+        async def get_all_renmin(
+            after_id: int = Query(0, ge=0, description="只返回 id 大于该值的记录"),
+            limit: Optional[int] = Query(None, ge=1, le=LIST_MAX_LIMIT, description="每页条数"),
+            theme: Optional[str] = Query(None, description="只返回包含该主题的记录"),
+            format: Literal["json", "ndjson"] = Query("json", description="ndjson 时逐行流式输出"),
+        ):
+            """
+            按 id 升序分页获取数据，每条包含 id、content、defination、theme
+            - json: 返回 {"total", "data", "next_after_id"}，取下一页时把 next_after_id 作为 after_id 传入
+            - ndjson: 每行一条记录，未指定 limit 时输出全部
+            """
+            if format == "ndjson":
+                sql, params = list_sql(after_id, theme, limit)
+                return StreamingResponse(stream_renmin(sql, params), media_type="application/x-ndjson")
+
+            page_size = limit or LIST_DEFAULT_LIMIT
+            sql, params = list_sql(after_id, theme, page_size)
+
+            def query(db):
                 with db.cursor(cursor_factory=extras.RealDictCursor) as cur:
-                    sql = """
-                        SELECT id, content, defination, theme
-                        FROM renmindaily
-                        ORDER BY id ASC
-                    """
-                    cur.execute(sql)
-                    rows = cur.fetchall()
-                    result = [
-                        {
-                            "id": row["id"],
-                            "content": row["content"],
-                            "defination": row["defination"],
-                            "theme": row["theme"]
-                        }
-                        for row in rows
-                    ]
-                    return {
-                        "total": len(result),
-                        "data": result
-                    }
+                    cur.execute(sql, params)
+                    return [serialize_row(row) for row in cur.fetchall()]
+
+            try:
+                # 总数取自内存索引，无需 COUNT(*)
+                await self.quotes.ensure_loaded()
+                if self.async_pool.available:
+                    rows = await self.async_pool.fetch(sql, params)
+                    result = [serialize_row(row) for row in rows]
+                else:
+                    result = await run_in_threadpool(run_read, get_db, query)
+                return {
+                    "total": self.quotes.count(theme),
+                    "data": result,
+                    "next_after_id": result[-1]["id"] if len(result) == page_size else None,
+                }
             except Exception as e:
                 raise HTTPException(status_code=500, detail=f"查询所有数据失败: {str(e)}")
 
+        async def has_trgm() -> bool:
+            if self._trgm is None:
+                sql = "SELECT EXISTS (SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm') AS found"
+
+                def query(db):
+                    with db.cursor() as cur:
+                        cur.execute(sql)
+                        return cur.fetchone()[0]
+
+                if self.async_pool.available:
+                    self._trgm = bool((await self.async_pool.fetchrow(sql))["found"])
+                else:
+                    self._trgm = bool(await run_in_threadpool(run_read, get_db, query))
+            return self._trgm
+
+        @app.get("/search")
+        async def search_renmin(
+            q: str = Query("", description="在 content 与 defination 中查找的关键词"),
+            theme: Optional[str] = Query(None, description="只返回包含该主题的记录"),
+            limit: int = Query(SEARCH_DEFAULT_LIMIT, ge=1, le=SEARCH_MAX_LIMIT),
+        ):
+            """
+            按关键词与主题搜索，正文命中的排在释义命中的前面，其后按相似度排序
+            返回格式: {"data": [...]}
+            """
+            q = q.strip()
+            if not q and not theme:
+                raise HTTPException(status_code=400, detail="请提供关键词或主题")
+
+            conditions: List[str] = []
+            params: List[Any] = []
+            pattern = "%" + q.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+            if q:
+                conditions.append("(content ILIKE %s OR defination ILIKE %s)")
+                params += [pattern, pattern]
+            if theme:
+                conditions.append(THEME_FILTER_SQL)
+                params.append(theme)
+            order = "id ASC"
+            try:
+                if q and await has_trgm():
+                    order = "(content ILIKE %s) DESC, similarity(content, %s) DESC, id ASC"
+                    params += [pattern, q]
+                elif q:
+                    # 没有 pg_trgm 时以正文长度近似相似度：命中相同时越短越贴题
+                    order = "(content ILIKE %s) DESC, length(content) ASC, id ASC"
+                    params.append(pattern)
+                sql = f"""
+                    SELECT id, content, defination, theme
+                    FROM renmindaily
+                    WHERE {' AND '.join(conditions)}
+                    ORDER BY {order}
+                    LIMIT %s
+                """
+                params.append(limit)
+
+                def query(db):
+                    with db.cursor(cursor_factory=extras.RealDictCursor) as cur:
+                        cur.execute(sql, params)
+                        return cur.fetchall()
+
+                if self.async_pool.available:
+                    rows = await self.async_pool.fetch(sql, params)
+                else:
+                    rows = await run_in_threadpool(run_read, get_db, query)
+                return {"data": [serialize_row(row) for row in rows]}
+            except Exception as e:
+                raise HTTPException(status_code=500, detail=f"搜索失败: {str(e)}")
+
         @app.put("/update/{item_id}")
         def update_renmin(
             item_id: int = Path(..., gt=0, description="要编辑的记录ID"),
@@ -193,30 +353,31 @@ class RenminDaily:
                 raise HTTPException(status_code=400, detail="未提供任何需要更新的字段")
             
             try:
-                db = get_db()
-                # 先检查记录是否存在
-                with db.cursor(cursor_factory=extras.RealDictCursor) as cur:
-                    cur.execute("SELECT id FROM renmindaily WHERE id = %s", (item_id,))
-                    if not cur.fetchone():
-                        raise HTTPException(status_code=404, detail=f"ID为{item_id}的记录不存在")
+                with get_db() as db:
+                    # 先检查记录是否存在
+                    with db.cursor(cursor_factory=extras.RealDictCursor) as cur:
+                        cur.execute("SELECT id FROM renmindaily WHERE id = %s", (item_id,))
+                        if not cur.fetchone():
+                            raise HTTPException(status_code=404, detail=f"ID为{item_id}的记录不存在")
                     
-                    # 构建更新SQL
-                    set_clause = ", ".join([f"{k} = %s" for k in update_fields.keys()])
-                    sql = f"UPDATE renmindaily SET {set_clause} WHERE id = %s RETURNING id, content, defination, theme"
-                    params = list(update_fields.values()) + [item_id]
+                        # 构建更新SQL
+                        set_clause = ", ".join([f"{k} = %s" for k in update_fields.keys()])
+                        sql = f"UPDATE renmindaily SET {set_clause} WHERE id = %s RETURNING id, content, defination, theme"
+                        params = list(update_fields.values()) + [item_id]
                     
-                    cur.execute(sql, params)
-                    updated_row = cur.fetchone()
-                    
-                    return {
-                        "msg": "更新成功",
-                        "data": {
-                            "id": updated_row["id"],
-                            "content": updated_row["content"],
-                            "defination": updated_row["defination"],
-                            "theme": updated_row["theme"]
+                        cur.execute(sql, params)
+                        updated_row = cur.fetchone()
+                        self.versions.bump(GLOBAL_DEVICE, "renmin")
+
+                        return {
+                            "msg": "更新成功",
+                            "data": {
+                                "id": updated_row["id"],
+                                "content": updated_row["content"],
+                                "defination": updated_row["defination"],
+                                "theme": updated_row["theme"]
+                            }
                         }
-                    }
             except HTTPException:
                 raise
             except Exception as e:
@@ -228,19 +389,20 @@ class RenminDaily:
         ):
             """删除指定ID的记录"""
             try:
-                db = get_db()
-                with db.cursor(cursor_factory=extras.RealDictCursor) as cur:
-                    # 先检查记录是否存在
-                    cur.execute("SELECT id FROM renmindaily WHERE id = %s", (item_id,))
-                    if not cur.fetchone():
-                        raise HTTPException(status_code=404, detail=f"ID为{item_id}的记录不存在")
-                    
-                    # 执行删除
-                    cur.execute("DELETE FROM renmindaily WHERE id = %s", (item_id,))
-                    if cur.rowcount == 0:
-                        raise HTTPException(status_code=500, detail="删除操作执行失败")
+                with get_db() as db:
+                    with db.cursor(cursor_factory=extras.RealDictCursor) as cur:
+                        # 先检查记录是否存在
+                        cur.execute("SELECT id FROM renmindaily WHERE id = %s", (item_id,))
+                        if not cur.fetchone():
+                            raise HTTPException(status_code=404, detail=f"ID为{item_id}的记录不存在")
                     
-                    return {"msg": f"ID为{item_id}的记录已成功删除"}
+                        # 执行删除
+                        cur.execute("DELETE FROM renmindaily WHERE id = %s", (item_id,))
+                        if cur.rowcount == 0:
+                            raise HTTPException(status_code=500, detail="删除操作执行失败")
+                        self.versions.bump(GLOBAL_DEVICE, "renmin")
+
+                        return {"msg": f"ID为{item_id}的记录已成功删除"}
             except HTTPException:
                 raise
             except Exception as e:
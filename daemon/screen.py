@@ -0,0 +1,238 @@
+import json
+import os
+from contextlib import asynccontextmanager, contextmanager
+from typing import Any, Dict, Optional
+
+from fastapi import FastAPI, HTTPException, Query, Request, Response
+from fastapi.concurrency import run_in_threadpool
+from fastapi.middleware.cors import CORSMiddleware
+
+from db_async import AsyncDatabasePool
+from days_master import annotate_days, local_today
+from db_pool import DatabasePool, run_read
+from migrations import migrate
+from provisioning import DEFAULT_CONFIG, DEFAULT_NOTICE
+from quote_index import QuoteIndex
+from versions import ContentVersions, conditional_get
+
+DB_CONFIG = {
+    "host": os.getenv("PG_HOST", "localhost"),
+    "user": os.getenv("PG_USER", "kaguya"),
+    "password": os.getenv("PG_PASSWORD", "FX7R4Ap3imY7NNzy"),
+    "dbname": os.getenv("PG_DATABASE", "kaguya"),
+    "port": int(os.getenv("PG_PORT", "5432")),
+    "client_encoding": "UTF-8",
+}
+
+# 屏幕状态由这些按设备区分的资源组成，外加全局的天气（版本取自天气文件，见 WeatherService.version）
+SCREEN_RESOURCES = ("config", "notice", "picture", "video", "days")
+
+# 一条语句取齐整屏数据：一次往返、同一快照，各 JSON 列以文本返回，同步/异步两条路径解析方式一致
+STATE_SQL = """
+SELECT
+    (
+        SELECT json_object_agg(key, value)
+        FROM config
+        WHERE device = %s
+    )::text AS config,
+    (
+        SELECT json_build_object('title', title, 'context', context)
+        FROM notice_text
+        WHERE device = %s
+        LIMIT 1
+    )::text AS notice,
+    (
+        SELECT url
+        FROM notice_picture
+        WHERE device = %s
+          AND url LIKE 'http%%'
+        LIMIT 1
+    ) AS picture,
+    (
+        SELECT url
+        FROM video
+        WHERE device = %s
+          AND url <> ''
+          AND url LIKE 'http%%'
+        ORDER BY ctid DESC
+        LIMIT 1
+    ) AS video,
+    (
+        SELECT json_agg(
+            json_build_object('id', id, 'content', content, 'time', time::date)
+            ORDER BY time ASC
+        )
+        FROM days_master
+        WHERE device = %s
+          AND content <> ''
+    )::text AS days,
+    (
+        SELECT json_build_object('id', id, 'content', content, 'defination', defination, 'theme', theme)
+        FROM renmindaily
+        WHERE id = %s
+    )::text AS quote
+"""
+
+
+def _load_json(value: Optional[str]) -> Any:
+    return json.loads(value) if value else None
+
+
+class ScreenService:
+    """聚合屏幕刷新所需的全部数据，一次请求返回。"""
+
+    def __init__(
+        self,
+        db_config: Dict[str, Any] = None,
+        db=None,
+        pool: Optional[DatabasePool] = None,
+        async_pool: Optional[AsyncDatabasePool] = None,
+        versions: Optional[ContentVersions] = None,
+        weather=None,
+        quotes: Optional[QuoteIndex] = None,
+        pictures=None,
+    ) -> None:
+        self.db_config = db_config or DB_CONFIG
+        self._external_db = db
+        self._owns_pool = pool is None
+        self.pool = pool or DatabasePool(self.db_config)
+        self._owns_async_pool = async_pool is None
+        self.async_pool = async_pool or AsyncDatabasePool(self.db_config)
+        self.versions = versions or ContentVersions()
+        self.weather = weather
+        # 通知图片按设备分辨率换成合适的一档（NoticePicture.display），未提供时返回原图地址
+        self.pictures = pictures
+        self.quotes = quotes or QuoteIndex(self.versions, self.get_db, self.async_pool)
+        self.app = FastAPI(lifespan=self._lifespan)
+        self._configure_app()
+        self._register_routes()
+
+    def _configure_app(self) -> None:
+        self.app.add_middleware(
+            CORSMiddleware,
+            allow_origins=["*"],
+            allow_credentials=False,
+            allow_methods=["GET", "OPTIONS"],
+            allow_headers=["*"],
+        )
+
+    @asynccontextmanager
+    async def _lifespan(self, app: FastAPI):
+        if self._owns_pool:
+            # 独立运行时自行执行迁移；挂载到 main.py 时由主程序在启动时统一执行
+            with self.get_db() as db:
+                migrate(db)
+        if self._owns_async_pool:
+            await self.async_pool.open()
+        try:
+            yield
+        finally:
+            if self._owns_async_pool:
+                await self.async_pool.close()
+            if self._owns_pool:
+                self.pool.close()
+
+    @contextmanager
+    def get_db(self):
+        """按请求从连接池借出连接，离开上下文时归还"""
+        if self._external_db is not None:
+            yield self._external_db
+            return
+        with self.pool.connection() as db:
+            yield db
+
+    def version(self, device: str) -> int:
+        # 倒数日剩余天数随日期变化，把当天日期计入版本，跨过零点后屏幕会重新拉取
+        combined = self.versions.combined(device, SCREEN_RESOURCES)
+        if self.weather is not None:
+            combined += self.weather.version()
+        if self.pictures is not None:
+            # 显示尺寸生成完成后换用，与 /picture/ 一样计入 generation
+            combined += self.pictures.renditions.generation
+        return combined + local_today().toordinal()
+
+    def _read_weather(self) -> Optional[Dict[str, Any]]:
+        if self.weather is None:
+            return None
+        try:
+            return self.weather.read_now()
+        except Exception:
+            return None
+
+    @staticmethod
+    def build_state(row: Dict[str, Any]) -> Dict[str, Any]:
+        config = dict(DEFAULT_CONFIG)
+        config.update(_load_json(row["config"]) or {})
+        return {
+            "config": config,
+            "notice": _load_json(row["notice"]) or dict(DEFAULT_NOTICE),
+            "video": row["video"] or None,
+            "days": annotate_days(_load_json(row["days"]) or [], local_today()),
+            "quote": _load_json(row["quote"]),
+        }
+
+    def _picture(self, url: Optional[str], width: Optional[int], height: Optional[int]) -> Dict[str, Optional[str]]:
+        if self.pictures is None:
+            return {"url": url or None}
+        return self.pictures.display(url, width, height)
+
+    def _register_routes(self) -> None:
+        app = self.app
+        get_db = self.get_db
+
+        def read_state(params) -> Dict[str, Any]:
+            def query(db):
+                with db.cursor() as cur:
+                    cur.execute(STATE_SQL, params)
+                    names = [c.name for c in cur.description]
+                    return dict(zip(names, cur.fetchone()))
+
+            return run_read(get_db, query)
+
+        @app.get("/state", summary="获取整屏状态")
+        async def get_state(
+            request: Request,
+            response: Response,
+            device: str = "default",
+            since: Optional[int] = None,
+            theme: Optional[str] = None,
+            width: Optional[int] = Query(None, ge=1, description="通知图片显示区域的宽度（物理像素）"),
+            height: Optional[int] = Query(None, ge=1, description="通知图片显示区域的高度（物理像素）"),
+        ) -> Dict[str, Any]:
+            """
+            一次返回配置、通知、图片、视频、倒数日、金句与天气
+            - since: 上次拿到的 version，未变化时只返回 {"version": ..., "changed": false}
+            - theme: 金句只在该主题下抽取；同一设备播完全部金句前不重复
+            - width / height: 图片与 /picture/ 一样按该尺寸挑选显示尺寸，picture 为 {"url", "original", "placeholder"}
+            """
+            # 先取版本再查库：查询期间若有写入，版本会再次递增，屏幕下次轮询即可拿到
+            version = self.version(device)
+            if since is not None and since == version:
+                return {"device": device, "version": version, "changed": False}
+            not_modified = conditional_get(request, response, f"{version}-{width or 0}x{height or 0}")
+            if not_modified is not None:
+                return not_modified
+            try:
+                await self.quotes.ensure_loaded()
+                params = (device,) * 5 + (self.quotes.pick(device, theme, shuffle=True),)
+                if self.async_pool.available:
+                    row = await self.async_pool.fetchrow(STATE_SQL, params)
+                else:
+                    row = await run_in_threadpool(read_state, params)
+            except Exception as e:
+                raise HTTPException(status_code=500, detail=f"查询失败: {str(e)}")
+
+            state = self.build_state(row)
+            state["picture"] = await run_in_threadpool(self._picture, row["picture"], width, height)
+            state["weather"] = self._read_weather()
+            return {"device": device, "version": version, "changed": True, **state}
+
+
+api = ScreenService()
+app = api.app
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    uvicorn.run(app, host="0.0.0.0", port=9004)
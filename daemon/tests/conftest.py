@@ -0,0 +1,5 @@
+import os
+import sys
+
+# 守护进程的模块按顶层模块导入（与 main.py 相同），测试从 daemon 目录之外运行时也能找到
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
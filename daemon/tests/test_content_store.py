@@ -0,0 +1,55 @@
+import hashlib
+import os
+
+from content_store import ContentStore
+
+
+def _upload(root: str, data: bytes, name: str) -> str:
+    tmp = os.path.join(root, f"{name}.part")
+    with open(tmp, "wb") as f:
+        f.write(data)
+    return tmp
+
+
+def _files(root: str):
+    return sorted(
+        os.path.relpath(os.path.join(dirpath, name), root)
+        for dirpath, _, names in os.walk(root)
+        for name in names
+    )
+
+
+def test_store_without_hardlinks_keeps_one_copy(tmp_path, monkeypatch):
+    def no_link(*args, **kwargs):
+        raise OSError("hard links not supported")
+
+    monkeypatch.setattr(os, "link", no_link)
+    root = str(tmp_path)
+    store = ContentStore(root)
+    data = b"picture"
+    digest = hashlib.sha256(data).hexdigest()
+
+    assert store.store(_upload(root, data, "a"), digest, "a.png")
+    assert _files(root) == ["a.png"]
+
+    # 关闭去重后的上传同样直接落到目标文件
+    assert store.store(_upload(root, b"other", "b"), hashlib.sha256(b"other").hexdigest(), "b.png")
+    assert _files(root) == ["a.png", "b.png"]
+
+    assert not store.store(_upload(root, b"new", "c"), hashlib.sha256(b"new").hexdigest(), "a.png")
+    assert store.store(_upload(root, b"new", "d"), hashlib.sha256(b"new").hexdigest(), "a.png", replace=True)
+    assert _files(root) == ["a.png", "b.png"]
+    with open(os.path.join(root, "a.png"), "rb") as f:
+        assert f.read() == b"new"
+
+
+def test_store_deduplicates_with_hardlinks(tmp_path):
+    root = str(tmp_path)
+    store = ContentStore(root)
+    data = b"picture"
+    digest = hashlib.sha256(data).hexdigest()
+
+    assert store.store(_upload(root, data, "a"), digest, "a.png")
+    assert store.store(_upload(root, data, "b"), digest, "b.png")
+    assert os.stat(store.path_for(digest)).st_nlink == 3
+    assert store.digest_of(os.stat(os.path.join(root, "b.png")).st_ino) == digest
@@ -0,0 +1,56 @@
+import json
+import os
+
+from PIL import Image
+
+from renditions import RenditionStore, render_renditions
+
+MANIFEST = {
+    "renditions": [
+        {"file": "k-720.webp", "width": 960, "height": 720},
+        {"file": "k-1080.webp", "width": 1440, "height": 1080},
+        {"file": "k-2160.webp", "width": 2880, "height": 2160},
+    ],
+    "placeholder": "data:image/jpeg;base64,",
+}
+
+
+def test_choose_smallest_rendition_that_fits():
+    assert RenditionStore.choose(MANIFEST, 800, 600) == "k-720.webp"
+    assert RenditionStore.choose(MANIFEST, 1920, 1080) == "k-1080.webp"
+    # 竖屏只需宽度够
+    assert RenditionStore.choose(MANIFEST, 1080, 1920) == "k-1080.webp"
+
+
+def test_choose_original_when_no_rendition_is_large_enough():
+    # 原图（例如 4000x3000）比任何一档都大，放大最大一档反而更模糊
+    assert RenditionStore.choose(MANIFEST, 3840, 2880) is None
+    assert RenditionStore.choose({"renditions": [], "placeholder": None}, 800, 600) is None
+
+
+def _manifest(directory, key):
+    with open(os.path.join(directory, f"{key}.json"), "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def test_render_renditions_for_still_image(tmp_path):
+    source = str(tmp_path / "still.png")
+    Image.new("RGB", (1600, 1200), "red").save(source)
+
+    render_renditions(source, str(tmp_path), "still", (720, 1080, 2160), "webp")
+
+    manifest = _manifest(str(tmp_path), "still")
+    assert [r["height"] for r in manifest["renditions"]] == [720, 1080]
+    assert manifest["placeholder"].startswith("data:image/jpeg;base64,")
+
+
+def test_render_renditions_skips_animated_gif(tmp_path):
+    source = str(tmp_path / "anim.gif")
+    frames = [Image.new("RGB", (1600, 1200), color) for color in ("red", "blue")]
+    frames[0].save(source, save_all=True, append_images=frames[1:], duration=100, loop=0)
+
+    render_renditions(source, str(tmp_path), "anim", (720, 1080, 2160), "webp")
+
+    manifest = _manifest(str(tmp_path), "anim")
+    assert manifest["renditions"] == []
+    assert not [name for name in os.listdir(tmp_path) if name.startswith("anim-")]
@@ -0,0 +1,19 @@
+from PIL import Image
+
+from thumbnails import render_thumbnail
+
+# EXIF Orientation 6：手机竖拿拍摄，像素按横图存储，显示时需顺时针旋转 90 度
+_ORIENTATION = 0x0112
+
+
+def test_render_thumbnail_applies_exif_orientation(tmp_path):
+    source = str(tmp_path / "phone.jpg")
+    exif = Image.Exif()
+    exif[_ORIENTATION] = 6
+    Image.new("RGB", (400, 200), "red").save(source, exif=exif)
+    target = str(tmp_path / "thumb.jpg")
+
+    render_thumbnail(source, target, (100, 100), "jpeg")
+
+    with Image.open(target) as thumb:
+        assert thumb.size == (50, 100)
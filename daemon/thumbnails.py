@@ -0,0 +1,169 @@
+import hashlib
+import os
+import re
+import threading
+import uuid
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+# 缩略图按 (源文件路径, 修改时间, 大小, 尺寸, 格式) 取键写入磁盘，源文件不变时不再解码
+THUMB_CACHE_MAX_BYTES = int(os.getenv("THUMB_CACHE_MAX_BYTES", str(200 * 1024 * 1024)))
+# webp 或 jpeg；Pillow 不支持 WebP 时自动改用 JPEG
+THUMB_FORMAT = os.getenv("THUMB_FORMAT", "webp").lower()
+THUMB_QUALITY = int(os.getenv("THUMB_QUALITY", "80"))
+# 键由源文件状态决定，内容变化即换名，浏览器可以永久缓存
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+_NAME_PATTERN = re.compile(r"^[0-9a-f]{32}\.(webp|jpg)$")
+_FORMATS = {"webp": ("WEBP", ".webp", "image/webp"), "jpeg": ("JPEG", ".jpg", "image/jpeg")}
+
+
+def _resolve_format(requested: str) -> str:
+    if requested != "webp":
+        return "jpeg"
+    try:
+        from PIL import features
+
+        return "webp" if features.check("webp") else "jpeg"
+    except Exception:
+        return "jpeg"
+
+
+def render_thumbnail(source: str, target: str, size: Tuple[int, int], fmt: str, quality: int = THUMB_QUALITY) -> None:
+    """解码源图、按 EXIF 方向摆正、缩放并编码到 target；先写临时文件再改名，读到的缩略图总是完整的"""
+    from PIL import Image, ImageOps
+
+    pil_format = _FORMATS[fmt][0]
+    with Image.open(source) as img:
+        # 与 renditions 一致先摆正手机照片；JPEG 在解码时按需缩小，旋转后宽高互换，按长边请求
+        img.draft("RGB", (max(size), max(size)))
+        img = ImageOps.exif_transpose(img)
+        img.thumbnail(size)
+        if pil_format == "JPEG" or img.mode not in ("RGB", "RGBA"):
+            img = img.convert("RGB" if pil_format == "JPEG" else "RGBA")
+        tmp = f"{target}.{uuid.uuid4().hex}.tmp"
+        try:
+            img.save(tmp, format=pil_format, quality=quality)
+            os.replace(tmp, target)
+        except Exception:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+
+
+class ThumbnailCache:
+    """磁盘缩略图缓存，总大小超过上限时按最近使用顺序淘汰。
+
+    使用顺序只记在内存中，首次使用时按文件修改时间扫描一遍缓存目录恢复。
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        size: Tuple[int, int],
+        fmt: str = THUMB_FORMAT,
+        max_bytes: int = THUMB_CACHE_MAX_BYTES,
+    ) -> None:
+        self.directory = directory
+        self.size = size
+        self.max_bytes = max_bytes
+        self._fmt = fmt
+        self._resolved_fmt: Optional[str] = None
+        self._lock = threading.Lock()
+        self._entries: Optional["OrderedDict[str, int]"] = None
+        self._total = 0
+
+    @property
+    def fmt(self) -> str:
+        if self._resolved_fmt is None:
+            self._resolved_fmt = _resolve_format(self._fmt)
+        return self._resolved_fmt
+
+    @property
+    def media_type(self) -> str:
+        return _FORMATS[self.fmt][2]
+
+    def _load_entries(self) -> "OrderedDict[str, int]":
+        if self._entries is not None:
+            return self._entries
+        found = []
+        if os.path.isdir(self.directory):
+            for entry in os.scandir(self.directory):
+                if entry.is_file() and _NAME_PATTERN.match(entry.name):
+                    stat = entry.stat()
+                    found.append((stat.st_mtime, entry.name, stat.st_size))
+        found.sort()
+        self._entries = OrderedDict((name, size) for _, name, size in found)
+        self._total = sum(self._entries.values())
+        return self._entries
+
+    def key_for(
+        self,
+        source: str,
+        mtime_ns: Optional[int] = None,
+        size: Optional[int] = None,
+        digest: Optional[str] = None,
+    ) -> str:
+        """mtime_ns/size 已知时（如来自媒体索引）不再访问源文件；已知内容哈希时按内容取键，同样的图片只生成一次"""
+        # upright：按 EXIF 方向摆正后生成，区别于此前未摆正的缓存文件
+        spec = f"{self.size[0]}x{self.size[1]}|{self.fmt}|upright"
+        if digest is not None:
+            raw = f"sha256:{digest}|{spec}"
+            return hashlib.sha1(raw.encode("utf-8")).hexdigest()[:32] + _FORMATS[self.fmt][1]
+        if mtime_ns is None or size is None:
+            stat = os.stat(source)
+            mtime_ns, size = stat.st_mtime_ns, stat.st_size
+        raw = f"{os.path.abspath(source)}|{mtime_ns}|{size}|{spec}"
+        return hashlib.sha1(raw.encode("utf-8")).hexdigest()[:32] + _FORMATS[self.fmt][1]
+
+    def path_for(self, name: str) -> Optional[str]:
+        """缓存文件的路径；名称不合法或已被淘汰时返回 None"""
+        if not _NAME_PATTERN.match(name):
+            return None
+        with self._lock:
+            entries = self._load_entries()
+            if name not in entries:
+                return None
+            entries.move_to_end(name)
+        return self.target(name)
+
+    def target(self, name: str) -> str:
+        return os.path.join(self.directory, name)
+
+    def lookup(
+        self,
+        source: str,
+        mtime_ns: Optional[int] = None,
+        size: Optional[int] = None,
+        digest: Optional[str] = None,
+    ) -> Tuple[str, bool]:
+        """返回 (缓存文件名, 是否已生成)，不做任何解码"""
+        name = self.key_for(source, mtime_ns, size, digest)
+        with self._lock:
+            entries = self._load_entries()
+            if name in entries:
+                entries.move_to_end(name)
+                return name, True
+        # 其他进程（如 derivatives.py --rescan）生成的缩略图，登记后直接使用
+        if os.path.isfile(self.target(name)):
+            self.add(name)
+            return name, True
+        return name, False
+
+    def add(self, name: str) -> None:
+        """登记一个已写入缓存目录的缩略图，并按上限淘汰最久未用的"""
+        size = os.path.getsize(self.target(name))
+        evicted = []
+        with self._lock:
+            entries = self._load_entries()
+            self._total += size - entries.pop(name, 0)
+            entries[name] = size
+            while self._total > self.max_bytes and len(entries) > 1:
+                old, old_size = entries.popitem(last=False)
+                self._total -= old_size
+                evicted.append(old)
+        for old in evicted:
+            try:
+                os.remove(self.target(old))
+            except OSError:
+                pass
@@ -0,0 +1,254 @@
+import hashlib
+import json
+import os
+import re
+import time
+import uuid
+from typing import Any, AsyncIterator, Callable, Dict, Optional, Set, Tuple
+
+from fastapi import HTTPException, UploadFile
+from fastapi.concurrency import run_in_threadpool
+
+from content_store import ContentStore, hash_file
+
+# 前端每次 PATCH 发送的建议块大小
+UPLOAD_CHUNK_BYTES = int(os.getenv("UPLOAD_CHUNK_BYTES", str(8 * 1024 * 1024)))
+# 超过该时长没有新数据的未完成上传会在下次创建会话时清理
+UPLOAD_EXPIRE_SECONDS = float(os.getenv("UPLOAD_EXPIRE_SECONDS", str(24 * 3600)))
+# 请求体攒够这么多字节再交给线程池写一次盘
+_WRITE_BUFFER_BYTES = 1024 * 1024
+
+_ID_PATTERN = re.compile(r"^[0-9a-f]{32}$")
+
+
+class UploadSessions:
+    """分块、可续传的上传。
+
+    创建会话时就检查文件名与大小，不合格的上传不会传输任何数据；之后客户端按
+    Upload-Offset 逐块 PATCH，服务端追加到 staging 目录下的 <id>.part，写盘与计算哈希在线程池中进行。
+    会话元数据也写在磁盘上（<id>.json），断线或服务重启后客户端查询偏移即可继续。
+    staging 与媒体目录在同一文件系统上，收齐后按内容哈希存入 ContentStore。
+    """
+
+    def __init__(
+        self,
+        store: ContentStore,
+        accept: Callable[[str], bool],
+        max_bytes: int,
+        label: str = "",
+        staging: Optional[str] = None,
+    ) -> None:
+        self.store = store
+        self.accept = accept
+        self.label = label
+        self.max_bytes = max_bytes
+        self.staging = staging or os.path.join(store.root, ".uploads")
+        # 正在接收数据的会话，同一会话不允许并发写入
+        self._active: Set[str] = set()
+        # 各会话已接收部分的 (字节数, 哈希)；进程重启或换了进程时从 .part 重新计算
+        self._hashers: Dict[str, Tuple[int, "hashlib._Hash"]] = {}
+
+    def check(self, filename: Optional[str], size: Optional[int]) -> str:
+        """校验文件名与声明的大小，返回去掉路径后的文件名"""
+        safe_name = os.path.basename(filename or "")
+        if not safe_name:
+            raise HTTPException(status_code=400, detail="文件名不能为空")
+        if not self.accept(safe_name):
+            raise HTTPException(status_code=400, detail=f"仅支持{self.label}格式")
+        if size is not None and size > self.max_bytes:
+            raise HTTPException(status_code=413, detail=f"文件过大，上限 {self.max_bytes} 字节")
+        return safe_name
+
+    def _paths(self, upload_id: str) -> Tuple[str, str]:
+        if not _ID_PATTERN.match(upload_id):
+            raise HTTPException(status_code=404, detail="上传不存在")
+        base = os.path.join(self.staging, upload_id)
+        return f"{base}.json", f"{base}.part"
+
+    def _load(self, upload_id: str) -> Tuple[Dict[str, Any], str]:
+        meta_path, part_path = self._paths(upload_id)
+        try:
+            with open(meta_path, "r", encoding="utf-8") as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            raise HTTPException(status_code=404, detail="上传不存在或已过期")
+        return meta, part_path
+
+    def _purge_expired(self) -> None:
+        deadline = time.time() - UPLOAD_EXPIRE_SECONDS
+        for entry in os.scandir(self.staging):
+            try:
+                if entry.is_file() and entry.stat().st_mtime < deadline:
+                    os.remove(entry.path)
+                    self._hashers.pop(entry.name.split(".", 1)[0], None)
+            except OSError:
+                pass
+
+    def create(self, filename: str, size: int, replace: bool = False) -> Dict[str, Any]:
+        safe_name = self.check(filename, size)
+        if size <= 0:
+            raise HTTPException(status_code=400, detail="文件大小无效")
+        os.makedirs(self.staging, exist_ok=True)
+        self._purge_expired()
+        upload_id = uuid.uuid4().hex
+        meta_path, part_path = self._paths(upload_id)
+        open(part_path, "wb").close()
+        tmp = f"{meta_path}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"filename": safe_name, "size": size, "replace": replace}, f, ensure_ascii=False)
+        os.replace(tmp, meta_path)
+        return {"upload_id": upload_id, "filename": safe_name, "size": size, "offset": 0, "chunk_size": UPLOAD_CHUNK_BYTES}
+
+    @staticmethod
+    def _offset(meta: Dict[str, Any], part_path: str) -> int:
+        if os.path.exists(part_path):
+            return os.path.getsize(part_path)
+        # 已记下哈希说明 .part 已移入存储，只差最后一步
+        return meta["size"] if meta.get("digest") else 0
+
+    def _current(self, upload_id: str) -> int:
+        meta, part_path = self._load(upload_id)
+        return self._offset(meta, part_path)
+
+    def status(self, upload_id: str) -> Dict[str, Any]:
+        meta, part_path = self._load(upload_id)
+        offset = self._offset(meta, part_path)
+        return {"upload_id": upload_id, "filename": meta["filename"], "size": meta["size"], "offset": offset}
+
+    def abort(self, upload_id: str) -> None:
+        self._hashers.pop(upload_id, None)
+        for path in self._paths(upload_id):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def _hasher(self, upload_id: str, part_path: str, offset: int) -> "hashlib._Hash":
+        cached = self._hashers.get(upload_id)
+        if cached is not None and cached[0] == offset:
+            return cached[1]
+        return hash_file(part_path)
+
+    @staticmethod
+    def _write(target, hasher: "hashlib._Hash", data: bytes) -> None:
+        hasher.update(data)
+        target.write(data)
+
+    def _complete(self, upload_id: str, meta: Dict[str, Any], part_path: str) -> bool:
+        meta_path = self._paths(upload_id)[0]
+        digest = meta.get("digest")
+        if not digest:
+            digest = self._hasher(upload_id, part_path, meta["size"]).hexdigest()
+            # 先把哈希写进元数据：存入途中失败时 .part 可能已移走，重试凭它完成
+            meta["digest"] = digest
+            tmp = f"{meta_path}.tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(meta, f, ensure_ascii=False)
+            os.replace(tmp, meta_path)
+        self._hashers.pop(upload_id, None)
+        stored = self.store.store(part_path, digest, meta["filename"], meta.get("replace", False))
+        os.remove(meta_path)
+        return stored
+
+    async def receive(self, upload_id: str, offset: int, chunks: AsyncIterator[bytes]) -> Dict[str, Any]:
+        """从 offset 处追加请求体，返回 {"offset", "size", "filename", "replace", "complete", "stored"}。
+
+        offset 与服务端已收到的字节数不一致时返回 409，并在 Upload-Offset 头里给出正确的偏移。
+        收齐后 complete 为 True；stored 为 False 表示已有同名文件且未要求替换（或内容相同），保留了原文件。
+        数据已收齐但存入失败的会话，在 offset 等于文件大小处再 PATCH 一次（请求体为空）即重试存入。
+        """
+        if upload_id in self._active:
+            current = await run_in_threadpool(self._current, upload_id)
+            raise HTTPException(
+                status_code=409,
+                detail="该上传正在接收数据",
+                headers={"Upload-Offset": str(current)},
+            )
+        self._active.add(upload_id)
+        try:
+            meta, part_path = await run_in_threadpool(self._load, upload_id)
+            size = meta["size"]
+            current = await run_in_threadpool(self._offset, meta, part_path)
+            if offset != current:
+                raise HTTPException(
+                    status_code=409,
+                    detail=f"偏移不一致，已收到 {current} 字节",
+                    headers={"Upload-Offset": str(current)},
+                )
+
+            written = current
+            if current < size:
+                written = await self._append(upload_id, part_path, size, current, chunks)
+            else:
+                async for chunk in chunks:
+                    if chunk:
+                        raise HTTPException(status_code=413, detail="数据超出声明的文件大小")
+
+            result = {
+                "offset": written,
+                "size": size,
+                "filename": meta["filename"],
+                "replace": meta.get("replace", False),
+                "complete": False,
+                "stored": False,
+            }
+            if written == size:
+                result["stored"] = await run_in_threadpool(self._complete, upload_id, meta, part_path)
+                result["complete"] = True
+            return result
+        finally:
+            self._active.discard(upload_id)
+
+    async def _append(
+        self, upload_id: str, part_path: str, size: int, current: int, chunks: AsyncIterator[bytes]
+    ) -> int:
+        hasher = await run_in_threadpool(self._hasher, upload_id, part_path, current)
+        target = await run_in_threadpool(open, part_path, "ab")
+        buffer = bytearray()
+        written = current
+        try:
+            async for chunk in chunks:
+                if written + len(buffer) + len(chunk) > size:
+                    raise HTTPException(status_code=413, detail="数据超出声明的文件大小")
+                buffer += chunk
+                if len(buffer) >= _WRITE_BUFFER_BYTES:
+                    await run_in_threadpool(self._write, target, hasher, bytes(buffer))
+                    written += len(buffer)
+                    buffer.clear()
+        finally:
+            # 客户端中途断开时已收到的部分照常落盘，续传从这里继续
+            if buffer:
+                await run_in_threadpool(self._write, target, hasher, bytes(buffer))
+                written += len(buffer)
+            await run_in_threadpool(target.close)
+            self._hashers[upload_id] = (written, hasher)
+        return written
+
+    def _save(self, source, safe_name: str, replace: bool) -> bool:
+        os.makedirs(self.staging, exist_ok=True)
+        tmp = os.path.join(self.staging, f"{uuid.uuid4().hex}.part")
+        hasher = hashlib.sha256()
+        try:
+            with open(tmp, "wb") as target:
+                for block in iter(lambda: source.read(_WRITE_BUFFER_BYTES), b""):
+                    self._write(target, hasher, block)
+            return self.store.store(tmp, hasher.hexdigest(), safe_name, replace)
+        except Exception:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+
+    async def save(self, file: UploadFile, replace: bool = False) -> Tuple[str, bool]:
+        """一次性 multipart 上传：校验后在线程池中边拷贝边计算哈希，再存入 ContentStore。
+
+        返回 (文件名, 是否写入)；已有同名文件且 replace 为 False 时保留原文件。
+        """
+        try:
+            safe_name = self.check(file.filename, file.size)
+            try:
+                stored = await run_in_threadpool(self._save, file.file, safe_name, replace)
+            except Exception as exc:
+                raise HTTPException(status_code=500, detail=f"上传失败: {str(exc)}") from exc
+        finally:
+            await file.close()
+        return safe_name, stored
@@ -0,0 +1,104 @@
+import threading
+import time
+from typing import Callable, Dict, Iterable, List, Optional, Tuple, Union
+
+from fastapi import Request, Response
+
+# 与设备无关的资源（天气、金句库等）统一记在这个设备名下
+GLOBAL_DEVICE = "*"
+
+# 允许浏览器缓存，但每次使用前必须带 If-None-Match 回源确认
+REVALIDATE_CACHE_CONTROL = "no-cache"
+
+
+class ContentVersions:
+    """进程内按 (设备, 资源) 维护的内容版本号。
+
+    写接口在数据提交后调用 bump()，读接口据此判断屏幕手里的数据是否已过期，
+    无需访问数据库。版本号取 max(当前值 + 1, 当前毫秒时间)，未写过的资源以进程
+    启动时刻为初值，因此重启后不会回退。
+
+    写入过的资源经 observe() 合并其他进程的通知后，各进程给出相同的版本号；但启动以来
+    没有写入过的资源，各进程的初值是各自的启动时刻并不相同。多进程部署在负载均衡后面时，
+    这类资源的条件请求只有落到同一进程才会命中 304，落到其他进程时照常返回完整响应
+    （只是多传一次，不会返回过期数据）。
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._base = int(time.time() * 1000)
+        self._versions: Dict[Tuple[str, str], int] = {}
+        self._listeners: List[Callable[[str, str, int, bool], None]] = []
+
+    def add_listener(self, listener: Callable[[str, str, int, bool], None]) -> None:
+        """注册变更回调 listener(device, resource, version, remote)，在写入线程中同步调用"""
+        self._listeners.append(listener)
+
+    def _notify(self, device: str, resource: str, version: int, remote: bool) -> None:
+        for listener in list(self._listeners):
+            try:
+                listener(device, resource, version, remote)
+            except Exception:
+                pass
+
+    def bump(self, device: str, resource: str) -> int:
+        with self._lock:
+            key = (device, resource)
+            value = max(self._versions.get(key, self._base) + 1, int(time.time() * 1000))
+            self._versions[key] = value
+        self._notify(device, resource, value, False)
+        return value
+
+    def observe(self, device: str, resource: str, version: int) -> int:
+        """合并其他进程发布的版本号，返回合并后的本地版本。
+
+        每条远端通知都代表一次真实的写入，本地版本总会前进：通知里的版本较新时直接采用，
+        各进程因此一致；不比本地新（如数据库触发器按数据库时钟盖章而该时钟偏慢）时本地加一，
+        宁可多失效一次缓存，也不丢掉这次变更。
+        """
+        with self._lock:
+            key = (device, resource)
+            value = max(version, self._versions.get(key, self._base) + 1)
+            self._versions[key] = value
+        self._notify(device, resource, value, True)
+        return value
+
+    def get(self, device: str, resource: str) -> int:
+        with self._lock:
+            return self._versions.get((device, resource), self._base)
+
+    def combined(self, device: str, resources: Iterable[str], global_resources: Iterable[str] = ()) -> int:
+        """多个资源合成的版本号，任一资源变化都会使其增大"""
+        with self._lock:
+            total = sum(self._versions.get((device, r), self._base) for r in resources)
+            total += sum(self._versions.get((GLOBAL_DEVICE, r), self._base) for r in global_resources)
+            return total
+
+
+def make_etag(version: Union[int, str]) -> str:
+    return f'W/"{version}"'
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """按弱比较规则判断 If-None-Match 是否命中"""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+
+    def opaque(tag: str) -> str:
+        tag = tag.strip()
+        return tag[2:] if tag.startswith("W/") else tag
+
+    target = opaque(etag)
+    return any(opaque(tag) == target for tag in if_none_match.split(","))
+
+
+def conditional_get(request: Request, response: Response, version: Union[int, str]) -> Optional[Response]:
+    """给 GET 响应加上 ETag；客户端缓存仍有效时返回 304 响应，调用方直接将其返回"""
+    etag = make_etag(version)
+    headers = {"ETag": etag, "Cache-Control": REVALIDATE_CACHE_CONTROL}
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+    response.headers.update(headers)
+    return None
@@ -1,14 +1,29 @@
+import json
+import logging
 import os
-import shutil
-from contextlib import asynccontextmanager
-from typing import Dict, Any, List, Optional
+import threading
+from contextlib import asynccontextmanager, contextmanager
+from functools import partial
+from typing import Dict, Any, List, Literal, Optional, Set
 
-import psycopg2
-from fastapi import FastAPI, HTTPException, UploadFile, File, Body, Form
+from fastapi import FastAPI, HTTPException, UploadFile, File, Body, Form, Header, Query, Request, Response
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse
 from psycopg2 import extras
 from pydantic import BaseModel
 
+from content_store import ContentStore
+from db_async import AsyncDatabasePool
+from db_pool import DatabasePool, run_read
+from derivatives import READY, VIDEO_PREVIEW_WORKERS, DerivativeQueue, render_video_preview
+from media_index import MEDIA_MAX_LIMIT, MediaEntry, MediaIndex
+from migrations import migrate
+from uploads import UploadSessions
+from versions import ContentVersions, conditional_get
+
+logger = logging.getLogger(__name__)
+
 DB_CONFIG = {
 	"host": os.getenv("PG_HOST", "localhost"),
 	"user": os.getenv("PG_USER", "kaguya"),
@@ -23,6 +38,7 @@ VIDEO_PUBLIC_BASE = os.getenv("VIDEO_PUBLIC_BASE", "http:///home.kaguya.lysz.sor
 VIDEO_THUMB_SUBDIR = os.getenv("VIDEO_THUMB_SUBDIR", "thumbs")
 VIDEO_PREVIEW_TIME = float(os.getenv("VIDEO_PREVIEW_TIME", "1"))
 VIDEO_PREVIEW_EXT = os.getenv("VIDEO_PREVIEW_EXT", ".jpg")
+VIDEO_MAX_UPLOAD_BYTES = int(os.getenv("VIDEO_MAX_UPLOAD_BYTES", str(4 * 1024 * 1024 * 1024)))
 ALLOWED_VIDEO_EXTENSIONS = {".mp4", ".avi", ".mkv", ".mov", ".wmv", ".flv", ".webm", ".m4v"}
 ALLOWED_IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png", ".gif", ".bmp", ".webp"}
 
@@ -68,31 +84,39 @@ def _ensure_thumb_dir(create_if_missing: bool = False) -> str:
 	raise HTTPException(status_code=500, detail=f"预览图目录不存在: {path}")
 
 
-def _preview_filename(video_filename: str) -> str:
+def _preview_filename(video_filename: str, digest: Optional[str] = None) -> str:
+	"""已知内容哈希时按内容命名，重复的视频共用一张预览图，同名替换后也不会沿用旧图"""
+	if digest is not None:
+		return f"{digest[:32]}{VIDEO_PREVIEW_EXT}"
 	stem, _ = os.path.splitext(os.path.basename(video_filename))
 	return f"{stem}{VIDEO_PREVIEW_EXT}"
 
 
-def _generate_preview(video_path: str, preview_path: str) -> None:
-	try:
-		try:
-			from moviepy import VideoFileClip
-		except Exception:
-			from moviepy.editor import VideoFileClip
-	except Exception as exc:
-		raise HTTPException(status_code=500, detail=f"moviepy 导入失败: {exc}") from exc
-
-	with VideoFileClip(video_path) as clip:
-		duration = getattr(clip, "duration", None) or 0
-		frame_time = VIDEO_PREVIEW_TIME
-		if duration > 0:
-			frame_time = min(frame_time, max(0.0, duration - 0.1))
-		clip.save_frame(preview_path, t=frame_time)
-
 class VideoService:
-	def __init__(self, db_config: Dict[str, Any] = None, db=None) -> None:
+	def __init__(
+		self,
+		db_config: Dict[str, Any] = None,
+		db=None,
+		pool: Optional[DatabasePool] = None,
+		async_pool: Optional[AsyncDatabasePool] = None,
+		versions: Optional[ContentVersions] = None,
+		derivatives: Optional[DerivativeQueue] = None,
+	) -> None:
 		self.db_config = db_config or DB_CONFIG
 		self._external_db = db
+		self._owns_pool = pool is None
+		self.pool = pool or DatabasePool(self.db_config)
+		self._owns_async_pool = async_pool is None
+		self.async_pool = async_pool or AsyncDatabasePool(self.db_config)
+		self.versions = versions or ContentVersions()
+		self.files = MediaIndex(VIDEO_ROOT, _is_video_file)
+		self.store = ContentStore(VIDEO_ROOT)
+		self.uploads = UploadSessions(self.store, _is_video_file, VIDEO_MAX_UPLOAD_BYTES, label="视频")
+		# 已生成的预览图文件名，首次使用时扫描一遍预览图目录，之后由生成完成的回调登记
+		self._previews: Optional[Set[str]] = None
+		self._previews_lock = threading.Lock()
+		self._owns_derivatives = derivatives is None
+		self.derivatives = derivatives or DerivativeQueue(VIDEO_PREVIEW_WORKERS, threads=True)
 		self.app = FastAPI(lifespan=self._lifespan)
 		self._configure_app()
 		self._register_routes()
@@ -102,89 +126,111 @@ class VideoService:
 			CORSMiddleware,
 			allow_origins=["*"],
 			allow_credentials=False,
-			allow_methods=["GET", "POST", "PUT", "OPTIONS"],
+			allow_methods=["GET", "POST", "PUT", "PATCH", "DELETE", "OPTIONS"],
 			allow_headers=["*"],
 		)
 
-	def ensure_table(self, db) -> None:
-		create_sql = """
-		CREATE TABLE IF NOT EXISTS video (
-			url TEXT NOT NULL,
-			device TEXT NOT NULL DEFAULT 'default'
-		);
-		"""
-		drop_pk_sql = """
-		ALTER TABLE video
-		DROP CONSTRAINT IF EXISTS video_pkey
-		"""
-		add_unique_sql = """
-		DO $$
-		BEGIN
-			IF NOT EXISTS (
-				SELECT 1
-				FROM pg_constraint
-				WHERE conname = 'video_device_url_key'
-			) THEN
-				ALTER TABLE video
-				ADD CONSTRAINT video_device_url_key UNIQUE (device, url);
-			END IF;
-		END $$;
-		"""
-		alter_device_sql = """
-		ALTER TABLE video
-		ADD COLUMN IF NOT EXISTS device TEXT NOT NULL DEFAULT 'default'
-		"""
-		drop_is_file_sql = """
-		ALTER TABLE video
-		DROP COLUMN IF EXISTS is_file
-		"""
-		with db.cursor() as cur:
-			cur.execute(create_sql)
-			cur.execute(alter_device_sql)
-			cur.execute(drop_pk_sql)
-			cur.execute(drop_is_file_sql)
-			cur.execute(add_unique_sql)
-
 	@asynccontextmanager
 	async def _lifespan(self, app: FastAPI):
-		created_local = False
-		db = self._external_db
-		if db is None:
-			db = psycopg2.connect(**self.db_config)
-			db.autocommit = True
-			created_local = True
-		self.ensure_table(db)
-		app.state.db = db
+		if self._owns_pool:
+			# 独立运行时自行执行迁移；挂载到 main.py 时由主程序在启动时统一执行
+			with self.get_db() as db:
+				migrate(db)
+		if self._owns_async_pool:
+			await self.async_pool.open()
+		if self._owns_pool:
+			self.files.start()
 		try:
 			yield
 		finally:
-			if created_local:
-				try:
-					db.close()
-				except Exception:
-					pass
-
+			if self._owns_pool:
+				self.files.stop()
+			if self._owns_derivatives:
+				self.derivatives.shutdown()
+			if self._owns_async_pool:
+				await self.async_pool.close()
+			if self._owns_pool:
+				self.pool.close()
+
+	@contextmanager
 	def get_db(self):
-		db = getattr(self.app.state, "db", None)
-		if db is None or getattr(db, "closed", 1) != 0:
-			db = psycopg2.connect(**self.db_config)
-			db.autocommit = True
-			self.app.state.db = db
-			self.ensure_table(db)
-		else:
-			try:
-				with db.cursor() as cur:
-					cur.execute("SELECT 1")
-			except Exception:
-				db = psycopg2.connect(**self.db_config)
-				db.autocommit = True
-				self.app.state.db = db
-				self.ensure_table(db)
-		return db
+		"""按请求从连接池借出连接，离开上下文时归还"""
+		if self._external_db is not None:
+			yield self._external_db
+			return
+		with self.pool.connection() as db:
+			yield db
 
 	def _ensure_device_placeholder(self, db, device: str) -> None:
 		return None
 
+	def _ready_previews(self) -> Set[str]:
+		"""在持有 _previews_lock 时调用"""
+		if self._previews is None:
+			path = _ensure_thumb_dir(create_if_missing=True)
+			self._previews = {entry.name for entry in os.scandir(path) if entry.is_file()}
+		return self._previews
+
+	def _preview_ready(self, preview_name: str) -> None:
+		with self._previews_lock:
+			self._ready_previews().add(preview_name)
+
+	def _preview(self, file_path: str, preview_name: str) -> str:
+		"""预览图的状态，由内存中的记录回答；尚未生成时交给后台的 ffmpeg 截取，列表接口不等待"""
+		with self._previews_lock:
+			if preview_name in self._ready_previews():
+				return READY
+		status = self.derivatives.status(preview_name)
+		if status is not None:
+			return status
+		preview_path = os.path.join(_thumb_dir(), preview_name)
+		# 其他进程（如 derivatives.py --rescan）生成的预览图，登记后直接使用
+		if os.path.isfile(preview_path):
+			self._preview_ready(preview_name)
+			return READY
+		return self.derivatives.submit(
+			preview_name,
+			render_video_preview,
+			file_path,
+			preview_path,
+			VIDEO_PREVIEW_TIME,
+			on_done=partial(self._preview_ready, preview_name),
+		)
+
+	def _ingest(self, filename: str, replaced: bool = False) -> None:
+		"""新文件放入视频目录后登记到索引并开始截取预览图，列表接口无需等待"""
+		entry = self.files.upsert(filename)
+		if entry is None:
+			return
+		self._preview(os.path.join(VIDEO_ROOT, filename), _preview_filename(filename, self.store.digest_of(entry.ino)))
+		if replaced:
+			self._bump_referencing(filename)
+
+	def _bump_referencing(self, filename: str) -> None:
+		"""同名视频被替换后，通知正在使用它的设备重新获取"""
+		try:
+			with self.get_db() as db:
+				with db.cursor() as cur:
+					cur.execute("SELECT device FROM video WHERE url = %s", (_build_public_url(filename),))
+					devices = [row[0] for row in cur.fetchall()]
+		except Exception as e:
+			logger.warning(f"查询使用视频 {filename} 的设备失败: {e}")
+			return
+		for device in devices:
+			self.versions.bump(device, "video")
+
+	def _file_item(self, video_dir: str, entry: MediaEntry) -> Dict[str, Any]:
+		preview_name = _preview_filename(entry.name, self.store.digest_of(entry.ino))
+		status = self._preview(os.path.join(video_dir, entry.name), preview_name)
+		return {
+			"filename": entry.name,
+			"size": entry.size,
+			"modified": entry.modified,
+			"url": _build_public_url(entry.name),
+			"preview": _build_public_url(f"{VIDEO_THUMB_SUBDIR}/{preview_name}") if status == READY else "",
+			"status": status,
+		}
+
 	def _register_routes(self) -> None:
 		app = self.app
 		get_db = self.get_db
@@ -193,10 +239,10 @@ class VideoService:
 			device: str
 			filename: str
 
-		@app.get("/")
-		def get_video(device: str = "default") -> Dict[str, Optional[str]]:
-			try:
-				db = get_db()
+		def read_video(device: str) -> Dict[str, Optional[str]]:
+			"""同步读取路径：异步连接池不可用时使用"""
+
+			def query(db):
 				with db.cursor(cursor_factory=extras.RealDictCursor) as cur:
 					cur.execute(
 						"""
@@ -214,6 +260,32 @@ class VideoService:
 					if row and row["url"]:
 						return {"url": row["url"]}
 					return {"url": None}
+
+			return run_read(get_db, query)
+
+		@app.get("/")
+		async def get_video(request: Request, response: Response, device: str = "default") -> Dict[str, Optional[str]]:
+			not_modified = conditional_get(request, response, self.versions.get(device, "video"))
+			if not_modified is not None:
+				return not_modified
+			try:
+				if self.async_pool.available:
+					row = await self.async_pool.fetchrow(
+						"""
+						SELECT url
+						FROM video
+						WHERE device = %s
+						  AND url <> ''
+						  AND url LIKE 'http%%'
+						ORDER BY ctid DESC
+						LIMIT 1
+						""",
+						(device,),
+					)
+					if row and row["url"]:
+						return {"url": row["url"]}
+					return {"url": None}
+				return await run_in_threadpool(read_video, device)
 			except Exception as e:
 				raise HTTPException(status_code=500, detail=f"查询失败: {str(e)}")
 
@@ -232,84 +304,108 @@ class VideoService:
 
 			full_url = _build_public_url(safe_name)
 			try:
-				db = get_db()
-				with db.cursor() as cur:
-					cur.execute(
-						"""
-						DELETE FROM video
-						WHERE device = %s
-						""",
-						(payload.device,),
-					)
-					cur.execute(
-						"""
-						INSERT INTO video (url, device)
-						VALUES (%s, %s)
-						""",
-						(full_url, payload.device),
-					)
-				return {"url": full_url}
+				with get_db() as db:
+					with db.cursor() as cur:
+						cur.execute(
+							"""
+							DELETE FROM video
+							WHERE device = %s
+							""",
+							(payload.device,),
+						)
+						cur.execute(
+							"""
+							INSERT INTO video (url, device)
+							VALUES (%s, %s)
+							""",
+							(full_url, payload.device),
+						)
+					self.versions.bump(payload.device, "video")
+					return {"url": full_url}
 			except Exception as e:
 				raise HTTPException(status_code=500, detail=f"更新失败: {str(e)}")
 
 		@app.get("/files", summary="获取视频列表", response_description="返回视频列表")
-		def list_videos() -> Dict[str, List[Dict[str, str]]]:
+		def list_videos(
+			offset: int = Query(0, ge=0, description="跳过的条数"),
+			limit: Optional[int] = Query(None, ge=1, le=MEDIA_MAX_LIMIT, description="每页条数，默认返回全部"),
+			sort: Literal["name", "date"] = Query("name", description="按文件名或修改时间排序"),
+			order: Literal["asc", "desc"] = Query("asc"),
+			q: Optional[str] = Query(None, description="文件名包含的关键词"),
+			format: Literal["json", "ndjson"] = Query("json", description="ndjson 时逐行流式输出"),
+		):
 			"""
-			获取视频目录下所有视频的文件名、预览图和视频链接
-			返回格式: {"items": [{"filename": "a.mp4", "url": "http://localhost/Video/a.mp4", "preview": "http://localhost/Video/a.jpg"}]}
+			获取视频目录下视频的文件名、大小、修改时间、预览图和视频链接（来自内存索引）
+			- json: 返回 {"total": 1, "items": [{"filename": "a.mp4", "size": 1, "modified": "...", "url": "http://localhost/Video/a.mp4", "preview": "http://localhost/Video/a.jpg", "status": "ready"}]}
+			- ndjson: 每行一个条目，边生成边输出
+			预览图尚未生成完时 preview 为空字符串，status 为 pending（失败为 failed）
 			"""
 			video_dir = _ensure_video_dir()
-			thumb_dir = _ensure_thumb_dir(create_if_missing=True)
-			items: List[Dict[str, str]] = []
-			for filename in sorted(os.listdir(video_dir)):
-				if not _is_video_file(filename):
-					continue
-				file_path = os.path.join(video_dir, filename)
-				if not os.path.isfile(file_path):
-					continue
-				preview_name = _preview_filename(filename)
-				preview_path = os.path.join(thumb_dir, preview_name)
-				if not os.path.isfile(preview_path):
-					_generate_preview(file_path, preview_path)
-				items.append(
-					{
-						"filename": filename,
-						"url": _build_public_url(filename),
-						"preview": _build_public_url(f"{VIDEO_THUMB_SUBDIR}/{preview_name}") if preview_name else "",
-					}
+			total, entries = self.files.query(offset, limit, sort, order == "desc", q)
+			if format == "ndjson":
+
+				def stream():
+					for entry in entries:
+						yield json.dumps(self._file_item(video_dir, entry), ensure_ascii=False) + "\n"
+
+				return StreamingResponse(
+					stream(), media_type="application/x-ndjson", headers={"X-Total-Count": str(total)}
 				)
-			return {"items": items}
+			return {"total": total, "items": [self._file_item(video_dir, entry) for entry in entries]}
 
 		@app.post("/upload", summary="上传视频到视频目录", response_description="返回上传后的文件名")
 		async def upload_video(
 			device: str = Form(..., description="视频归属标识"),
 			file: UploadFile = File(..., description="上传的视频文件"),
+			replace: bool = Form(False, description="同名文件已存在时是否替换"),
 		) -> Dict[str, str]:
 			"""
-			上传视频到视频目录
+			上传视频到视频目录（一次性上传；大文件请使用 /uploads 分块上传）
+			同名文件已存在且未要求替换时保留原文件
 			返回格式: {"filename": "上传后的文件名"}
 			"""
-			if not file.filename:
-				raise HTTPException(status_code=400, detail="文件名不能为空")
+			safe_name, stored = await self.uploads.save(file, replace)
+			if stored:
+				await run_in_threadpool(self._ingest, safe_name, replace)
+			return {"filename": safe_name}
 
-			safe_name = os.path.basename(file.filename)
-			if not _is_video_file(safe_name):
-				raise HTTPException(status_code=400, detail="仅支持视频格式")
-
-			video_dir = _ensure_video_dir(create_if_missing=True)
-			target_path = os.path.join(video_dir, safe_name)
-			if not os.path.exists(target_path):
-				try:
-					with open(target_path, "wb") as target:
-						shutil.copyfileobj(file.file, target)
-				except Exception as exc:
-					raise HTTPException(status_code=500, detail=f"上传失败: {str(exc)}") from exc
-				finally:
-					await file.close()
-			else:
-				await file.close()
+		class UploadCreate(BaseModel):
+			filename: str
+			size: int
+			replace: bool = False
 
-			return {"filename": safe_name}
+		@app.post("/uploads", summary="创建分块上传", response_description="返回上传 ID 与建议的块大小")
+		def create_upload(payload: UploadCreate) -> Dict[str, Any]:
+			"""
+			创建可续传的上传会话，文件名与大小不合格时直接拒绝（400/413），不传输任何数据
+			返回格式: {"upload_id": "...", "filename": "...", "size": 1, "offset": 0, "chunk_size": 8388608}
+			"""
+			return self.uploads.create(payload.filename, payload.size, payload.replace)
+
+		@app.get("/uploads/{upload_id}", summary="查询上传进度")
+		def get_upload(upload_id: str) -> Dict[str, Any]:
+			"""断线后据 offset 继续上传"""
+			return self.uploads.status(upload_id)
+
+		@app.patch("/uploads/{upload_id}", summary="上传一块数据")
+		async def upload_chunk(
+			upload_id: str,
+			request: Request,
+			upload_offset: int = Header(..., alias="Upload-Offset", ge=0, description="本块在文件中的起始偏移"),
+		) -> Dict[str, Any]:
+			"""
+			请求体为原始字节，从 Upload-Offset 处追加；偏移不一致时返回 409 并在 Upload-Offset 头中给出正确偏移
+			返回格式: {"offset": 1, "size": 1, "filename": "...", "replace": false, "complete": false, "stored": false}
+			"""
+			result = await self.uploads.receive(upload_id, upload_offset, request.stream())
+			if result["stored"]:
+				await run_in_threadpool(self._ingest, result["filename"], result["replace"])
+			return result
+
+		@app.delete("/uploads/{upload_id}", summary="取消上传")
+		def abort_upload(upload_id: str) -> Dict[str, str]:
+			self.uploads.abort(upload_id)
+			return {"upload_id": upload_id}
 
 api = VideoService()
 app = api.app
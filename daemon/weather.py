@@ -1,10 +1,13 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Request, Response
 from contextlib import asynccontextmanager
 import os
 import json
 import requests
 import asyncio
 import logging
+from typing import Any, Dict, Optional
+
+from versions import GLOBAL_DEVICE, ContentVersions, conditional_get
 
 # 配置日志
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
@@ -21,7 +24,10 @@ WEATHER_FILE_3D = os.path.join(BASE_DIR, "weather_3d.json")
 class WeatherService:
     """天气服务模块，每十分钟获取一次天气数据并提供API接口"""
 
-    def __init__(self) -> None:
+    def __init__(self, versions: Optional[ContentVersions] = None) -> None:
+        self.versions = versions or ContentVersions()
+        self._now_cache: Optional[Dict[str, Any]] = None
+        self._now_mtime: Optional[float] = None
         self.app = FastAPI(lifespan=self._lifespan)
         self._configure_app()
         self._register_routes()
@@ -60,6 +66,7 @@ class WeatherService:
             # 存储数据到文件
             with open(WEATHER_FILE_NOW, "w", encoding="utf-8") as f:
                 json.dump(data, f, ensure_ascii=False, indent=2)
+            self.versions.bump(GLOBAL_DEVICE, "weather")
             
             logger.info("当前天气数据获取成功并更新到文件")
         except Exception as e:
@@ -84,13 +91,38 @@ class WeatherService:
         except Exception as e:
             logger.error(f"获取3天天气预报数据失败: {str(e)}")
 
+    def version(self) -> int:
+        """当前天气的版本号，取天气文件的修改时间（毫秒）。
+
+        文件可能由外部程序或其他进程改写，按文件取值各进程一致，改写后立即变化；文件不存在时为 0。
+        """
+        try:
+            return os.stat(WEATHER_FILE_NOW).st_mtime_ns // 1_000_000
+        except OSError:
+            return 0
+
+    def read_now(self) -> Optional[Dict[str, Any]]:
+        """读取当前天气文件，按修改时间缓存解析结果；文件不存在时返回 None"""
+        try:
+            mtime = os.path.getmtime(WEATHER_FILE_NOW)
+        except OSError:
+            return None
+        if self._now_cache is None or self._now_mtime != mtime:
+            with open(WEATHER_FILE_NOW, "r", encoding="utf-8") as f:
+                self._now_cache = json.load(f)
+            self._now_mtime = mtime
+        return self._now_cache
+
     def _register_routes(self) -> None:
         """注册路由"""
         app = self.app
 
         @app.get("/now")
-        async def get_weather_now():
+        async def get_weather_now(request: Request, response: Response):
             """获取当前天气数据"""
+            not_modified = conditional_get(request, response, self.version())
+            if not_modified is not None:
+                return not_modified
             try:
                 if not os.path.exists(WEATHER_FILE_NOW):
                     # 如果文件不存在，立即获取数据
@@ -14,6 +14,7 @@ import axios from 'axios'
 import clsx from 'clsx'
 import { useAuthStore } from '../stores/authStore'
 import { useDeviceStore } from '../stores/deviceStore'
+import { chunkedUpload } from '../utils/chunkedUpload'
 
 const configApi = axios.create({
   baseURL: '/config-api'
@@ -27,6 +28,28 @@ const pictureApi = axios.create({
   baseURL: '/picture-api'
 })
 
+// 缩略图地址相对于图片服务根路径
+const thumbnailUrl = (item) => `${pictureApi.defaults.baseURL}/${item.thumbnail}`
+
+// 逐行读取 NDJSON 响应，每收到一批条目就回调一次，列表可以边下载边渲染
+const fetchNdjson = async (url, onItems) => {
+  const res = await fetch(url)
+  if (!res.ok) throw new Error(`HTTP ${res.status}`)
+  const reader = res.body.getReader()
+  const decoder = new TextDecoder()
+  let buffer = ''
+  for (;;) {
+    const { done, value } = await reader.read()
+    if (done) break
+    buffer += decoder.decode(value, { stream: true })
+    const lines = buffer.split('\n')
+    buffer = lines.pop()
+    const items = lines.filter((line) => line.trim()).map((line) => JSON.parse(line))
+    if (items.length) onItems(items)
+  }
+  if (buffer.trim()) onItems([JSON.parse(buffer)])
+}
+
 export default function NoticeSettings() {
   const [config, setConfig] = useState({ mode: 'default', notice_mode: 'text' })
   const [notice, setNotice] = useState({ title: '', context: '' })
@@ -65,22 +88,32 @@ export default function NoticeSettings() {
     }
   }
 
-  const fetchImages = async () => {
-    setImagesLoading(true)
+  const fetchImages = async (silent = false) => {
+    if (!silent) setImagesLoading(true)
     try {
-      const res = await pictureApi.get(`/files`)
-      setImages(res.data.items || [])
+      const items = []
+      await fetchNdjson(`${pictureApi.defaults.baseURL}/files?format=ndjson`, (batch) => {
+        items.push(...batch)
+        setImages([...items])
+        if (!silent) setImagesLoading(false)
+      })
+      if (!items.length) setImages([])
+      // 缩略图在后台生成，有未完成的条目时稍后静默刷新一次
+      if (items.some((item) => item.status === 'pending')) {
+        setTimeout(() => fetchImages(true), 3000)
+      }
     } catch (err) {
       console.error('获取图片列表失败:', err)
     } finally {
-      setImagesLoading(false)
+      if (!silent) setImagesLoading(false)
     }
   }
 
   const fetchCurrentPicture = async () => {
     try {
       const res = await pictureApi.get(`/?device=${currentDevice?.device_id}`)
-      const url = res.data.url || ''
+      // url 可能是按屏幕尺寸缩放后的文件，original 才是上传的原图
+      const url = res.data.original || res.data.url || ''
       const filename = url.split('/').pop() || ''
       setCurrentPicture(filename)
     } catch (err) {
@@ -94,20 +127,13 @@ export default function NoticeSettings() {
       return
     }
 
+    const exists = images.some((item) => item.filename === file.name)
+    if (exists && !window.confirm('已存在同名图片，是否替换？')) return
+
     setUploading(true)
     setUploadProgress(0)
-    const formData = new FormData()
-    formData.append('file', file)
-    formData.append('device', currentDevice?.device_id)
-
     try {
-      await pictureApi.post('/upload', formData, {
-        headers: { 'Content-Type': 'multipart/form-data' },
-        onUploadProgress: (progressEvent) => {
-          const percentCompleted = Math.round((progressEvent.loaded * 100) / progressEvent.total)
-          setUploadProgress(percentCompleted)
-        }
-      })
+      await chunkedUpload(pictureApi, file, setUploadProgress, exists)
       fetchImages()
       alert('上传成功！')
     } catch (err) {
@@ -484,11 +510,18 @@ export default function NoticeSettings() {
                               : "hover:scale-105"
                           )}
                         >
-                          <img
-                            src={item.thumbnail}
-                            alt={item.filename}
-                            className="w-full h-full object-cover"
-                          />
+                          {item.thumbnail ? (
+                            <img
+                              src={thumbnailUrl(item)}
+                              loading="lazy"
+                              alt={item.filename}
+                              className="w-full h-full object-cover"
+                            />
+                          ) : (
+                            <div className="w-full h-full bg-gray-200 flex items-center justify-center text-xs text-gray-500">
+                              {item.status === 'failed' ? '无法预览' : '生成中…'}
+                            </div>
+                          )}
                           {isCurrent && (
                             <div className="absolute top-1 left-1 px-2 py-0.5 bg-cyan-500 text-white text-xs rounded-full">
                               当前
@@ -508,11 +541,11 @@ export default function NoticeSettings() {
                   </div>
                 )}
 
-                {previewImage && (
+                {previewImage?.thumbnail && (
                   <div className="fixed inset-0 z-[100] flex items-center justify-center p-4 pointer-events-none">
                     <div className="relative glass rounded-2xl p-4 max-w-2xl max-h-[80vh] animate-slide-up shadow-xl">
                       <img
-                        src={previewImage.thumbnail}
+                        src={thumbnailUrl(previewImage)}
                         alt={previewImage.filename}
                         className="max-w-full max-h-[60vh] object-contain rounded-lg"
                       />
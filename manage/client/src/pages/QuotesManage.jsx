@@ -6,7 +6,8 @@ import {
   Trash2,
   X,
   Loader2,
-  Tag
+  Tag,
+  Search
 } from 'lucide-react'
 import axios from 'axios'
 import clsx from 'clsx'
@@ -17,10 +18,16 @@ const api = axios.create({
   baseURL: '/quotes-api'
 })
 
+const PAGE_SIZE = 100
+
 export default function QuotesManage() {
   const [quotes, setQuotes] = useState([])
   const [total, setTotal] = useState(0)
   const [loading, setLoading] = useState(true)
+  const [nextAfterId, setNextAfterId] = useState(null)
+  const [loadingMore, setLoadingMore] = useState(false)
+  const [keyword, setKeyword] = useState('')
+  const [searching, setSearching] = useState(false)
   const [modalOpen, setModalOpen] = useState(false)
   const [modalMode, setModalMode] = useState('add')
   const [formData, setFormData] = useState({ content: '', defination: '', theme: '' })
@@ -33,9 +40,11 @@ export default function QuotesManage() {
 
   const fetchQuotes = async () => {
     try {
-      const res = await api.get(`/list`)
+      const res = await api.get(`/list`, { params: { limit: PAGE_SIZE } })
       setQuotes(res.data.data || [])
       setTotal(res.data.total || 0)
+      setNextAfterId(res.data.next_after_id ?? null)
+      setSearching(false)
     } catch (err) {
       console.error('获取金句失败:', err)
     } finally {
@@ -43,6 +52,41 @@ export default function QuotesManage() {
     }
   }
 
+  const handleSearch = async (e) => {
+    e.preventDefault()
+    const q = keyword.trim()
+    if (!q) {
+      fetchQuotes()
+      return
+    }
+    setLoading(true)
+    try {
+      const res = await api.get(`/search`, { params: { q, limit: 100 } })
+      setQuotes(res.data.data || [])
+      setNextAfterId(null)
+      setSearching(true)
+    } catch (err) {
+      console.error('搜索金句失败:', err)
+    } finally {
+      setLoading(false)
+    }
+  }
+
+  const loadMore = async () => {
+    if (nextAfterId == null || loadingMore) return
+    setLoadingMore(true)
+    try {
+      const res = await api.get(`/list`, { params: { after_id: nextAfterId, limit: PAGE_SIZE } })
+      setQuotes((prev) => [...prev, ...(res.data.data || [])])
+      setTotal(res.data.total || 0)
+      setNextAfterId(res.data.next_after_id ?? null)
+    } catch (err) {
+      console.error('获取金句失败:', err)
+    } finally {
+      setLoadingMore(false)
+    }
+  }
+
   useEffect(() => {
     if (currentDevice) {
       fetchQuotes()
@@ -120,7 +164,9 @@ export default function QuotesManage() {
       <div className="flex flex-col sm:flex-row sm:items-center justify-between gap-4">
         <div>
           <h1 className="text-2xl font-bold text-gray-800">每日金句管理</h1>
-          <p className="text-gray-500 mt-1">共 {total} 条金句</p>
+          <p className="text-gray-500 mt-1">
+            {searching ? `找到 ${quotes.length} 条相关金句` : `共 ${total} 条金句`}
+          </p>
         </div>
         {isAdmin && (
           <button onClick={openAddModal} className="btn-primary flex items-center gap-2 self-start">
@@ -130,6 +176,17 @@ export default function QuotesManage() {
         )}
       </div>
 
+      <form onSubmit={handleSearch} className="relative">
+        <Search className="w-4 h-4 text-gray-400 absolute left-4 top-1/2 -translate-y-1/2" />
+        <input
+          type="text"
+          value={keyword}
+          onChange={(e) => setKeyword(e.target.value)}
+          className="input-field pl-11"
+          placeholder="搜索金句内容或释义，回车确认"
+        />
+      </form>
+
       {loading ? (
         <div className="flex items-center justify-center py-20">
           <Loader2 className="w-8 h-8 animate-spin text-purple-500" />
@@ -186,6 +243,19 @@ export default function QuotesManage() {
         </div>
       )}
 
+      {!loading && nextAfterId != null && (
+        <div className="flex justify-center">
+          <button
+            onClick={loadMore}
+            disabled={loadingMore}
+            className="px-6 py-3 bg-gray-100 rounded-xl text-gray-600 font-medium hover:bg-gray-200 transition-all flex items-center gap-2"
+          >
+            {loadingMore && <Loader2 className="w-4 h-4 animate-spin" />}
+            <span>加载更多</span>
+          </button>
+        </div>
+      )}
+
       {modalOpen && (
         <div className="fixed inset-0 z-50 flex items-center justify-center p-4">
           <div className="absolute inset-0 bg-black/50 backdrop-blur-sm" onClick={() => setModalOpen(false)} />
@@ -13,6 +13,7 @@ import axios from 'axios'
 import clsx from 'clsx'
 import { useAuthStore } from '../stores/authStore'
 import { useDeviceStore } from '../stores/deviceStore'
+import { chunkedUpload } from '../utils/chunkedUpload'
 
 const configApi = axios.create({
   baseURL: '/config-api'
@@ -49,15 +50,20 @@ export default function VideoMode() {
     }
   }
 
-  const fetchVideos = async () => {
-    setVideosLoading(true)
+  const fetchVideos = async (silent = false) => {
+    if (!silent) setVideosLoading(true)
     try {
       const res = await videoApi.get(`/files?device=${currentDevice?.device_id}`)
-      setVideos(res.data.items || [])
+      const items = res.data.items || []
+      setVideos(items)
+      // 预览图在后台生成，有未完成的条目时稍后静默刷新一次
+      if (items.some((item) => item.status === 'pending')) {
+        setTimeout(() => fetchVideos(true), 3000)
+      }
     } catch (err) {
       console.error('获取视频列表失败:', err)
     } finally {
-      setVideosLoading(false)
+      if (!silent) setVideosLoading(false)
     }
   }
 
@@ -78,20 +84,13 @@ export default function VideoMode() {
       return
     }
 
+    const exists = videos.some((item) => item.filename === file.name)
+    if (exists && !window.confirm('已存在同名视频，是否替换？')) return
+
     setUploading(true)
     setUploadProgress(0)
-    const formData = new FormData()
-    formData.append('file', file)
-    formData.append('device', currentDevice?.device_id)
-
     try {
-      await videoApi.post('/upload', formData, {
-        headers: { 'Content-Type': 'multipart/form-data' },
-        onUploadProgress: (progressEvent) => {
-          const percentCompleted = Math.round((progressEvent.loaded * 100) / progressEvent.total)
-          setUploadProgress(percentCompleted)
-        }
-      })
+      await chunkedUpload(videoApi, file, setUploadProgress, exists)
       fetchVideos()
       alert('上传成功！')
     } catch (err) {
@@ -0,0 +1,69 @@
+// 分块、可续传上传：先创建会话（服务端此时就校验格式与大小），再按偏移逐块 PATCH。
+// 会话 ID 按文件记在 localStorage 中，断网或刷新页面后重新选择同一个文件即从断点继续。
+const MAX_RETRIES = 3
+
+const sessionKey = (api, file) =>
+  `upload:${api.defaults.baseURL}:${file.name}:${file.size}:${file.lastModified}`
+
+const sleep = (ms) => new Promise((resolve) => setTimeout(resolve, ms))
+
+const resumeSession = async (api, key) => {
+  const uploadId = localStorage.getItem(key)
+  if (!uploadId) return null
+  try {
+    const res = await api.get(`/uploads/${uploadId}`)
+    return res.data
+  } catch {
+    localStorage.removeItem(key)
+    return null
+  }
+}
+
+// replace 为 true 时替换同名文件；否则同名文件已存在时保留原文件
+export async function chunkedUpload(api, file, onProgress, replace = false) {
+  const key = sessionKey(api, file)
+  let session = await resumeSession(api, key)
+  if (!session) {
+    const res = await api.post('/uploads', { filename: file.name, size: file.size, replace })
+    session = res.data
+    localStorage.setItem(key, session.upload_id)
+  }
+
+  const chunkSize = session.chunk_size || 8 * 1024 * 1024
+  let offset = session.offset
+  let result = null
+  let failures = 0
+  // 数据收齐后服务端才存入；续传时若已全部收到，也要在末尾偏移处发一次空 PATCH 完成存入
+  while (!result?.complete) {
+    const start = offset
+    try {
+      const res = await api.patch(`/uploads/${session.upload_id}`, file.slice(start, start + chunkSize), {
+        headers: { 'Content-Type': 'application/octet-stream', 'Upload-Offset': String(start) },
+        onUploadProgress: (e) => onProgress?.(Math.round(((start + e.loaded) * 100) / file.size))
+      })
+      result = res.data
+      offset = result.offset
+      failures = 0
+    } catch (err) {
+      const status = err.response?.status
+      const serverOffset = err.response?.headers?.['upload-offset']
+      if (status === 409 && serverOffset !== undefined) {
+        offset = Number(serverOffset)
+        // 偏移没有变化说明另一个请求仍在写入该会话，稍等再试
+        if (offset === start) {
+          if (++failures > MAX_RETRIES) throw err
+          await sleep(1000 * failures)
+        }
+        continue
+      }
+      if ((status && status < 500) || ++failures > MAX_RETRIES) throw err
+      await sleep(1000 * failures)
+      // 断开前已落盘的部分不再重传
+      const current = await resumeSession(api, key)
+      if (current) offset = current.offset
+    }
+  }
+  localStorage.removeItem(key)
+  onProgress?.(100)
+  return result
+}
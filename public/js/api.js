@@ -10,7 +10,7 @@
         const mergedOptions = {
             ...options,
             signal: controller.signal,
-            cache: 'no-store'
+            cache: 'no-cache'
         };
         
         return fetch(url, mergedOptions).finally(() => clearTimeout(timeoutId));
@@ -51,8 +51,119 @@
         });
     }
     
+    let eventSource = null;
+    const changeHandlers = [];
+    
+    function onServerChange(handler) {
+        changeHandlers.push(handler);
+        if (eventSource || typeof EventSource === 'undefined') return;
+        
+        eventSource = new EventSource(buildUrl('/events', window.getDeviceCode()));
+        eventSource.addEventListener('change', (e) => {
+            let data = null;
+            try {
+                data = JSON.parse(e.data);
+            } catch (err) {
+                return;
+            }
+            for (const fn of changeHandlers) {
+                try {
+                    fn(data);
+                } catch (err) {
+                    console.warn('变更事件处理失败', err);
+                }
+            }
+        });
+    }
+    
+    // 整屏状态：各模块只订阅，由一次 /screen/state 请求取齐；带上 since，未变化时服务端只回 {"changed": false}
+    const STATE_REFRESH_MS = 60 * 1000;
+    let screenState = null;
+    let stateVersion = null;
+    let stateLoading = null;
+    let stateStarted = false;
+    const stateParams = {};
+    const stateHandlers = [];
+    
+    function callStateHandlers(state, error) {
+        for (const entry of stateHandlers) {
+            const fn = error ? entry.onError : entry.handler;
+            if (!fn) continue;
+            try {
+                fn(error || state);
+            } catch (err) {
+                console.warn('整屏状态处理失败', err);
+            }
+        }
+    }
+    
+    async function fetchScreenState() {
+        const query = new URLSearchParams(stateParams);
+        if (stateVersion !== null) query.set('since', stateVersion);
+        const res = await apiGet(`/screen/state?${query}`, 8000);
+        if (!res.ok) throw new Error(`status ${res.status}`);
+        const data = await res.json();
+        if (!data.changed) return;
+        stateVersion = data.version;
+        screenState = data;
+        callStateHandlers(data, null);
+    }
+    
+    function refreshScreenState() {
+        // 同一时刻只有一个请求在途
+        if (!stateLoading) {
+            stateLoading = fetchScreenState()
+                .catch((err) => {
+                    console.warn('整屏状态获取失败', err);
+                    callStateHandlers(null, err);
+                })
+                .finally(() => {
+                    stateLoading = null;
+                });
+        }
+        return stateLoading;
+    }
+    
+    function startScreenState() {
+        if (stateStarted) return;
+        stateStarted = true;
+        // 等各模块在 DOMContentLoaded 中订阅完、报好图片区域尺寸后再发第一个请求
+        const first = () => setTimeout(refreshScreenState, 0);
+        if (document.readyState === 'loading') {
+            document.addEventListener('DOMContentLoaded', first, { once: true });
+        } else {
+            first();
+        }
+        setInterval(refreshScreenState, STATE_REFRESH_MS);
+        onServerChange(() => refreshScreenState());
+    }
+    
+    // handler(state) 在整屏状态变化时调用；onError(err) 在请求失败时调用
+    function onScreenState(handler, onError) {
+        stateHandlers.push({ handler, onError });
+        if (screenState) {
+            try {
+                handler(screenState);
+            } catch (err) {
+                console.warn('整屏状态处理失败', err);
+            }
+        }
+        startScreenState();
+    }
+    
+    // 附加查询参数（如图片区域的 width / height）；参数变了需要完整重新拉取
+    function setScreenStateParams(params) {
+        Object.assign(stateParams, params);
+        stateVersion = null;
+        if (screenState) refreshScreenState();
+    }
+    
     window.apiRequest = apiRequest;
     window.apiGet = apiGet;
     window.apiPost = apiPost;
+    window.onServerChange = onServerChange;
+    window.onScreenState = onScreenState;
+    window.refreshScreenState = refreshScreenState;
+    window.setScreenStateParams = setScreenStateParams;
     window.API_BASE = API_BASE;
 })();
@@ -1,9 +1,11 @@
 async function initDays() {
   const ROTATE_MS = 5 * 1000;
+  let rotateTimer = null;
+  let midnightTimer = null;
 
   const byDate = (items) =>
     items
-      .map((x) => ({ content: x.content, time: x.time }))
+      .map((x) => ({ content: x.content, time: x.time, days_left: x.days_left }))
       .filter((x) => x.content && x.time)
       .sort((a, b) => new Date(a.time) - new Date(b.time));
 
@@ -23,28 +25,28 @@ async function initDays() {
       ui.date.textContent = '目标日：--';
     } else {
       ui.label.innerHTML = `距 ${item.content} 还有`;
-      ui.value.textContent = daysLeft(item.time);
+      ui.value.textContent = item.days_left ?? daysLeft(item.time);
       ui.date.textContent = `目标日：${item.time}`;
     }
   }
 
-  async function load() {
+  let shown;
+
+  function show(days) {
+    // 整屏状态里其他部分变化时倒数日不变，不打断轮播
+    const key = JSON.stringify(days);
+    if (key === shown) return;
+    shown = key;
     const card = document.getElementById('countdown-card');
     const label = document.getElementById('countdown-label');
     const valueEl = document.getElementById('countdown-value');
     const dateEl = document.getElementById('countdown-date');
     if (!card || !label || !valueEl || !dateEl) return;
 
-    let list = [];
-    try {
-      const res = await apiGet('/days/', 8000);
-      if (!res.ok) throw new Error(`status ${res.status}`);
-      const data = await res.json();
-      list = Array.isArray(data) ? byDate(data) : [];
-    } catch (e) {
-      console.warn('倒数日获取失败', e);
-    }
+    // 已过期的不再显示
+    const list = Array.isArray(days) ? byDate(days.filter((x) => !x.is_past)) : [];
 
+    if (rotateTimer) clearInterval(rotateTimer);
     if (!list.length) {
       render(null, { card, label, value: valueEl, date: dateEl });
       return;
@@ -57,9 +59,22 @@ async function initDays() {
       idx += 1;
     };
     tick();
-    setInterval(tick, ROTATE_MS);
+    rotateTimer = setInterval(tick, ROTATE_MS);
+  }
+
+  // 剩余天数由服务端按天计算，整屏版本计入了日期，过零点后立即重新拉取
+  function scheduleMidnightRefresh() {
+    if (midnightTimer) clearTimeout(midnightTimer);
+    const now = new Date();
+    const next = new Date(now);
+    next.setHours(24, 0, 5, 0);
+    midnightTimer = setTimeout(async () => {
+      await refreshScreenState();
+      scheduleMidnightRefresh();
+    }, next.getTime() - now.getTime());
   }
 
-  window.initDays = load;
-  return load();
+  window.initDays = refreshScreenState;
+  scheduleMidnightRefresh();
+  onScreenState((state) => show(state.days), (e) => console.warn('倒数日获取失败', e));
 }
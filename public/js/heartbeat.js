@@ -0,0 +1,41 @@
+(function() {
+    'use strict';
+
+    const CLIENT_VERSION = '1.0.0';
+    const HEARTBEAT_INTERVAL = 30 * 1000;
+
+    let frames = 0;
+    let frameWindowStart = performance.now();
+
+    function countFrame() {
+        frames++;
+        requestAnimationFrame(countFrame);
+    }
+
+    function takeFps() {
+        const now = performance.now();
+        const elapsed = now - frameWindowStart;
+        const fps = elapsed > 0 ? Math.round(frames * 10000 / elapsed) / 10 : null;
+        frames = 0;
+        frameWindowStart = now;
+        return fps;
+    }
+
+    function currentMode() {
+        const page = window.location.pathname.split('/').pop() || 'index.html';
+        return page.replace(/\.html$/, '');
+    }
+
+    function sendHeartbeat() {
+        window.apiPost('/device/heartbeat', {
+            device: window.getDeviceCode(),
+            mode: currentMode(),
+            client_version: CLIENT_VERSION,
+            fps: takeFps()
+        }, 5000).catch(() => {});
+    }
+
+    requestAnimationFrame(countFrame);
+    setTimeout(sendHeartbeat, 5000);
+    setInterval(sendHeartbeat, HEARTBEAT_INTERVAL);
+})();
@@ -10,37 +10,30 @@ function initNotice(){
 			.replace(/'/g, '&#39;');
 	}
 
-	async function loadNotice(){
+	let fallback = null;
+	let shown;
+
+	function showNotice(data){
+		// 整屏状态里其他部分变化时通知内容不变，不重建滚动列表
+		const key = JSON.stringify(data);
+		if (key === shown) return;
+		shown = key;
+
 		const titleEl = document.querySelector('.notice-title');
 		const textBox = document.querySelector('.notice-text');
 		if (!titleEl || !textBox) {
 			console.warn('未找到通知容器');
 			return;
 		}
+		if (fallback === null) fallback = textBox.innerHTML;
 
-		const fallback = textBox.innerHTML;
-		let ok = false;
 		let items = [];
+		if (data && typeof data.title === 'string') titleEl.textContent = data.title;
+		const context = data && typeof data.context === 'string' ? data.context : '';
+		if (context) items = [context];
 
-		try {
-			const res = await apiGet('/notice/', 60000);
-			if (!res.ok) throw new Error('fetch failed');
-			const data = await res.json();
-
-			if (typeof data.title === 'string') titleEl.textContent = data.title;
-			const context = typeof data.context === 'string' ? data.context : '';
-			if (context){
-				items = [context];
-				ok = true;
-			}
-		} catch(e) {
-			console.warn('通知接口不可用或被CORS拦截，保留占位内容');
-			textBox.innerHTML = fallback;
-			return;
-		}
-
-		if (!ok){
-			console.warn('通知接口不可用或被CORS拦截，保留占位内容');
+		if (!items.length){
+			console.warn('整屏状态中没有通知内容，保留占位内容');
 			textBox.innerHTML = fallback;
 			return;
 		}
@@ -115,14 +108,14 @@ function initNotice(){
 		if (next <= now) next.setDate(next.getDate() + 1);
 		const delay = next.getTime() - now.getTime();
 		dailyTimer = setTimeout(async () => {
-			await loadNotice();
+			await refreshScreenState();
 			scheduleDailyRefresh();
 		}, delay);
 	}
 
 	function boot(){
-		loadNotice();
 		scheduleDailyRefresh();
+		onScreenState((state) => showNotice(state.notice));
 	}
 
 	if (document.readyState === 'loading') {
@@ -1,36 +1,65 @@
 function initPicture(){
-	async function loadPicture(){
+	let fallback = null;
+	let shown;
+
+	function showPicture(data){
+		// 整屏状态里其他部分变化时图片不变，不重新加载
+		const key = JSON.stringify(data);
+		if (key === shown) return;
+		shown = key;
+
 		const box = document.querySelector('.notice-text');
 		if (!box){
 			console.warn('未找到通知容器');
 			return;
 		}
 
-		const fallback = box.innerHTML;
 		try {
-			const res = await apiGet('/picture/', 8000);
-			if (!res.ok) throw new Error('fetch failed');
-			const data = await res.json();
-			const picUrl = typeof data.url === 'string' ? data.url : '';
+			const picUrl = data && typeof data.url === 'string' ? data.url : '';
 			if (!picUrl) throw new Error('no url');
 
-			box.innerHTML = '';
 			const img = document.createElement('img');
-			img.src = picUrl;
 			img.alt = '通知图片';
 			img.className = 'notice-img';
-			box.appendChild(img);
-
-			return;
+			if (data.placeholder) {
+				// 先显示模糊占位图，完整图片加载完再替换
+				box.innerHTML = '';
+				img.src = data.placeholder;
+				img.style.filter = 'blur(12px)';
+				box.appendChild(img);
+				const full = new Image();
+				full.onload = () => {
+					img.src = picUrl;
+					img.style.filter = '';
+				};
+				full.src = picUrl;
+			} else {
+				box.innerHTML = '';
+				img.src = picUrl;
+				box.appendChild(img);
+			}
 		} catch (e) {
-			console.warn('图片通知接口不可用或缺少url，保留占位内容');
+			console.warn('整屏状态中没有图片，保留占位内容');
 			box.innerHTML = fallback;
 		}
 	}
 
+	function boot(){
+		const box = document.querySelector('.notice-text');
+		if (box){
+			fallback = box.innerHTML;
+			// 按容器的实际像素尺寸请求，服务端挑选合适的显示尺寸
+			const ratio = window.devicePixelRatio || 1;
+			const width = Math.round((box.clientWidth || window.innerWidth) * ratio);
+			const height = Math.round((box.clientHeight || window.innerHeight) * ratio);
+			setScreenStateParams({ width, height });
+		}
+		onScreenState((state) => showPicture(state.picture));
+	}
+
 	if (document.readyState === 'loading') {
-		document.addEventListener('DOMContentLoaded', loadPicture, { once: true });
+		document.addEventListener('DOMContentLoaded', boot, { once: true });
 	} else {
-		loadPicture();
+		boot();
 	}
 }
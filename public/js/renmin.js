@@ -54,21 +54,8 @@ async function initRenmin() {
     themeLineEl.innerHTML = `<strong>使用主题：</strong>${display}`;
   };
 
-  try {
-    const res = await apiGet('/renmin/', 8000);
-    if (!res.ok) throw new Error(`HTTP ${res.status}`);
-
-    let data;
-    try {
-      data = await res.json();
-    } catch (_) {
-      throw new Error('Invalid JSON');
-    }
-
-    const payload = (data && typeof data === 'object' && data.data && typeof data.data === 'object')
-      ? data.data
-      : data;
-
+  // 金句随整屏状态一起抽取，状态每次变化都会换一条
+  const showQuote = (payload) => {
     const content = payload?.content ?? null;
     const def = payload?.defination ?? null;
     const theme = payload?.theme ?? '';
@@ -80,20 +67,19 @@ async function initRenmin() {
     }
 
     if (meaningEl) {
-      if (!isBlank(def)) {
+      if (content != null && !isBlank(def)) {
         setMeaning(def);
-      } else {
+      } else if (content != null) {
         // 成功但释义为空：不显示“释义：”和其内容
         meaningEl.innerHTML = '';
+      } else if (fallbackMeaningHTML != null) {
+        meaningEl.innerHTML = fallbackMeaningHTML;
       }
     }
 
     // 主题行
-    setTheme(theme);
-  } catch (err) {
-    console.warn('加载每日金句失败', err);
-    quoteEl.innerHTML = fallbackQuoteHTML;
-    if (meaningEl && fallbackMeaningHTML != null) meaningEl.innerHTML = fallbackMeaningHTML;
-    if (themeLineEl) themeLineEl.innerHTML = '';
-  }
+    setTheme(content != null ? theme : '');
+  };
+
+  onScreenState((state) => showQuote(state.quote), (err) => console.warn('加载每日金句失败', err));
 }
\ No newline at end of file
@@ -1,6 +1,4 @@
 async function initWeather() {
-  const API_URL = 'http://daemon.api.kaguya.lysz.sorasaku.vip:9000/weather/now';
-  const API_KEY = '7ff913a997ea42d5bd3bd8d1840aa0e5';
   const STATUS_URL = 'xiaomi_weather_status.json';
   const ICON_BASE = 'img/weather';
   const FALLBACK_CODE = 99;
@@ -9,7 +7,7 @@ async function initWeather() {
   const fetchWithTimeout = (url, ms = 8000, options = {}) => {
     const ctrl = new AbortController();
     const timer = setTimeout(() => ctrl.abort(), ms);
-    return fetch(url, { signal: ctrl.signal, cache: 'no-store', ...options }).finally(() => clearTimeout(timer));
+    return fetch(url, { signal: ctrl.signal, cache: 'no-cache', ...options }).finally(() => clearTimeout(timer));
   };
 
   async function loadStatusMap() {
@@ -76,7 +74,10 @@ async function initWeather() {
     card.classList.add(isDay ? 'day' : 'night');
   }
 
-  async function loadWeather() {
+  let statusMap = null;
+
+  // 天气随整屏状态一起下发（版本计入了天气文件的修改时间），这里只负责渲染
+  async function showWeather(payload) {
     setWeatherBackground(); // 每次刷新天气时同步切换背景
 
     const icon = document.getElementById('weather-icon');
@@ -84,25 +85,19 @@ async function initWeather() {
     const desc = document.getElementById('weather-desc');
     if (!icon || !temp || !desc) return;
 
-    let statusMap = new Map();
-    try {
-      statusMap = await loadStatusMap();
-    } catch (e) {
-      console.warn('天气状态码映射获取失败', e);
+    if (!statusMap) {
+      try {
+        statusMap = await loadStatusMap();
+      } catch (e) {
+        console.warn('天气状态码映射获取失败', e);
+        statusMap = new Map();
+      }
     }
 
     try {
-      const weatherRes = await fetchWithTimeout(API_URL, 8000, {
-        headers: { 'X-QW-Api-Key': API_KEY },
-      });
-      if (!weatherRes.ok) throw new Error(`api status ${weatherRes.status}`);
-
-      const weatherData = await weatherRes.json();
-      const current = parseCurrent(weatherData);
+      const current = parseCurrent(payload);
       if (!current) throw new Error('missing current');
       applyWeather({ icon, temp, desc }, statusMap, current);
-
-      // Alerts removed per request
     } catch (e) {
       console.warn('天气获取失败，保留占位', e);
       if (temp) temp.textContent = '--°';
@@ -112,8 +107,9 @@ async function initWeather() {
   }
 
   window.initWeather = function () {
-    loadWeather();
-    setInterval(loadWeather, REFRESH_MS);
+    onScreenState((state) => showWeather(state.weather));
+    // 日夜背景按时间切换，与数据是否变化无关
+    setInterval(setWeatherBackground, REFRESH_MS);
   };
 
   return window.initWeather();